@@ -6,6 +6,8 @@ from io import BytesIO
 from PIL import Image
 import pytz
 import holidays
+import numpy as np
+from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 import threading
 from streamlit import session_state as ss
@@ -54,24 +56,19 @@ def state_codes():
     }
     return codes
 
-def get_public_holidays(state):
-    national = holidays.Australia()
-    state_hols = holidays.Australia(subdiv=state)
+HOLIDAY_YEARS = range(date.today().year - 5, date.today().year + 6)
 
-    combined = holidays.HolidayBase()
-    combined.update(national)
-    combined.update(state_hols)
-    return combined
+@lru_cache(maxsize=None)
+def get_public_holidays(state):
+    # National holidays are included in the state's, built once per state for HOLIDAY_YEARS.
+    return holidays.Australia(subdiv=state, years=HOLIDAY_YEARS)
 
 def check_dates_for_hols(date_range, holidays):
-    holidays_in_range = set()
-    date_iter = date_range[0]
-    date_end = date_range[1] + timedelta(days=1)
-    while date_iter != date_end:
-        if date_iter in holidays:
-            holidays_in_range.add(date_iter)
-        date_iter += timedelta(days=1)
-    return holidays_in_range
+    for year in range(date_range[0].year, date_range[1].year + 1):
+        date(year, 1, 1) in holidays # populates the year if it isn't already
+    holiday_dates = np.array(list(holidays.keys()), dtype='datetime64[D]')
+    dates = np.arange(np.datetime64(date_range[0], 'D'), np.datetime64(date_range[1], 'D') + 1)
+    return {d.item() for d in dates[np.isin(dates, holiday_dates)]}
 
 def get_data_service(state):
     state_code = state_codes()[state]
@@ -141,6 +138,45 @@ def convert_df_for_download(df):
     return df.to_csv(index=False).encode("utf-8")
 
 
+def chunk_list(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def get_primary_techs_by_job(state, jobs, chunk_size=50, max_workers=4):
+    """
+    Returns {job id: [assigned technician names]} for the given jobs.
+
+    Jobs with at most two appointments are resolved through their first and last
+    appointment IDs, in chunked bulk requests. Jobs with more appointments fall
+    back to one request per job.
+    """
+    check_and_update_ss_for_data_service(state)
+    data_service = ss[f'st_data_service_{state}']
+
+    appt_ids = set()
+    many_appt_job_ids = []
+    for job in jobs:
+        if job.get('appointmentCount', 0) <= 2:
+            appt_ids.update(str(appt_id) for appt_id in (job.get('firstAppointmentId'), job.get('lastAppointmentId')) if appt_id)
+        else:
+            many_appt_job_ids.append(job['id'])
+
+    def fetch_chunk(ids):
+        return data_service.get_api_data('dispatch', 'appointment-assignments', options={'appointmentIds': ','.join(ids)})
+
+    techs_by_job = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        for appt_assmnts in ex.map(fetch_chunk, chunk_list(sorted(appt_ids), chunk_size)):
+            for appt in appt_assmnts:
+                techs_by_job.setdefault(appt['jobId'], []).append(appt['technicianName'])
+        for job_id, appt_assmnts in zip(many_appt_job_ids, ex.map(data_service.get_appointment_assignments_by_job_id, many_appt_job_ids)):
+            techs_by_job[job_id] = [appt['technicianName'] for appt in appt_assmnts]
+    return techs_by_job
+
+def localise_st_dates(values, state, fmt):
+    """Convert a column of ServiceTitan UTC timestamps to local date strings. Missing values stay missing."""
+    local = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format='ISO8601', errors='coerce').dt.tz_convert(ss[f'st_data_service_{state}'].timezone)
+    return local.dt.strftime(fmt).where(local.notna(), None)
+
 def get_commission_data(state, start_date, end_date):
 
     app_guid = get_secret('ST_servco_integrations_guid')
@@ -149,20 +185,22 @@ def get_commission_data(state, start_date, end_date):
     # Payment type???
     # Do they get comms if its just the call out fee?
 
-    def format_job(job, technicians):
-        if 116255355 in job['tagTypeIds'] or job['jobStatus'] == 'Canceled': # Unsuccessful or cancelled 
+    def skip_job(job):
+        return 116255355 in job['tagTypeIds'] or job['jobStatus'] == 'Canceled' # Unsuccessful or cancelled 
+
+    def format_job(job, technicians, primary_techs):
+        if skip_job(job):
             return None
         formatted = {}
         if job['soldById'] is not None:
             formatted['Sold By'] = technicians[job['soldById']]
         else:
-            appts = ss[f'st_data_service_{state}'].get_appointment_assignments_by_job_id(job['id'])
-            formatted['Sold By'] = ','.join([appt['technicianName'] for appt in appts]) + ' (Primary Tech)'
+            formatted['Sold By'] = ','.join(primary_techs.get(job['id'], [])) + ' (Primary Tech)'
         # formatted['Sold By'] = technicians[job['soldById']] if job['soldById'] is not None else "None"
         # formatted['Primary Technician'] = invoice['customer']['name']
         # formatted['Created Date'] = job['createdOn'] if job['createdOn'] is not None else "None"
-        formatted['Created Date'] = sp.convert_utc_datetime_to_local(sp.convert_ST_datetime_to_object(job['createdOn']), "Australia/Sydney").strftime("%m/%d/%Y")
-        formatted['Completion Date'] = sp.convert_utc_datetime_to_local(sp.convert_ST_datetime_to_object(job['completedOn']), "Australia/Sydney").strftime("%m/%d/%Y") if job['completedOn'] is not None else "None"
+        formatted['Created Date'] = job['createdOn']
+        formatted['Completion Date'] = job['completedOn']
         formatted['Job #'] = job['jobNumber'] if job['jobNumber'] is not None else "None"
         # formatted['Suburb'] = job['subTotal']
         # formatted['Jobs Subtotal'] = "GST on Income"
@@ -205,9 +243,15 @@ def get_commission_data(state, start_date, end_date):
     technicians = format_employee_list(technicians_response)
 
     job_response = ss[f'st_data_service_{state}'].get_jobs_created_between(start_time, end_time, app_guid=app_guid)
-    jobs_w_nones = [format_job(job, technicians) for job in job_response]
+    unsold_jobs = [job for job in job_response if job['soldById'] is None and not skip_job(job)]
+    primary_techs = get_primary_techs_by_job(state, unsold_jobs)
+    jobs_w_nones = [format_job(job, technicians, primary_techs) for job in job_response]
     jobs = [job for job in jobs_w_nones if job is not None]
     jobs_df = pd.DataFrame(jobs)
+    if not jobs_df.empty:
+        # Convert the date columns in one go rather than per job
+        jobs_df['Created Date'] = localise_st_dates(jobs_df['Created Date'], state, "%m/%d/%Y")
+        jobs_df['Completion Date'] = localise_st_dates(jobs_df['Completion Date'], state, "%m/%d/%Y").fillna("None")
     
     invoice_ids = get_invoice_ids(job_response)
 
@@ -359,41 +403,62 @@ def get_commission_data(state, start_date, end_date):
 
 #     return buffer
 
-def get_timesheets_for_tech(tech_id, state, start_date, end_date):
-    
-    def format_timesheet(timesheet):
-        formatted = {}
-        formatted['id'] = timesheet['id']
-        formatted['technicianId'] = timesheet['technicianId']
-        formatted['jobId'] = timesheet['jobId']
-        formatted['appointmentId'] = timesheet['appointmentId']
-        formatted['dispatchedOn'] = sp.convert_ST_datetime_to_local_obj(timesheet['dispatchedOn'], ss[f'st_data_service_{state}'].timezone) if timesheet['dispatchedOn'] is not None else None
-        formatted['arrivedOn'] = sp.convert_ST_datetime_to_local_obj(timesheet['arrivedOn'], ss[f'st_data_service_{state}'].timezone) if timesheet['arrivedOn'] is not None else None
-        formatted['doneOn'] = sp.convert_ST_datetime_to_local_obj(timesheet['doneOn'], ss[f'st_data_service_{state}'].timezone) if timesheet['doneOn'] is not None else None
-        return formatted
+def date_windows(start_date, end_date, window_days=7):
+    """Split an inclusive date range into consecutive (start, end) windows of `window_days` days."""
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+def get_timesheets_for_techs(tech_ids, state, start_date, end_date, window_days=7, max_workers=6):
+    """
+    Per tech, per day spans of work: first arrival and last finish of each day, with the job IDs.
+
+    `tech_ids` is a list of technician IDs, or None for every tech. The technician filter is
+    sent to the API, and the date range is fetched in parallel windows of `window_days`.
+    """
+    check_and_update_ss_for_data_service(state)
+    data_service = ss[f'st_data_service_{state}']
 
+    def fetch_window(tech_id, window_start, window_end):
+        start_time = datetime.combine(window_start, time(0,0,0))
+        end_time = datetime.combine(window_end, time(23,59,59))
+        options = {'technicianId': tech_id} if tech_id is not None else {}
+        return data_service.get_api_data_between('payroll', 'jobs/timesheets', start_time, end_time, 'created', options=options)
 
-    check_and_update_ss_for_data_service(state)
+    fetches = [(tech_id, ws, we) for tech_id in (tech_ids or [None]) for ws, we in date_windows(start_date, end_date, window_days)]
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        timesheet_data = flatten_list(ex.map(lambda r: fetch_window(*r), fetches))
 
-    start_time = datetime.combine(start_date, time(0,0,0))
-    end_time = datetime.combine(end_date, time(23,59,59))
+    span_cols = ['technicianId', 'arrivedDate', 'arrivedTime', 'jobId_x', 'doneTime', 'jobId_y', 'span']
+    if not timesheet_data:
+        return pd.DataFrame(columns=span_cols)
 
-    timesheet_data = ss[f'st_data_service_{state}'].get_api_data_between('payroll', 'jobs/timesheets', start_time, end_time, 'created')
-    # timesheet_data = ss[f'st_data_service_{state}'].get_api_data_between('payroll', 'jobs/timesheets', start_time, end_time, 'created', options={'technicianId': tech_id})
-    timesheet_data = [format_timesheet(timesheet) for timesheet in timesheet_data]
-    
-    timesheet_data = pd.DataFrame(timesheet_data).sort_values(by=['arrivedOn'])
+    timesheet_data = pd.DataFrame(timesheet_data, columns=['id', 'technicianId', 'jobId', 'appointmentId', 'dispatchedOn', 'arrivedOn', 'doneOn'])
+    timesheet_data = timesheet_data.drop_duplicates(subset='id')
+    for col in ['dispatchedOn', 'arrivedOn', 'doneOn']:
+        timesheet_data[col] = pd.to_datetime(timesheet_data[col], utc=True, format='ISO8601').dt.tz_convert(data_service.timezone)
+    timesheet_data = timesheet_data.sort_values(by=['arrivedOn'])
 
     timesheet_data['arrivedOn'] = timesheet_data['arrivedOn'].dt.round('15min')
     timesheet_data['doneOn'] = timesheet_data['doneOn'].dt.round('15min')
     timesheet_data['arrivedDate'] = timesheet_data['arrivedOn'].dt.date
     timesheet_data['arrivedTime'] = timesheet_data['arrivedOn'].dt.time
     timesheet_data['doneTime'] = timesheet_data['doneOn'].dt.time
-    first_rows = timesheet_data.groupby(['technicianId', 'arrivedDate'], as_index=False).first()[['technicianId', 'arrivedDate', 'arrivedTime', 'jobId']]
-    last_rows = timesheet_data.groupby(['technicianId', 'arrivedDate'], as_index=False).last()[['technicianId', 'arrivedDate', 'doneTime', 'jobId']]
+    grouped = timesheet_data.groupby(['technicianId', 'arrivedDate'], as_index=False)
+    first_rows = grouped.first()[['technicianId', 'arrivedDate', 'arrivedTime', 'jobId', 'arrivedOn']]
+    last_rows = grouped.last()[['technicianId', 'arrivedDate', 'doneTime', 'jobId', 'doneOn']]
     timesheet_data = pd.merge(first_rows, last_rows, left_on=['technicianId', 'arrivedDate'], right_on=['technicianId', 'arrivedDate'])
+    timesheet_data['span'] = timesheet_data['doneOn'] - timesheet_data['arrivedOn']
 
-    return timesheet_data
+    return timesheet_data[span_cols]
+
+def get_timesheets_for_tech(tech_id, state, start_date, end_date):
+    tech_ids = [tech_id] if tech_id is not None else None
+    return get_timesheets_for_techs(tech_ids, state, start_date, end_date)
 
 
 def update_job_external_data(job_id, state, data):
@@ -10,6 +10,7 @@ import modules.data as data
 import modules.photos as photos
 
 import modules.google_store as gs
+import modules.profiling as profiling
 
 st.set_page_config(
     layout="wide",
@@ -130,6 +131,7 @@ def doc_check_template():
             st.write("before_img", before_img, "after_img", after_img, "receipt_img", receipt_img)
 
 if ss["authentication_status"]:
+    profiling.start('doc_check_payroll')
     if 'app_guid' not in ss:
         ss.app_guid = data.get_secret("ST_servco_integrations_guid")
     if 'state' not in ss:
@@ -149,6 +151,7 @@ if ss["authentication_status"]:
     time_now = datetime.now(ZoneInfo("Australia/Sydney"))
 
     job_data_template()
+    profiling.finish()
 
 elif ss["authentication_status"] is False:
     data.clear_ss()
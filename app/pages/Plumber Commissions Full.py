@@ -8,6 +8,7 @@ import pandas as pd
 
 from modules.data import get_full_commission_data, convert_df_for_download
 import modules.google_store as gs
+import modules.profiling as profiling
 
 st.set_page_config(
     layout="wide",
@@ -26,6 +27,7 @@ authenticator = stauth.Authenticate(
 authenticator.login(location='main')
 
 if ss["authentication_status"]:
+    profiling.start('plumber_commissions_full')
 
     st.subheader("Work in progress")
     time_now = datetime.now(ZoneInfo("Australia/Sydney"))
@@ -94,7 +96,7 @@ if ss["authentication_status"]:
             ss.full_commission_end_date = None
     st.write("Current Data:")
     # st.dataframe(ss.full_commission_data)
-
+    profiling.finish()
 
 elif ss["authentication_status"] is False:
     st.error('Go to home page to log in.')
@@ -6,6 +6,7 @@ from zoneinfo import ZoneInfo
 
 from modules.data import get_commission_data, convert_df_for_download
 import modules.google_store as gs
+import modules.profiling as profiling
 
 st.set_page_config(
     layout="wide",
@@ -24,6 +25,7 @@ authenticator = stauth.Authenticate(
 authenticator.login(location='main')
 
 if ss["authentication_status"]:
+    profiling.start('plumber_commissions')
 
     st.subheader("Work in progress")
     time_now = datetime.now(ZoneInfo("Australia/Sydney"))
@@ -81,7 +83,7 @@ if ss["authentication_status"]:
             ss.commission_end_date = None
     st.write("Current Data:")
     st.dataframe(ss.commission_data)
-
+    profiling.finish()
 
 elif ss["authentication_status"] is False:
     st.error('Go to home page to log in.')
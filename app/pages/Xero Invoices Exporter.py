@@ -6,6 +6,7 @@ from zoneinfo import ZoneInfo
 
 from modules.data import get_invoices_for_xero, convert_df_for_download
 import modules.google_store as gs
+import modules.profiling as profiling
 
 st.set_page_config(
     layout="wide",
@@ -24,6 +25,7 @@ authenticator = stauth.Authenticate(
 authenticator.login(location='main')
 
 if ss["authentication_status"]:
+    profiling.start('xero_invoices')
 
     time_now = datetime.now(ZoneInfo("Australia/Sydney"))
     today = time_now.date()
@@ -83,6 +85,7 @@ if ss["authentication_status"]:
             ss.invoice_end_date = None
     st.write("Current Data:")
     st.dataframe(ss.invoice_data)
+    profiling.finish()
 
 elif ss["authentication_status"] is False:
     st.error('Go to home page to log in.')
@@ -0,0 +1,259 @@
+"""
+Local load test for the attachment worker.
+
+Runs the FastAPI app under uvicorn with ServiceTitan, GCS and Supabase replaced by local stand-ins,
+then POSTs jobs to /tasks/process-job from concurrent clients, like Cloud Tasks would.
+
+    python load_test.py --jobs 200 --concurrency 16 --attachments 10 --attachment-kb 500
+
+Reports throughput, request latency percentiles and peak memory. Nothing touches production;
+"uploaded" files go to a temporary directory that is removed afterwards unless --keep-files is given.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import uvicorn
+
+import main
+import modules.google_store as gs
+
+# -------------------------------------------------------------------
+# STAND-INS
+# -------------------------------------------------------------------
+
+class FakeServiceTitanClient:
+    """Serves synthetic attachment listings and files with a simulated API latency."""
+
+    def __init__(self, tenant: str, attachments_per_job: int, attachment_bytes: int, latency: float):
+        self.tenant = tenant
+        self.attachments_per_job = attachments_per_job
+        self.attachment_bytes = attachment_bytes
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            # Jittered so concurrent requests don't all finish together
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def build_url(self, module, resource, resource_id=None, version=1):
+        url = f"fake://{module}/v{version}/tenant/{self.tenant}/{resource}"
+        return f"{url}/{resource_id}" if resource_id is not None else url
+
+    def get_all(self, url, params=None):
+        self._wait()
+        job_id = int(re.search(r"jobs/(\d+)/attachments", url).group(1))
+        return [
+            {
+                "id": job_id * 1000 + i,
+                "fileName": f"photo_{i}.jpg" if i % 4 else f"form_{i}.pdf",
+                "createdOn": "2025-01-01T00:00:00Z",
+                "createdById": 1,
+            }
+            for i in range(self.attachments_per_job)
+        ]
+
+    def get(self, url, params=None):
+        self._wait()
+        return os.urandom(self.attachment_bytes)
+
+class FakeGCS:
+    """Writes uploads under a local directory and returns file:// URLs in place of signed URLs."""
+
+    def __init__(self, root: str, latency: float):
+        self.root = root
+        self.latency = latency
+
+    def upload_bytes_to_gcs_signed(self, data: bytes, bucket_name: str, blob_name: str, content_type: Optional[str] = None, expires_in_seconds: int = 0) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.root, bucket_name, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return f"file://{path}"
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+class _FakeQuery:
+    def __init__(self, table: "FakeTable"):
+        self.table = table
+        self.filters: Dict[str, Any] = {}
+        self.columns: Optional[List[str]] = None
+        self.row: Optional[Dict[str, Any]] = None
+        self.on_conflict: Optional[str] = None
+
+    def select(self, columns="*"):
+        self.columns = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def upsert(self, row, on_conflict=None):
+        self.row = row
+        self.on_conflict = on_conflict
+        return self
+
+    def execute(self):
+        return self.table.execute(self)
+
+class FakeTable:
+    """Just enough of the supabase-py table API for select/eq and upsert."""
+
+    def __init__(self, name: str, primary_key: List[str], latency: float):
+        self.name = name
+        self.primary_key = primary_key
+        self.latency = latency
+        self.rows: Dict[tuple, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def execute(self, query: _FakeQuery) -> _FakeResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if query.row is not None:
+                key_cols = [query.on_conflict] if query.on_conflict else self.primary_key
+                key = tuple(query.row.get(c) for c in key_cols)
+                self.rows[key] = {**self.rows.get(key, {}), **query.row}
+                return _FakeResponse([dict(self.rows[key])])
+            matched = [row for row in self.rows.values() if all(row.get(k) == v for k, v in query.filters.items())]
+        if query.columns:
+            matched = [{c: row.get(c) for c in query.columns} for row in matched]
+        return _FakeResponse(matched)
+
+class FakeSupabase:
+    def __init__(self, latency: float):
+        self.tables = {
+            "gcs_job_attachment_status": FakeTable("gcs_job_attachment_status", ["job_id", "tenant"], latency),
+            "gcs_attachments": FakeTable("gcs_attachments", ["attachment_id"], latency),
+        }
+
+    def table(self, name):
+        return _FakeQuery(self.tables[name])
+
+def install_stand_ins(args, gcs_root: str) -> FakeSupabase:
+    """Point the worker at the stand-ins. Clients are shared like the real ones would be per process."""
+    supabase = FakeSupabase(args.db_latency)
+    clients: Dict[str, FakeServiceTitanClient] = {}
+
+    def get_st_client(tenant):
+        if tenant not in clients:
+            clients[tenant] = FakeServiceTitanClient(tenant, args.attachments, args.attachment_kb * 1024, args.st_latency)
+        return clients[tenant]
+
+    main.get_supabase = lambda: supabase
+    main.get_st_client = get_st_client
+    gs.upload_bytes_to_gcs_signed = FakeGCS(gcs_root, args.gcs_latency).upload_bytes_to_gcs_signed
+    return supabase
+
+# -------------------------------------------------------------------
+# DRIVER
+# -------------------------------------------------------------------
+
+def start_server(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def post_job(port: int, job_id: int, tenant: str, force_refresh: bool) -> Dict[str, Any]:
+    body = json.dumps({"job_id": job_id, "tenant": tenant, "force_refresh": force_refresh}).encode()
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{port}/tasks/process-job", data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=900) as resp:
+            status = resp.status
+            resp.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return {"job_id": job_id, "status": status, "latency": time.perf_counter() - start}
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+def run(args) -> Dict[str, Any]:
+    gcs_root = tempfile.mkdtemp(prefix="attachment_load_test_")
+    install_stand_ins(args, gcs_root)
+    tracemalloc.start()
+    server = start_server(args.port)
+
+    tenants = args.tenants.split(",")
+    jobs = [(100_000 + i, tenants[i % len(tenants)]) for i in range(args.jobs)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda job: post_job(args.port, job[0], job[1], args.force_refresh), jobs))
+    elapsed = time.perf_counter() - start
+
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    server.should_exit = True
+
+    if args.keep_files:
+        print(f"Uploaded files kept in {gcs_root}")
+    else:
+        shutil.rmtree(gcs_root, ignore_errors=True)
+
+    latencies = [r["latency"] for r in results]
+    ok = [r for r in results if r["status"] == 200]
+    total_bytes = len(ok) * args.attachments * args.attachment_kb * 1024
+    return {
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "elapsed_s": round(elapsed, 2),
+        "jobs_per_s": round(len(ok) / elapsed, 2),
+        "mb_per_s": round(total_bytes / elapsed / 1e6, 2),
+        "latency_s": {
+            "mean": round(statistics.mean(latencies), 3),
+            "p50": round(percentile(latencies, 50), 3),
+            "p90": round(percentile(latencies, 90), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies), 3),
+        },
+        "peak_python_alloc_mb": round(peak_traced / 1e6, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # ru_maxrss is KB on Linux
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the attachment worker against local stand-ins.")
+    parser.add_argument("--jobs", type=int, default=100, help="number of jobs to POST")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests, like Cloud Run max concurrency")
+    parser.add_argument("--tenants", default="alphabravo,mikeecho", help="comma separated tenant names to spread jobs over")
+    parser.add_argument("--attachments", type=int, default=10, help="attachments per job")
+    parser.add_argument("--attachment-kb", type=int, default=500, help="size of each synthetic attachment")
+    parser.add_argument("--st-latency", type=float, default=0.2, help="simulated ServiceTitan latency per call (s)")
+    parser.add_argument("--gcs-latency", type=float, default=0.1, help="simulated GCS upload latency (s)")
+    parser.add_argument("--db-latency", type=float, default=0.03, help="simulated Supabase latency per query (s)")
+    parser.add_argument("--force-refresh", action="store_true", help="send force_refresh=True")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--keep-files", action="store_true", help="don't delete the fake GCS directory")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    print(json.dumps(run(parse_args()), indent=2))
@@ -1,11 +1,15 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import List, Tuple, Dict, Any
 import logging
+import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
 import modules.fetching as fetch
+import modules.observability as obs
 
 
 # from gcs_images import get_signed_image_urls_for_job  # from previous helper module
@@ -20,6 +24,7 @@ from modules.job_status_store import (
 )
 from modules.helpers import get_supabase, get_st_client
 
+obs.setup_logging()
 app = FastAPI()
 logger = logging.getLogger("worker")
 
@@ -53,6 +58,21 @@ def process_job_attachments(job_id: int, force_refresh: bool, tenant: str) -> Pr
     - upload to GCS
     - mark as processed
     """
+    start = time.perf_counter()
+    obs.JOBS_IN_FLIGHT.labels(tenant=tenant).inc()
+    try:
+        result = _process_job_attachments(job_id, force_refresh, tenant)
+    except Exception:
+        obs.JOB_DURATION.labels(tenant=tenant, status="error").observe(time.perf_counter() - start)
+        raise
+    finally:
+        obs.JOBS_IN_FLIGHT.labels(tenant=tenant).dec()
+    duration = time.perf_counter() - start
+    obs.JOB_DURATION.labels(tenant=tenant, status=result.status).observe(duration)
+    obs.log_event(logger, "job_finished", tenant=tenant, job_id=job_id, status=result.status, num_images=result.num_images, duration_s=round(duration, 3))
+    return result
+
+def _process_job_attachments(job_id: int, force_refresh: bool, tenant: str) -> ProcessJobResponse:
     sb_client = get_supabase()
     st_client = get_st_client(tenant)
 
@@ -74,16 +94,18 @@ def process_job_attachments(job_id: int, force_refresh: bool, tenant: str) -> Pr
         )
 
     try:
-        set_job_status_processing(job_id, sb_client, datetime.now(), tenant)
+        with obs.observe(obs.SUPABASE_WRITE_LATENCY, error_stage="supabase_write", tenant=tenant, table="gcs_job_attachment_status"):
+            set_job_status_processing(job_id, sb_client, datetime.now(), tenant)
 
         # Download attachments to GCS, insert urls and other data to supabase DBs
-        count_of_urls = fetch.download_attachments_for_job(job_id, st_client, sb_client)
+        count_of_urls = fetch.download_attachments_for_job(job_id, st_client, sb_client, tenant=tenant)
 
         # 2. Upload to GCS and generate signed URLs (or you can just ignore URLs here)
         # urls = get_signed_image_urls_for_job(job_id, raw_attachments)
 
         # 3. Mark as processed in status store
-        set_job_status_processed(job_id, count_of_urls, sb_client, datetime.now(), tenant)
+        with obs.observe(obs.SUPABASE_WRITE_LATENCY, error_stage="supabase_write", tenant=tenant, table="gcs_job_attachment_status"):
+            set_job_status_processed(job_id, count_of_urls, sb_client, datetime.now(), tenant)
 
         return ProcessJobResponse(
             status="processed",
@@ -92,8 +114,9 @@ def process_job_attachments(job_id: int, force_refresh: bool, tenant: str) -> Pr
         )
 
     except Exception as e:
-        logger.exception(f"Error processing job {job_id}: {e}")
-        set_job_status_error(job_id, str(e), sb_client, datetime.now(), tenant)
+        obs.log_event(logger, "job_failed", level=logging.ERROR, exc_info=True, tenant=tenant, job_id=job_id, error=str(e))
+        with obs.observe(obs.SUPABASE_WRITE_LATENCY, error_stage="supabase_write", tenant=tenant, table="gcs_job_attachment_status"):
+            set_job_status_error(job_id, str(e), sb_client, datetime.now(), tenant)
 # ZoneInfo("Australia/Sydney")
         raise
 
@@ -108,7 +131,7 @@ async def process_job_endpoint(req: ProcessJobRequest, request: Request):
     Cloud Tasks will POST here with JSON payload matching ProcessJobRequest.
     """
     # (Optional) verify request headers/auth here to ensure it came from Cloud Tasks
-    print(f'request caught for {req.job_id}')
+    obs.log_event(logger, "job_received", tenant=req.tenant, job_id=req.job_id, force_refresh=req.force_refresh)
     try:
         result = process_job_attachments(req.job_id, req.force_refresh, req.tenant)
         return result
@@ -116,5 +139,10 @@ async def process_job_endpoint(req: ProcessJobRequest, request: Request):
         # Cloud Tasks will treat non-2xx as failure and retry based on config
         raise HTTPException(status_code=500, detail=f"Processing failed: {e}")
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == '__main__':
     print(process_job_attachments(143554308, True, 'bravogolf'))
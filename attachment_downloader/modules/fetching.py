@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime
+import logging
 
 from servicetitan_api_client import ServiceTitanClient
 from typing import Dict, List, Set, Tuple, Optional, Any, Iterable
@@ -10,13 +11,16 @@ from supabase import create_client, Client
 if __name__ == '__main__':
     import google_store as gs
     import helpers as helpers
+    import observability as obs
     from helpers import get_supabase, get_st_client
 
 else:
     import modules.google_store as gs
     import modules.helpers as helpers
+    import modules.observability as obs
     from modules.helpers import get_supabase, get_st_client
 
+logger = logging.getLogger("worker")
 
 def fetch_job_attachments(job_id: str, _client: ServiceTitanClient) -> List[Dict[str, Any]]:
     """Retrieve attachment metadata for the given job ID.
@@ -40,16 +44,24 @@ def fetch_attachment_bytes(attachment_id: int, _client: ServiceTitanClient) -> b
     url = _client.build_url("forms", "jobs/attachment", resource_id=attachment_id)
     return _client.get(url)
 
-def download_attachment_to_gcs(attachment_id: int, _client: ServiceTitanClient, gcs_bucket: str, gcs_blob: str) -> str:
-    """Downloads an attachment to gcs and return a signed url to access
+def download_attachment_to_gcs(attachment_id: int, _client: ServiceTitanClient, gcs_bucket: str, gcs_blob: str, tenant: str = "") -> Tuple[str, int]:
+    """Downloads an attachment to gcs and return a signed url to access, and the attachment size in bytes
     """
-    data = fetch_attachment_bytes(attachment_id, _client)
-    url = gs.upload_bytes_to_gcs_signed(data, gcs_bucket, gcs_blob)
+    obs.DOWNLOADS_IN_FLIGHT.labels(tenant=tenant).inc()
+    try:
+        with obs.observe(obs.SERVICETITAN_LATENCY, error_stage="servicetitan_download", tenant=tenant, operation="download_attachment"):
+            data = fetch_attachment_bytes(attachment_id, _client)
+        with obs.observe(obs.GCS_LATENCY, error_stage="gcs_upload", tenant=tenant):
+            url = gs.upload_bytes_to_gcs_signed(data, gcs_bucket, gcs_blob)
+    finally:
+        obs.DOWNLOADS_IN_FLIGHT.labels(tenant=tenant).dec()
+    size = len(data) if data else 0
+    obs.BYTES_TRANSFERRED.labels(tenant=tenant).inc(size)
     # print("signed_url:")
     # print(url)
-    return url
+    return url, size
 
-def download_attachments_for_job(job_id: str, client: ServiceTitanClient, sb_client: Client):
+def download_attachments_for_job(job_id: str, client: ServiceTitanClient, sb_client: Client, tenant: str | None = None):
     """Download all attachments for a job and group them by type.
 
     This helper performs two API calls: one to list attachments and a
@@ -59,18 +71,23 @@ def download_attachments_for_job(job_id: str, client: ServiceTitanClient, sb_cli
     dictionary is a list of ``(filename, data)`` tuples, where ``data``
     is the raw bytes of the attachment.  If no attachments exist for a
     category, the list will be empty.
+
+    ``tenant`` is only used to label metrics and logs, defaulting to the client's tenant ID.
     """
+    tenant = tenant or str(client.tenant)
 
     GCS_BUCKET = 'prestigious-doc-check-attachments'
     # GCS_BUCKET = 'doc-check-attachments'
 
-    attachments = fetch_job_attachments(job_id, client)
+    with obs.observe(obs.SERVICETITAN_LATENCY, error_stage="servicetitan_list", tenant=tenant, operation="list_attachments"):
+        attachments = fetch_job_attachments(job_id, client)
 
     count_urls = 0
+    total_bytes = 0
     
     max_workers = min(8, len(attachments)) or 1
     with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        future_map: Dict[Future[bytes], Tuple] = {}
+        future_map: Dict[Future[Tuple[str, int]], Tuple] = {}
         # for category, att_id, filename, file_date, file_by in tasks:
         for att in attachments:
             file_name = att.get("fileName")
@@ -79,37 +96,40 @@ def download_attachments_for_job(job_id: str, client: ServiceTitanClient, sb_cli
             file_by = att.get("createdById")
             if not file_name or att_id is None:
                 continue
-            fut = pool.submit(download_attachment_to_gcs, att_id, client, GCS_BUCKET, f'{client.tenant}/{job_id}/{file_name}')
+            fut = pool.submit(download_attachment_to_gcs, att_id, client, GCS_BUCKET, f'{client.tenant}/{job_id}/{file_name}', tenant)
             future_map[fut] = (file_name, file_date, file_by, att_id)
         for fut in as_completed(future_map):
             file_name, file_date, file_by, att_id = future_map[fut]
             # try:
             # If error is raised, will be dealt with in main
-            signed_url = fut.result()
+            signed_url, size = fut.result()
             count_urls += 1
+            total_bytes += size
             # except Exception as e:
             #     # Set job as errored status here ??
             #     print(f"EXCEPTION: {e}")
             #     signed_url = 'error'
-            print(f"uploading {att_id}...")
-            response = (
-                sb_client.table("gcs_attachments")
-                .upsert({
-                    "job_id": job_id, 
-                    "type": helpers.get_attachment_type(file_name), 
-                    "gcs_uploaded": datetime.now().isoformat(), 
-                    "url": signed_url, 
-                    "tenant": client.tenant,
-                    "file_date": file_date, 
-                    "file_name": file_name, 
-                    "file_by": file_by, 
-                    "attachment_id": att_id
-                },
-                on_conflict='attachment_id')
-                .execute()
-            # handle response ??
-            ) 
-            print(f"uploaded {att_id}.")
+            with obs.observe(obs.SUPABASE_WRITE_LATENCY, error_stage="supabase_write", tenant=tenant, table="gcs_attachments"):
+                response = (
+                    sb_client.table("gcs_attachments")
+                    .upsert({
+                        "job_id": job_id, 
+                        "type": helpers.get_attachment_type(file_name), 
+                        "gcs_uploaded": datetime.now().isoformat(), 
+                        "url": signed_url, 
+                        "tenant": client.tenant,
+                        "file_date": file_date, 
+                        "file_name": file_name, 
+                        "file_by": file_by, 
+                        "attachment_id": att_id
+                    },
+                    on_conflict='attachment_id')
+                    .execute()
+                # handle response ??
+                ) 
+            obs.log_event(logger, "attachment_uploaded", tenant=tenant, job_id=job_id, attachment_id=att_id, bytes=size)
+    obs.JOB_ATTACHMENTS.labels(tenant=tenant).observe(count_urls)
+    obs.JOB_BYTES.labels(tenant=tenant).observe(total_bytes)
     return count_urls
     # grouped_meta = helpers.group_attachments_by_type(attachments)
     # result: Dict[str, List[Tuple[str, Any]]] = {key: [] for key in grouped_meta}
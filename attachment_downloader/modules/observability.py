@@ -0,0 +1,114 @@
+"""
+Prometheus metrics and structured logging for the attachment worker.
+
+Metrics are exposed by the /metrics endpoint in main.py. Logs are written to stdout as one JSON
+object per line, which Cloud Logging picks up with the right severity and the extra fields searchable.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# -------------------------------------------------------------------
+# METRICS
+# -------------------------------------------------------------------
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+ATTACHMENT_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000, 100_000_000, 500_000_000)
+
+JOB_DURATION = Histogram(
+    "attachment_job_duration_seconds", "Time to process one job, by outcome.",
+    ["tenant", "status"], buckets=JOB_DURATION_BUCKETS,
+)
+JOB_ATTACHMENTS = Histogram(
+    "attachment_job_attachments", "Attachments uploaded per processed job.",
+    ["tenant"], buckets=ATTACHMENT_COUNT_BUCKETS,
+)
+JOB_BYTES = Histogram(
+    "attachment_job_bytes", "Bytes downloaded from ServiceTitan and uploaded to GCS per processed job.",
+    ["tenant"], buckets=BYTES_BUCKETS,
+)
+BYTES_TRANSFERRED = Counter(
+    "attachment_bytes_transferred_total", "Attachment bytes downloaded from ServiceTitan and uploaded to GCS.",
+    ["tenant"],
+)
+SERVICETITAN_LATENCY = Histogram(
+    "servicetitan_request_seconds", "ServiceTitan API latency.",
+    ["tenant", "operation"], buckets=LATENCY_BUCKETS,
+)
+GCS_LATENCY = Histogram(
+    "gcs_upload_seconds", "GCS upload and URL signing latency per attachment.",
+    ["tenant"], buckets=LATENCY_BUCKETS,
+)
+SUPABASE_WRITE_LATENCY = Histogram(
+    "supabase_write_seconds", "Supabase write latency.",
+    ["tenant", "table"], buckets=LATENCY_BUCKETS,
+)
+ERRORS = Counter(
+    "attachment_errors_total", "Failures, by the step that failed.",
+    ["tenant", "stage"],
+)
+JOBS_IN_FLIGHT = Gauge(
+    "attachment_jobs_in_flight", "Jobs currently being processed.",
+    ["tenant"],
+)
+DOWNLOADS_IN_FLIGHT = Gauge(
+    "attachment_downloads_in_flight", "Attachment downloads/uploads currently running.",
+    ["tenant"],
+)
+
+@contextmanager
+def observe(histogram: Histogram, error_stage: str | None = None, **labels):
+    """
+    Time the block into `histogram` with `labels`.
+
+    If `error_stage` is given, an exception in the block also increments ERRORS for that stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if error_stage is not None:
+            ERRORS.labels(tenant=labels.get("tenant", ""), stage=error_stage).inc()
+        raise
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+# -------------------------------------------------------------------
+# LOGGING
+# -------------------------------------------------------------------
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any fields passed through `log_event` merged in."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging() -> None:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info=None, **fields) -> None:
+    """Log `event` with `fields` as top level keys in the JSON line."""
+    logger.log(level, event, exc_info=exc_info, extra={"fields": {"event": event, **fields}})
@@ -3,20 +3,19 @@ import streamlit as st
 from streamlit import session_state as ss
 import streamlit_authenticator as stauth
 import datetime as dt
-import pandas as pd
 import calendar
-from pprint import pprint
 
 import modules.google_store as gs
 
 from modules.excel_builder import build_workbook 
-from modules.excel_templates import CommissionSpreadSheetExporter
 
 import modules.helpers as helpers
 import modules.templates as templates
-import modules.data_formatting as format
-import modules.data_fetching as fetching
 import modules.lookup_tables as lookup
+import modules.tracing as tracing
+import modules.profiling as profiling
+import modules.pipeline as pipeline
+import modules.export_jobs as export_jobs
 
 ###############################################################################
 # Filter warnings
@@ -36,6 +35,7 @@ authenticator = stauth.Authenticate(
 authenticator.login(location='main')
 
 if ss["authentication_status"]:
+    profiling.start('commission_exporter')
 
     if "spreadsheets" not in ss:
         ss.spreadsheets = {}
@@ -43,6 +43,8 @@ if ss["authentication_status"]:
     st.write('If there is a yellow box above talking about a Cookie Manager, please disregard. It does not affect the functionality of the app.')
     st.write('Please select a timeframe, tenant, and date to filter by, then click "Fetch and build workbook". This will gather all the relevant data and produce the "Download Spreadsheet" button after a short wait. Click this to get the spreadsheet.')
 
+    templates.show_precomputed_exports()
+
     today = dt.date.today()
     # default to last Mon–Sun
     last_monday = today - dt.timedelta(days=today.weekday() + 7)
@@ -59,6 +61,16 @@ if ss["authentication_status"]:
     )
 
     with st.form("date_select"):
+        reuse_data = st.checkbox(
+            "Reuse stored ServiceTitan data (only fetch what changed)",
+            value=True,
+            help="Untick to fetch everything from ServiceTitan again and rebuild the workbook.",
+        )
+        run_in_background = st.checkbox(
+            "Run in the background",
+            value=False,
+            help="The export keeps going if you close or refresh this page. Best for monthly and \"All\" exports.",
+        )
         state = st.selectbox(
             "Select State",
             ['All'] + list(lookup.get_tenant_from_state().keys())
@@ -104,144 +116,42 @@ if ss["authentication_status"]:
             
 
         
-    if submitted:
-        if state == 'All':
-            states = list(lookup.get_tenant_from_state().keys())
-        else:
-            states = [state] # Janky way to force "All" to work with current setup.
-            
-        for state in states:
-            tenant_codes = lookup.get_tenant_from_state(state)
-            data_present = False # flag for checking if data is present. Only here because refactoring for merging states, not the best way to do it I know.
-            job_records = []
-            employee_map_total = {}
-            for tenant_code in tenant_codes:
-                with st.spinner("Loading..."):
-                    ss.client = helpers.get_client(tenant_code)
-                    with st.spinner("Fetching employee info..."):
-                        employee_map = helpers.get_all_employee_ids(ss.client)
-                        employee_map_total.update(employee_map)
-
-                    with st.spinner("Fetching tags..."):
-                        tenant_tags = fetching.fetch_tag_types(ss.client)
-
-                    with st.spinner("Fetching appointments..."):
-                        appts = fetching.fetch_appts(ss.client, start_date, end_date)
-                        pprint(f"len(appts) == {len(appts)}")
-                    if len(appts) == 0:
-                        continue
-                    
-                    with st.spinner("Fetching appointments..."):
-                        first_appts = format.get_first_appts(appts)
-                        pprint(f"len(first_appts) == {len(first_appts)}")
-                        if len(first_appts) == 0:
-                            continue
-                        data_present = True # Change to true if any data present.
-                        
-                        job_ids = format.get_job_ids(first_appts)
-                        pprint(f"len(job_ids) == {len(job_ids)}")
-                        appt_ids = [appt['id'] for appt in appts]
-
-                    with st.spinner("Fetching appointment assignments..."):
-                        appt_assmnts = fetching.fetch_appt_assmnts(ss.client, appt_ids)
-
-                    with st.spinner("Fetching jobs..."):
-                        jobs = fetching.fetch_jobs(ss.client, job_id_ls=job_ids)
-                        pprint(f"len(jobs) == {len(jobs)}")
-                        invoice_ids = format.get_invoice_ids(jobs)
-
-                    with st.spinner("Fetching estimates..."):
-                        estimates = fetching.fetch_estimates(start_date, end_date, ss.client)
-
-                    with st.spinner("Fetching invoices..."):
-                        invoices = fetching.fetch_invoices(invoice_ids, ss.client)
-
-                    with st.spinner("Fetching payments..."):
-                        payments = fetching.fetch_payments(invoice_ids, ss.client)
-                    
-                    with st.spinner("Formatting data..."):
-                        appt_assmnts = [format.format_appt_assmt(appt) for appt in appt_assmnts]
-                        appt_assmnts_by_job, num_appts_per_job = format.group_appt_assmnts_by_job(appt_assmnts)
-                        first_appts_by_id = format.extract_id_to_key(first_appts, 'jobId')
-                        for job in jobs:
-                            job['appt_techs'] = set(appt_assmnts_by_job.get(job['id'], []))
-                            job['num_of_appts_in_mem'] = num_appts_per_job.get(job['id'], 0)
-                            job['first_appt'] = first_appts_by_id.get(job['id'], {})
-                        jobs_w_nones = [format.format_job(job, ss.client, tenant_tags, exdata_key='docchecks_live') for job in jobs]
-                        jobs = [job for job in jobs_w_nones if job is not None]
-                        if len(jobs) == 0:
-                            continue
-                        invoices = [format.format_invoice(invoice) for invoice in invoices]
-                        payments = helpers.flatten_list([format.format_payment(payment, ss.client) for payment in payments])
-                        open_estimates = [e for e in [format.format_estimate(est, sold=False) for est in estimates] if e is not None]
-                        sold_estimates = [e for e in [format.format_estimate(est, sold=True) for est in estimates] if e is not None]
-
-                        jobs_df = pd.DataFrame(jobs)
-                        
-                        if len(invoices) == 0:
-                            invoices_df = pd.DataFrame(columns=['invoiceId'])
-                        else:
-                            invoices_df = pd.DataFrame(invoices)
-                        if len(payments) == 0:
-                            payments_df = pd.DataFrame(columns=['invoiceId'])
-                        else:
-                            payments_df = pd.DataFrame(payments)
-                        payments_grouped = payments_df.groupby('invoiceId', as_index=False).agg(lambda x: ', '.join(sorted(list(set(x)))))
-                        
-                        open_estimates_df = pd.DataFrame(open_estimates)
-                        if open_estimates_df.empty:
-                            open_estimates_df = pd.DataFrame(columns=['job_id', 'est_subtotal'])
-                            
-                        sold_estimates_df = pd.DataFrame(sold_estimates)
-                        if sold_estimates_df.empty:
-                            sold_estimates_df = pd.DataFrame(columns=['job_id', 'est_subtotal'])
-                            
-                        open_estimates_grouped = open_estimates_df.groupby('job_id', as_index=False).agg({'est_subtotal': 'sum'})
-                        sold_estimates_grouped = sold_estimates_df.groupby('job_id', as_index=False).agg({'est_subtotal': 'sum'})
-
-                    with st.spinner("Merging data..."):
-                        merged = helpers.merge_dfs([jobs_df, invoices_df, payments_grouped], on='invoiceId', how='left')
-                        merged = helpers.merge_dfs([merged, open_estimates_grouped], on='job_id')
-                        if 'est_subtotal' in merged.columns:
-                            merged = merged.rename(columns={'est_subtotal': 'open_est_subtotal'})
-                            
-                        merged = helpers.merge_dfs([merged, sold_estimates_grouped], on='job_id')
-                        if 'est_subtotal' in merged.columns:
-                            merged = merged.rename(columns={'est_subtotal': 'sold_est_subtotal'})
-                        
-                        if 'first_appt_start_dt' in merged.columns:
-                            merged = merged.sort_values(by='first_appt_start_dt')
-                        job_records_tmp = merged.to_dict(orient='records')
-                        for job in job_records_tmp:
-                            job['payments_in_time'] = helpers.check_payment_dates(job, end_date)
-                        
-                        job_records.extend(job_records_tmp)
-            if data_present:    
-                with st.spinner("Separating by technician..."):
-                    # group by tech name
-                    relevant_holidays = helpers.get_holidays(state)
-                    # print(relevant_holidays)
-                    job_records.sort(key = lambda x: x["first_appt_start_str"])
-                    jobs_by_tech = format.group_jobs_by_tech(job_records, employee_map_total, end_date, relevant_holidays)
-
-                with st.spinner("Building spreadsheet..."):
-                    if timeframe == "Custom":
-                        timeframe = 'Weekly' # will possibly break a lot of summary functionality, but there are a lot of hardcoded things for weekly/monthly!
-                    builder = CommissionSpreadSheetExporter(jobs_by_tech, end_date, timeframe=timeframe.lower(), col_offset=1, holidays=relevant_holidays, scheme=state, spare_rows=spare_rows)
-                    
-                    excel_bytes = builder.build_workbook()
-                    pprint(f"Workbook built for {state}, {start_date} to {end_date}.")
-                # st.write(jobs_by_tech)
-                    
-                ss.spreadsheets[f"commissions_{state}_{start_date}_{end_date}.xlsx"] = excel_bytes
-            
-                # templates.show_download_button(excel_bytes, f"commissions_{tenant_code}_{start_date}_{end_date}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            else:
+    if submitted and run_in_background:
+        ss.pop("export_jobs", None) # list them again with the new job
+        try:
+            export_jobs.submit_job(ss["username"], {
+                'state': state,
+                'states': pipeline.states_for(state),
+                'timeframe': timeframe,
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'spare_rows': int(spare_rows),
+                'reuse_data': reuse_data,
+            })
+            st.success("Export started. Its progress is shown below, and you can leave or refresh this page while it runs.")
+        except Exception as e:
+            st.error(f"Couldn't start the export in the background: {e}")
+
+    elif submitted:
+        states = pipeline.states_for(state)
+        trace = tracing.RunTrace(timeframe=timeframe, state=state, start_date=start_date, end_date=end_date)
+        workbooks = pipeline.run_export(states, timeframe, start_date, end_date, spare_rows, reuse_data=reuse_data, trace=trace, step=st.spinner)
+        for state, excel_bytes in workbooks.items():
+            if excel_bytes is None:
                 st.write(f"No data available for {state}.")
+            else:
+                ss.spreadsheets[pipeline.workbook_name(state, start_date, end_date)] = excel_bytes
+        trace.save() # listed by show_run_traces
 
     for spreadsheet_name, spreadsheet_data in ss.spreadsheets.items():
         templates.show_download_button(spreadsheet_data, spreadsheet_name, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+    templates.show_export_jobs(ss["username"])
+
+    templates.show_run_traces()
+    templates.show_warehouse_freshness()
+    profiling.finish()
+
 elif ss["authentication_status"] is False:
     st.error('Please log in.')
 elif ss["authentication_status"] is None:
@@ -2,9 +2,87 @@ from __future__ import annotations
 
 import streamlit as st
 import datetime as _dt
-from typing import Dict, List, Set, Tuple, Optional, Any, Iterable
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple, Optional, Any, Iterable, Iterator
 
 from servicetitan_api_client import ServiceTitanClient
+import modules.projection as projection
+import modules.tracing as tracing
+
+PAGE_SIZE = 500
+
+# Estimates are fetched for a created-date window starting this many days before the export range,
+# plus one request per job created before the window. Most jobs are created shortly before their
+# first appointment, so few need their own request.
+ESTIMATE_LOOKBACK_DAYS = 31
+
+# Limits for id-list filters like appointmentIds: ServiceTitan accepts up to 50 ids per filter,
+# and the character cap keeps the query string well under URL length limits.
+MAX_IDS_PER_REQUEST = 50
+MAX_ID_PARAM_CHARS = 1500
+
+def chunk_ids(ids: Iterable, max_ids: int = MAX_IDS_PER_REQUEST, max_chars: int = MAX_ID_PARAM_CHARS) -> List[List[str]]:
+    """Split ids into chunks that fit a single comma separated query parameter."""
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    length = 0
+    for id_ in ids:
+        id_ = str(id_)
+        if current and (len(current) >= max_ids or length + len(id_) + 1 > max_chars):
+            chunks.append(current)
+            current, length = [], 0
+        current.append(id_)
+        length += len(id_) + 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+def iter_pages(_client: ServiceTitanClient, url: str, params: Optional[Dict] = None, page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Yield each page of a paginated endpoint as it arrives."""
+    page = 1
+    while True:
+        resp = _client.get(url, params={**(params or {}), "page": page, "pageSize": page_size})
+        if not isinstance(resp, dict):
+            raise ValueError(f"Unexpected response for {url} page {page}: {type(resp).__name__}")
+        yield resp.get("data") or []
+        if not resp.get("hasMore"):
+            return
+        page += 1
+
+def get_all_projected(_client: ServiceTitanClient, url: str, entity: str, params: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Like `get_all`, but each page is cut down to the fields in projection.FIELDS[entity] as soon as it
+    arrives, so only the projected records are kept.
+    """
+    records: List[Dict[str, Any]] = []
+    for page in iter_pages(_client, url, params):
+        records.extend(projection.project_all(page, entity))
+    return records
+
+def get_all_id_filter_projected(
+    _client: ServiceTitanClient,
+    url: str,
+    ids: Iterable,
+    entity: str,
+    id_filter_name: str = 'ids',
+    params: Optional[Dict] = None,
+    max_workers: int = 6,
+) -> List[Dict[str, Any]]:
+    """Like `get_all_id_filter`, projected per page, with the id chunks fetched concurrently and de-duplicated by id."""
+    chunks = chunk_ids(dict.fromkeys(str(id_) for id_ in ids))
+    if not chunks:
+        return []
+
+    def _fetch_chunk(chunk):
+        return get_all_projected(_client, url, entity, params={**(params or {}), id_filter_name: ','.join(chunk)})
+
+    records_by_id: Dict[Any, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as ex:
+        for chunk_records in ex.map(tracing.traced(_fetch_chunk), chunks):
+            for record in chunk_records:
+                records_by_id[record['id']] = record
+    return list(records_by_id.values())
 
 # @st.cache_data(show_spinner=False)
 def fetch_jobs(
@@ -34,10 +112,10 @@ def fetch_jobs(
         params["createdOnOrAfter"] = created_after
         params["createdBefore"] = created_before
 
-        return _client.get_all(base_path, params=params)
+        return get_all_projected(_client, base_path, 'jobs', params=params)
 
     if job_id_ls:
-        return _client.get_all_id_filter(base_path, job_id_ls, params=params)
+        return get_all_id_filter_projected(_client, base_path, job_id_ls, 'jobs', params=params)
     
     return []
 
@@ -55,7 +133,7 @@ def fetch_invoices(
         ids = [str(id) for id in ids]
     base_path = _client.build_url('accounting', 'invoices')
 
-    invoices = _client.get_all_id_filter(base_path, ids=ids)
+    invoices = get_all_id_filter_projected(_client, base_path, ids, 'invoices')
     return invoices
 
 # @st.cache_data(show_spinner=False)
@@ -74,7 +152,7 @@ def fetch_payments(
         # 'appliedToInvoiceIds': ','.join(invoice_ids)
     }
 
-    payments = _client.get_all_id_filter(base_path, ids=invoice_ids, id_filter_name='appliedToInvoiceIds', params=params)
+    payments = get_all_id_filter_projected(_client, base_path, invoice_ids, 'payments', id_filter_name='appliedToInvoiceIds', params=params)
     return payments
 
 def fetch_tag_types(client: ServiceTitanClient):
@@ -87,11 +165,15 @@ def fetch_appt_assmnts(
     start_date: _dt.date = None,
     end_date: _dt.date = None,
     job_id: str | None = None,
-    appt_ids: List[str] = None
+    appt_ids: List[str] = None,
+    max_workers: int = 6,
 ) -> List[Dict[str, Any]]:
     """
     Retrieve all appointment assignments created between `start_date` and `end_date`,
     converting the local date boundaries into UTC timestamps.
+
+    With `appt_ids`, retrieve exactly the assignments for those appointments instead,
+    fetching chunks of ids concurrently.
     """
 
     base_path = _client.build_url('dispatch', 'appointment-assignments')
@@ -103,7 +185,7 @@ def fetch_appt_assmnts(
                     "createdOnOrAfter": created_after,
                     "createdBefore": created_before,
                 }
-        return _client.get_all(base_path, params=params)
+        return get_all_projected(_client, base_path, 'appointment_assignments', params=params)
     
     # If job_id specified, only return that job
     if job_id:
@@ -120,10 +202,20 @@ def fetch_appt_assmnts(
         return page_data
     
     if appt_ids:
-        params = {
-            'appointmentIds': ','.join[appt_ids]
-        }
-        return _client.get_all(base_path, params=params)
+        appt_ids = list(dict.fromkeys(str(appt_id) for appt_id in appt_ids))
+        chunks = chunk_ids(appt_ids)
+
+        def _fetch_chunk(chunk):
+            return get_all_projected(_client, base_path, 'appointment_assignments', params={'appointmentIds': ','.join(chunk)})
+
+        wanted = set(appt_ids)
+        assmnts_by_id: Dict[Any, Dict[str, Any]] = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as ex:
+            for chunk_assmnts in ex.map(tracing.traced(_fetch_chunk), chunks):
+                for assmnt in chunk_assmnts:
+                    if str(assmnt['appointmentId']) in wanted:
+                        assmnts_by_id[assmnt['id']] = assmnt
+        return list(assmnts_by_id.values())
     
     return []
 
@@ -147,7 +239,7 @@ def fetch_appts(
                 "startsOnOrAfter": starts_after,
                 "startsBefore": starts_before,
             }
-    appts = _client.get_all(base_path, params=params)
+    appts = get_all_projected(_client, base_path, 'appointments', params=params)
     return appts
 
 # @st.cache_data(show_spinner=False)
@@ -183,5 +275,47 @@ def fetch_estimates(
                 "createdOnOrAfter": created_after,
                 "createdBefore": created_before,
             }
-    ests = _client.get_all(base_path, params=params)
-    return ests
\ No newline at end of file
+    ests = get_all_projected(_client, base_path, 'estimates', params=params)
+    return ests
+
+def jobs_created_before(jobs: List[Dict[str, Any]], utc_timestamp: str) -> List[str]:
+    """Ids of jobs created before `utc_timestamp`. A job's estimates can't be older than the job."""
+    created = pd.to_datetime(pd.Series([job.get('createdOn') for job in jobs], dtype=object), utc=True, format='ISO8601', errors='coerce')
+    cutoff = pd.Timestamp(utc_timestamp)
+    return [str(job['id']) for job, ts in zip(jobs, created) if pd.isna(ts) or ts < cutoff]
+
+def fetch_estimates_by_job(
+    job_ids: List,
+    _client: ServiceTitanClient,
+    created_before: Optional[_dt.date] = None,
+    max_workers: int = 6,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieve each job's estimates, whenever they were created (up to the end of `created_before`).
+
+    The estimates endpoint has no job id-list filter (its `ids` filter is estimate ids), so this
+    is one request per job. Only use it for the few jobs outside a created-date window, see
+    ESTIMATE_LOOKBACK_DAYS.
+    """
+    job_ids = list(dict.fromkeys(str(job_id) for job_id in job_ids))
+    if not job_ids:
+        return {}
+    base_path = _client.build_url('sales', 'estimates')
+    params = {}
+    if created_before:
+        params["createdBefore"] = _client.end_of_day_utc_string(created_before)
+
+    def _fetch_job(job_id):
+        return get_all_projected(_client, base_path, 'estimates', params={**params, "jobId": job_id})
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(job_ids))) as ex:
+        return dict(zip(job_ids, ex.map(tracing.traced(_fetch_job), job_ids)))
+
+def filter_estimates(estimates: List[Dict[str, Any]], job_ids: Iterable, created_before_utc: str) -> List[Dict[str, Any]]:
+    """The estimates on `job_ids` created before `created_before_utc`, de-duplicated by id."""
+    wanted = {str(job_id) for job_id in job_ids}
+    estimates = list({est['id']: est for est in estimates if str(est.get('jobId')) in wanted}.values())
+    created = pd.to_datetime(pd.Series([est.get('createdOn') for est in estimates], dtype=object), utc=True, format='ISO8601', errors='coerce')
+    cutoff = pd.Timestamp(created_before_utc)
+    return [est for est, ts in zip(estimates, created) if not pd.isna(ts) and ts < cutoff]
+
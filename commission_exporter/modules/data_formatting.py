@@ -3,10 +3,51 @@ from __future__ import annotations
 from typing import Dict, List, Set, Tuple, Optional, Any, Iterable
 import json
 
+import pandas as pd
+
 from servicetitan_api_client import ServiceTitanClient
 import modules.lookup_tables as lookup
 import modules.helpers as helpers
 
+def localise_st_dates(values: List[Optional[str]], tenant_code: str, fmts: Dict[str, str]) -> Tuple[List, Dict[str, List]]:
+    """
+    Parse a column of ServiceTitan UTC timestamps and convert them to the tenant's timezone in one step.
+
+    Returns the local datetimes and, for each name in `fmts`, the values formatted with that
+    strftime format. Missing or unparseable timestamps come back as None. The timezone comes from
+    lookup_tables.get_timezone_from_tenant, which raises for a tenant it doesn't know.
+    """
+    tz = lookup.get_timezone_from_tenant(tenant_code)
+    local = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format='ISO8601', errors='coerce').dt.tz_convert(tz)
+    missing = local.isna().tolist()
+    dts = [None if m else ts.to_pydatetime() for m, ts in zip(missing, local)]
+    strs = {
+        name: [None if m else v for m, v in zip(missing, local.dt.strftime(fmt))]
+        for name, fmt in fmts.items()
+    }
+    return dts, strs
+
+def localise_job_dates(jobs: List[Dict], tenant_code: str) -> List[Dict]:
+    """Add local datetimes and date strings for each job's created, completed and first appointment times, used by format_job."""
+    columns = {
+        'created': [job['createdOn'] for job in jobs],
+        'completed': [job['completedOn'] for job in jobs],
+        'first_appt_start': [(job.get('first_appt') or {}).get('start') for job in jobs],
+    }
+    for name, values in columns.items():
+        dts, strs = localise_st_dates(values, tenant_code, {'str': "%d/%m/%Y"})
+        for job, dt_val, str_val in zip(jobs, dts, strs['str']):
+            job[f'{name}_local_dt'] = dt_val
+            job[f'{name}_local_str'] = str_val
+    return jobs
+
+def localise_payment_dates(payments: List[Dict], tenant_code: str) -> List[Dict]:
+    """Add each payment's local date as a YYYY-MM-DD string, used by format_payment."""
+    _, strs = localise_st_dates([payment.get('date') for payment in payments], tenant_code, {'date': "%Y-%m-%d"})
+    for payment, date_str in zip(payments, strs['date']):
+        payment['local_date_str'] = date_str
+    return payments
+
 def check_unsuccessful(job, tags):
     unsuccessful_tags = {tag.get("id") for tag in tags if "Unsuccessful" in tag.get("name") or "Cancelled" in tag.get("name")}
     job_tags = set(job.get('tagTypeIds'))
@@ -46,15 +87,16 @@ def format_job(job, client: ServiceTitanClient, tenant_tags: list, exdata_key='d
         else:
             formatted['sold_by'] = str(job_appt_techs[0])
 
+    # Local dates are added to all jobs at once by localise_job_dates before formatting
     if job['first_appt']:
-        formatted['first_appt_start_dt'] = client.from_utc(job['first_appt']['start'])
-        formatted['first_appt_start_str'] = client.st_date_to_local((job['first_appt']['start']), fmt="%d/%m/%Y")
+        formatted['first_appt_start_dt'] = job['first_appt_start_local_dt']
+        formatted['first_appt_start_str'] = job['first_appt_start_local_str']
 
     formatted['job_id'] = job['id']
-    formatted['created_str'] = client.st_date_to_local(job['createdOn'], fmt="%d/%m/%Y")
-    formatted['created_dt'] = client.from_utc(job['createdOn'])
-    formatted['completed_str'] = client.st_date_to_local(job['completedOn'], fmt="%d/%m/%Y") if job['completedOn'] is not None else "No data"
-    formatted['completed_dt'] = client.from_utc(job['completedOn']) if job['completedOn'] is not None else None
+    formatted['created_str'] = job['created_local_str']
+    formatted['created_dt'] = job['created_local_dt']
+    formatted['completed_str'] = job['completed_local_str'] if job['completedOn'] is not None else "No data"
+    formatted['completed_dt'] = job['completed_local_dt'] if job['completedOn'] is not None else None
     formatted['num'] = job['jobNumber'] if job['jobNumber'] is not None else -1
     formatted['status'] = job['jobStatus'] if job['jobStatus'] is not None else "No data"
     formatted['invoiceId'] = job['invoiceId'] if job['invoiceId'] is not None else -1
@@ -127,11 +169,9 @@ def format_payment(payment, client: ServiceTitanClient):
         formatted = {}
         formatted['invoiceId'] = invoice['appliedTo']
         formatted['payment_types'] = payment['type']
-        try:    
-            formatted['payment_dates'] = client.st_date_to_local(payment['date'])[:10] # cut off at just date
-            # formatted['payment_dates'] = client.st_date_to_local(invoice['appliedOn'])[:10] # cut off at just date
-        except KeyError:
-            formatted['payment_dates'] = 'no payment date'
+        # Added to all payments at once by localise_payment_dates before formatting
+        formatted['payment_dates'] = payment['local_date_str'] or 'no payment date'
+        # formatted['payment_dates'] = client.st_date_to_local(invoice['appliedOn'])[:10] # cut off at just date
         all_payment_types = lookup.get_all_payment_types()
         formatted['payment_details'] = f"{all_payment_types.get(payment['type'], payment['type'])}|{invoice.get('appliedAmount', '0')}"
         # formatted['payment_details'] = {'type': payment['type'], 'amount': invoice.get('appliedAmount', '0')}
@@ -0,0 +1,216 @@
+"""
+Commission exports run as background jobs by the worker (worker.py).
+
+The page submits a job, which saves it to GCS and queues a Cloud Task per state that POSTs it to the
+worker. Each task runs the export for its state, writing its progress and per-stage status to a part
+blob as it goes, and uploads the finished workbook next to the job:
+
+    export_jobs/<user>/<job_id>.json
+    export_jobs/<user>/<job_id>/parts/<state>.json
+    export_jobs/<user>/<job_id>/commissions_<state>_<start>_<end>.xlsx
+
+load_job combines the parts into the job's status, stages and results. The page polls the job
+blobs, so an export keeps going if the browser is closed or refreshed.
+
+A running part is saved at least every HEARTBEAT_SECONDS. Cloud Tasks delivers at least once, and
+retries a task still running past its dispatch deadline, so the worker turns away a task whose part
+has been saved within RUNNING_STALE_AFTER and lets it take over a part that has gone quiet.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Any
+
+import modules.google_store as gs
+import modules.tasks as tasks
+from modules.tracing import Stage
+
+JOBS_PREFIX = os.environ.get("EXPORT_JOBS_PREFIX", "export_jobs")
+WORKER_URL = os.environ.get("COMMISSION_WORKER_URL", "")
+PROGRESS_SAVE_INTERVAL = 2.0 # seconds; stage updates in between are saved with the next one
+HEARTBEAT_SECONDS = 60
+RUNNING_STALE_AFTER = timedelta(minutes=5)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+def job_blob(user: str, job_id: str) -> str:
+    return f"{JOBS_PREFIX}/{user}/{job_id}.json"
+
+def result_blob(user: str, job_id: str, file_name: str) -> str:
+    return f"{JOBS_PREFIX}/{user}/{job_id}/{file_name}"
+
+def part_blob(user: str, job_id: str, state: str) -> str:
+    return f"{JOBS_PREFIX}/{user}/{job_id}/parts/{state}.json"
+
+def save_job(job: Dict[str, Any]) -> None:
+    job['updated_at'] = _now()
+    gs.save_file(job, job_blob(job['user'], job['job_id']))
+
+def new_part(state: str) -> Dict[str, Any]:
+    return {
+        'state': state,
+        'status': 'queued',
+        'message': 'Waiting for the worker...',
+        'started_at': None,
+        'finished_at': None,
+        'stages': [],
+        'result': None,
+        'error': None,
+    }
+
+def save_part(part: Dict[str, Any], blob: str) -> None:
+    part['updated_at'] = _now()
+    gs.save_file(part, blob)
+
+def load_part(blob: str) -> Optional[Dict[str, Any]]:
+    return gs.load_file(blob) or None
+
+def is_running(part: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """True if the part is running and has been saved recently, so its worker is still going."""
+    if part['status'] != 'running' or not part.get('updated_at'):
+        return False
+    return (now or datetime.now()) - datetime.fromisoformat(part['updated_at']) < RUNNING_STALE_AFTER
+
+def combine_parts(job: Dict[str, Any], parts: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """The job with the status, message, stages and results of its per-state parts filled in."""
+    parts = {state: part or new_part(state) for state, part in parts.items()}
+    statuses = [part['status'] for part in parts.values()]
+    errors = [f"{state}: {part['error']}" for state, part in parts.items() if part['error']]
+    if job['status'] == 'error':
+        status = 'error' # couldn't be queued
+    elif 'running' in statuses or ('queued' in statuses and 'done' in statuses):
+        status = 'running'
+    elif 'queued' in statuses:
+        status = 'queued'
+    else:
+        status = 'error' if errors else 'done'
+    running = [f"{state}: {part['message']}" for state, part in parts.items() if part['status'] == 'running']
+    started = [part['started_at'] for part in parts.values() if part['started_at']]
+    finished = [part['finished_at'] for part in parts.values() if part['finished_at']]
+    return {
+        **job,
+        'status': status,
+        'message': '; '.join(running) or ('Done' if status == 'done' else job['message']),
+        'started_at': min(started, default=None),
+        'finished_at': max(finished, default=None) if status in ('done', 'error') else None,
+        'updated_at': max([job.get('updated_at') or ''] + [part.get('updated_at') or '' for part in parts.values()]),
+        'stages': [stage for part in parts.values() for stage in part['stages']],
+        'results': {state: part['result'] for state, part in parts.items() if part['status'] == 'done'},
+        'error': job['error'] or '; '.join(errors) or None,
+    }
+
+def load_job(user: str, job_id: str) -> Optional[Dict[str, Any]]:
+    job = gs.load_file(job_blob(user, job_id)) or None
+    if job is None or 'parts' not in job:
+        return job
+    return combine_parts(job, {state: load_part(part_blob(user, job_id, state)) for state in job['parts']})
+
+def list_jobs(user: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """The user's most recent jobs, newest first. Job ids start with the submit time, so they sort by it."""
+    prefix = f"{JOBS_PREFIX}/{user}/"
+    names = [name for name in gs.list_blob_names(prefix) if name.endswith('.json') and '/' not in name[len(prefix):]]
+    jobs = [load_job(user, name[len(prefix):-len('.json')]) for name in sorted(names, reverse=True)[:limit]]
+    return [job for job in jobs if job]
+
+def submit_job(user: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Save a new job and queue a task per state for the worker. `params` are run_export's arguments, with dates as ISO strings."""
+    if not WORKER_URL:
+        raise RuntimeError("COMMISSION_WORKER_URL isn't set, so exports can't run in the background.")
+    job = {
+        'job_id': datetime.now().strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6],
+        'user': user,
+        'params': params,
+        'parts': list(params['states']),
+        'status': 'queued',
+        'message': 'Waiting for the worker...',
+        'submitted_at': _now(),
+        'error': None,
+        'task_names': {},
+    }
+    save_job(job)
+    try:
+        for state in job['parts']:
+            job['task_names'][state] = tasks.create_task(
+                WORKER_URL.rstrip('/') + '/tasks/run-export', {'user': user, 'job_id': job['job_id'], 'state': state},
+            )
+    except Exception as e:
+        job.update(status='error', error=f"Couldn't queue the export: {e}", finished_at=_now())
+        save_job(job)
+        raise
+    save_job(job)
+    return combine_parts(job, {state: None for state in job['parts']})
+
+class JobProgress:
+    """
+    Records an export's progress on a job part, for RunTrace.on_stage and run_export's `step`.
+    `save` writes the part back.
+    """
+
+    def __init__(self, part: Dict[str, Any], save: Callable[[Dict[str, Any]], None]):
+        self.part = part
+        self.save = save
+        self._last_save = 0.0
+        self._lock = threading.RLock()
+
+    def _save(self, force: bool = False) -> None:
+        with self._lock:
+            if force or time.monotonic() - self._last_save >= PROGRESS_SAVE_INTERVAL:
+                self.save(self.part)
+                self._last_save = time.monotonic()
+
+    @contextmanager
+    def heartbeat(self, interval: float = HEARTBEAT_SECONDS):
+        """Save the part every `interval` seconds while the block runs, so a long stage doesn't look stale."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                self._save(force=True)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @contextmanager
+    def step(self, message: str):
+        with self._lock:
+            self.part['message'] = message
+        yield
+
+    def on_stage(self, event: str, stage: Stage) -> None:
+        with self._lock:
+            self._on_stage(event, stage)
+
+    def _on_stage(self, event: str, stage: Stage) -> None:
+        if event == 'start':
+            self.part['stages'].append({
+                'stage': stage.name,
+                'state': stage.state,
+                'tenant': stage.tenant,
+                'status': 'running',
+                'started_at': _now(),
+            })
+        else:
+            entry = next(
+                e for e in reversed(self.part['stages'])
+                if e['status'] == 'running' and (e['stage'], e['state'], e['tenant']) == (stage.name, stage.state, stage.tenant)
+            )
+            entry.update(
+                status='error' if stage.error else 'done',
+                wall_s=stage.wall_s,
+                rows=stage.rows,
+                error=stage.error,
+            )
+        self._save(force=stage.error is not None)
@@ -10,10 +10,13 @@ import streamlit as st
 import streamlit_authenticator as stauth
 from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
-import holidays
+import numpy as np
+
+from modules.holiday_calendar import HolidayCalendar, get_calendar
 
 from servicetitan_api_client import ServiceTitanClient
 import modules.google_store as gs
+import modules.st_fixtures as st_fixtures
 
 import modules.data_formatting as format
 import modules.data_fetching as fetching
@@ -28,6 +31,7 @@ def flatten_list(
 def get_client(
         tenant
     ) -> ServiceTitanClient:
+    st_fixtures.install() # no-op unless ST_FIXTURE_MODE is set
     @st.cache_resource(show_spinner=False)
     def _create_client(tenant) -> ServiceTitanClient:
             client = ServiceTitanClient(
@@ -174,27 +178,22 @@ def get_dates_in_month_datetime(
 
 def get_public_holidays(
         state: str
-    ):
-    national = holidays.Australia()
-    state_hols = holidays.Australia(subdiv=state)
-
-    combined = holidays.HolidayBase()
-    combined.update(national)
-    combined.update(state_hols)
-    return combined
+    ) -> HolidayCalendar:
+    return get_calendar(state)
 
 def get_threshold_days(
         dates: List[date], 
-        holidays: List[date]
+        holidays: HolidayCalendar | List[date]
     ):
-    threshold_days = 0
-    for day in dates:
-        if day not in holidays and day.weekday() not in [5,6]:
-            threshold_days += 1
-    return threshold_days
+    if isinstance(holidays, HolidayCalendar):
+        return holidays.threshold_days(dates)
+    if len(dates) == 0:
+        return 0
+    holiday_dates = np.array(list(holidays), dtype='datetime64[D]')
+    return int(np.is_busday(np.array(dates, dtype='datetime64[D]'), holidays=holiday_dates).sum())
 
-def get_holidays(state: str):
-    return holidays.Australia(state=state)
+def get_holidays(state: str) -> HolidayCalendar:
+    return get_calendar(state)
 
 def australian_public_holidays_between(
         start_date: date,
@@ -221,12 +220,4 @@ def australian_public_holidays_between(
     if start_date > end_date:
         raise ValueError("start_date must be before or equal to end_date")
 
-    au_holidays = holidays.Australia(state=state)
-
-    results = []
-    current = start_date
-    while current <= end_date:
-        if current in au_holidays:
-            results.append(current)
-        current += timedelta(days=1)
-    return results
\ No newline at end of file
+    return get_calendar(state).holidays_between(start_date, end_date)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import List, Iterable
+
+import numpy as np
+import holidays
+
+# Years precomputed for each state. Membership checks outside this range still work (slower),
+# but business day counts assume no holidays outside it.
+CALENDAR_YEARS = range(date.today().year - 5, date.today().year + 6)
+
+WEEKMASK = '1111100' # Mon-Fri
+
+class HolidayCalendar:
+    """
+    Public holidays (national and state) for one Australian state, indexed for vectorised lookups.
+
+    Supports ``date in calendar`` like a ``holidays.HolidayBase``, plus array
+    versions of holiday membership and business day counting.
+    """
+
+    def __init__(self, state: str, years: Iterable[int] = CALENDAR_YEARS):
+        self.state = state
+        self.years = range(min(years), max(years) + 1)
+        self._holidays = holidays.Australia(subdiv=state, years=self.years)
+        self.holiday_dates = np.array(sorted(self._holidays.keys()), dtype='datetime64[D]')
+        self._holiday_set = frozenset(self._holidays.keys())
+        self.busdaycal = np.busdaycalendar(weekmask=WEEKMASK, holidays=self.holiday_dates)
+
+    def __contains__(self, day) -> bool:
+        if isinstance(day, datetime):
+            day = day.date()
+        if isinstance(day, date) and day.year in self.years:
+            return day in self._holiday_set
+        return day in self._holidays
+
+    def get(self, day, default=None):
+        """Holiday name for a date, like ``holidays.HolidayBase.get``."""
+        return self._holidays.get(day, default)
+
+    def is_holiday(self, dates) -> np.ndarray:
+        """Boolean array, True where the date is a public holiday."""
+        return np.isin(np.asarray(dates, dtype='datetime64[D]'), self.holiday_dates)
+
+    def is_business_day(self, dates) -> np.ndarray:
+        """Boolean array, True for weekdays that aren't public holidays."""
+        return np.is_busday(np.asarray(dates, dtype='datetime64[D]'), busdaycal=self.busdaycal)
+
+    def business_days_between(self, start_dates, end_dates) -> np.ndarray:
+        """Business days from each start to each end date, both inclusive. Takes scalars or arrays."""
+        start_dates = np.asarray(start_dates, dtype='datetime64[D]')
+        end_dates = np.asarray(end_dates, dtype='datetime64[D]') + np.timedelta64(1, 'D')
+        return np.busday_count(start_dates, end_dates, busdaycal=self.busdaycal)
+
+    def threshold_days(self, dates) -> int:
+        """Number of business days in ``dates``."""
+        if len(dates) == 0:
+            return 0
+        return int(self.is_business_day(dates).sum())
+
+    def holidays_between(self, start_date: date, end_date: date) -> List[date]:
+        """Public holidays from start_date to end_date inclusive."""
+        start, end = np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D')
+        in_range = self.holiday_dates[(self.holiday_dates >= start) & (self.holiday_dates <= end)]
+        return [d.item() for d in in_range]
+
+@lru_cache(maxsize=None)
+def get_calendar(state: str) -> HolidayCalendar:
+    """Calendar for a state, built once per process."""
+    return HolidayCalendar(state)
@@ -42,6 +42,22 @@ def get_state_from_tenant(tenant: Optional[str] = None):
     if tenant: return tenants[tenant]
     return tenants
 
+def get_timezone_from_tenant(tenant: Optional[str] = None):
+    """Local timezone of each tenant's jobs, for turning ServiceTitan's UTC timestamps into local dates."""
+    timezones = {
+        'foxtrotwhiskey': 'Australia/Sydney',
+        'bravogolf': 'Australia/Brisbane',
+        'mikeecho': 'Australia/Melbourne',
+        'sierradelta': 'Australia/Perth',
+        'alphabravo': 'Australia/Sydney',
+        'echozulu': 'Australia/Brisbane',
+        'victortango': 'Australia/Melbourne',
+    }
+    if tenant is None: return timezones
+    if tenant not in timezones:
+        raise KeyError(f"No timezone for tenant {tenant!r}. Add it to get_timezone_from_tenant in lookup_tables.py.")
+    return timezones[tenant]
+
 def get_tenant_from_state(state: Optional[str] = None) -> dict[str,list] | list:
     mapping = {
         'NSW': ['foxtrotwhiskey', 'alphabravo'],
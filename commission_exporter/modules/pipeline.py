@@ -0,0 +1,240 @@
+"""
+The commission export: fetch each tenant's records, format and merge them, then build one workbook per state.
+
+The Streamlit page and the background worker (worker.py) both run exports through `run_export`.
+`step(message)` wraps each step, e.g. with st.spinner on the page or a progress update in the
+worker; per-stage timings go to `trace` as before.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import logging
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+
+import pandas as pd
+
+from modules.excel_templates import CommissionSpreadSheetExporter
+
+import modules.helpers as helpers
+import modules.data_formatting as format
+import modules.data_fetching as fetching
+import modules.lookup_tables as lookup
+import modules.tracing as tracing
+import modules.warehouse as warehouse
+import modules.sync as sync
+import modules.workbook_cache as workbook_cache
+
+logger = logging.getLogger(__name__)
+
+def states_for(state: str) -> List[str]:
+    """The states an export covers, from the state picked in the form."""
+    if state == 'All':
+        return list(lookup.get_tenant_from_state().keys())
+    return [state] # Janky way to force "All" to work with current setup.
+
+def workbook_name(state: str, start_date: _dt.date, end_date: _dt.date) -> str:
+    return f"commissions_{state}_{start_date}_{end_date}.xlsx"
+
+def run_export(
+    states: List[str],
+    timeframe: str,
+    start_date: _dt.date,
+    end_date: _dt.date,
+    spare_rows: int,
+    reuse_data: bool = True,
+    trace: Optional[tracing.RunTrace] = None,
+    step: Callable[[str], ContextManager] = lambda message: nullcontext(),
+) -> Dict[str, Optional[bytes]]:
+    """
+    Build the commission workbook for each state in `states`.
+
+    Returns workbook bytes by state, with None for states that have no appointments in the range.
+    With `reuse_data` off, everything is fetched from ServiceTitan again and the workbook is rebuilt.
+    """
+    if trace is None:
+        trace = tracing.RunTrace(timeframe=timeframe, states=','.join(states), start_date=start_date, end_date=end_date)
+    max_age = warehouse.DEFAULT_MAX_AGE if reuse_data else 0
+    workbooks: Dict[str, Optional[bytes]] = {}
+    for state in states:
+        tenant_codes = lookup.get_tenant_from_state(state)
+        data_present = False # flag for checking if data is present. Only here because refactoring for merging states, not the best way to do it I know.
+        job_records = []
+        employee_map_total = {}
+        for tenant_code in tenant_codes:
+            with step("Loading..."):
+                client = helpers.get_client(tenant_code)
+                if reuse_data:
+                    with step("Syncing changes..."), trace.stage('sync', tenant_code, state) as stage:
+                        stage.rows = sum(sync.sync_tenant(client, tenant_code).values())
+
+                with step("Fetching employee info..."), trace.stage('employees', tenant_code, state) as stage:
+                    employee_map = helpers.get_all_employee_ids(client)
+                    employee_map_total.update(employee_map)
+                    stage.rows = len(employee_map)
+
+                with step("Fetching tags..."), trace.stage('tags', tenant_code, state) as stage:
+                    tenant_tags = fetching.fetch_tag_types(client)
+                    stage.rows = len(tenant_tags)
+
+                with step("Fetching appointments..."), trace.stage('appointments', tenant_code, state) as stage:
+                    appts = warehouse.fetch_scope(
+                        tenant_code, 'appointments', warehouse.scope_key(starts_from=start_date, starts_to=end_date),
+                        lambda: fetching.fetch_appts(client, start_date, end_date), max_age=max_age,
+                        local_query=lambda wh: wh.records_between(tenant_code, 'appointments', 'start', client.start_of_day_utc_string(start_date), client.end_of_day_utc_string(end_date)),
+                    )
+                    stage.rows = len(appts)
+                    logger.debug("%s %s: %d appts", tenant_code, state, len(appts))
+                if len(appts) == 0:
+                    continue
+                
+                with step("Fetching appointments..."):
+                    first_appts = format.get_first_appts(appts)
+                    logger.debug("%s %s: %d first_appts", tenant_code, state, len(first_appts))
+                    if len(first_appts) == 0:
+                        continue
+                    data_present = True # Change to true if any data present.
+                    
+                    job_ids = format.get_job_ids(first_appts)
+                    logger.debug("%s %s: %d job_ids", tenant_code, state, len(job_ids))
+                    appt_ids = [appt['id'] for appt in appts]
+
+                with step("Fetching appointment assignments..."), trace.stage('assignments', tenant_code, state) as stage:
+                    appt_assmnts = warehouse.fetch_scope(
+                        tenant_code, 'appointment_assignments', warehouse.scope_key(appt_ids=appt_ids),
+                        lambda: fetching.fetch_appt_assmnts(client, appt_ids=appt_ids), max_age=max_age,
+                        local_query=lambda wh: wh.records_with_field_in(tenant_code, 'appointment_assignments', 'appointmentId', appt_ids),
+                    )
+                    stage.rows = len(appt_assmnts)
+
+                with step("Fetching jobs..."), trace.stage('jobs', tenant_code, state) as stage:
+                    jobs = warehouse.fetch_ids(
+                        tenant_code, 'jobs', job_ids,
+                        lambda ids: fetching.fetch_jobs(client, job_id_ls=ids), max_age=max_age,
+                    )
+                    stage.rows = len(jobs)
+                    logger.debug("%s %s: %d jobs", tenant_code, state, len(jobs))
+                    invoice_ids = format.get_invoice_ids(jobs)
+
+                with step("Fetching estimates..."), trace.stage('estimates', tenant_code, state) as stage:
+                    # Everything created in a window before the range, then jobs older than the window one by one
+                    window_start = start_date - _dt.timedelta(days=fetching.ESTIMATE_LOOKBACK_DAYS)
+                    window_start_utc = client.start_of_day_utc_string(window_start)
+                    end_utc = client.end_of_day_utc_string(end_date)
+                    estimates = warehouse.fetch_scope(
+                        tenant_code, 'estimates', warehouse.scope_key(created_from=window_start, created_to=end_date),
+                        lambda: fetching.fetch_estimates(window_start, end_date, client), max_age=max_age,
+                        local_query=lambda wh: wh.records_between(tenant_code, 'estimates', 'createdOn', window_start_utc, end_utc),
+                    )
+                    older_job_ids = fetching.jobs_created_before(jobs, window_start_utc)
+                    estimates += warehouse.fetch_keyed_scopes(
+                        tenant_code, 'estimates',
+                        {job_id: warehouse.scope_key(job_id=job_id, created_to=end_date) for job_id in older_job_ids},
+                        lambda ids: fetching.fetch_estimates_by_job(ids, client, created_before=end_date), max_age=max_age,
+                        local_query=lambda wh, ids: wh.records_with_field_in(tenant_code, 'estimates', 'jobId', ids),
+                    )
+                    estimates = fetching.filter_estimates(estimates, job_ids, end_utc)
+                    stage.rows = len(estimates)
+
+                with step("Fetching invoices..."), trace.stage('invoices', tenant_code, state) as stage:
+                    invoices = warehouse.fetch_ids(
+                        tenant_code, 'invoices', invoice_ids,
+                        lambda ids: fetching.fetch_invoices(ids, client), max_age=max_age,
+                    )
+                    stage.rows = len(invoices)
+
+                with step("Fetching payments..."), trace.stage('payments', tenant_code, state) as stage:
+                    payments = warehouse.fetch_scope(
+                        tenant_code, 'payments', warehouse.scope_key(invoice_ids=invoice_ids),
+                        lambda: fetching.fetch_payments(invoice_ids, client), max_age=max_age,
+                        local_query=lambda wh: wh.payments_for_invoices(tenant_code, invoice_ids),
+                    )
+                    stage.rows = len(payments)
+                
+                with step("Formatting data..."), trace.stage('formatting', tenant_code, state) as stage:
+                    appt_assmnts = [format.format_appt_assmt(appt) for appt in appt_assmnts]
+                    appt_assmnts_by_job, num_appts_per_job = format.group_appt_assmnts_by_job(appt_assmnts)
+                    first_appts_by_id = format.extract_id_to_key(first_appts, 'jobId')
+                    for job in jobs:
+                        job['appt_techs'] = set(appt_assmnts_by_job.get(job['id'], []))
+                        job['num_of_appts_in_mem'] = num_appts_per_job.get(job['id'], 0)
+                        job['first_appt'] = first_appts_by_id.get(job['id'], {})
+                    jobs = format.localise_job_dates(jobs, tenant_code)
+                    jobs_w_nones = [format.format_job(job, client, tenant_tags, exdata_key='docchecks_live') for job in jobs]
+                    jobs = [job for job in jobs_w_nones if job is not None]
+                    stage.rows = len(jobs)
+                    if len(jobs) == 0:
+                        continue
+                    invoices = [format.format_invoice(invoice) for invoice in invoices]
+                    payments = format.localise_payment_dates(payments, tenant_code)
+                    payments = helpers.flatten_list([format.format_payment(payment, client) for payment in payments])
+                    open_estimates = [e for e in [format.format_estimate(est, sold=False) for est in estimates] if e is not None]
+                    sold_estimates = [e for e in [format.format_estimate(est, sold=True) for est in estimates] if e is not None]
+
+                    jobs_df = pd.DataFrame(jobs)
+                    
+                    if len(invoices) == 0:
+                        invoices_df = pd.DataFrame(columns=['invoiceId'])
+                    else:
+                        invoices_df = pd.DataFrame(invoices)
+                    if len(payments) == 0:
+                        payments_df = pd.DataFrame(columns=['invoiceId'])
+                    else:
+                        payments_df = pd.DataFrame(payments)
+                    payments_grouped = payments_df.groupby('invoiceId', as_index=False).agg(lambda x: ', '.join(sorted(list(set(x)))))
+                    
+                    open_estimates_df = pd.DataFrame(open_estimates)
+                    if open_estimates_df.empty:
+                        open_estimates_df = pd.DataFrame(columns=['job_id', 'est_subtotal'])
+                        
+                    sold_estimates_df = pd.DataFrame(sold_estimates)
+                    if sold_estimates_df.empty:
+                        sold_estimates_df = pd.DataFrame(columns=['job_id', 'est_subtotal'])
+                        
+                    open_estimates_grouped = open_estimates_df.groupby('job_id', as_index=False).agg({'est_subtotal': 'sum'})
+                    sold_estimates_grouped = sold_estimates_df.groupby('job_id', as_index=False).agg({'est_subtotal': 'sum'})
+
+                with step("Merging data..."), trace.stage('merge', tenant_code, state) as stage:
+                    merged = warehouse.merge_commission_frames(jobs_df, invoices_df, payments_grouped, open_estimates_grouped, sold_estimates_grouped)
+                    
+                    if 'first_appt_start_dt' in merged.columns:
+                        merged = merged.sort_values(by='first_appt_start_dt')
+                    job_records_tmp = merged.to_dict(orient='records')
+                    for job in job_records_tmp:
+                        job['payments_in_time'] = helpers.check_payment_dates(job, end_date)
+                    stage.rows = len(job_records_tmp)
+                    
+                    job_records.extend(job_records_tmp)
+        if data_present:    
+            relevant_holidays = helpers.get_holidays(state)
+            if timeframe == "Custom":
+                timeframe = 'Weekly' # will possibly break a lot of summary functionality, but there are a lot of hardcoded things for weekly/monthly!
+
+            with step("Checking for a saved workbook..."), trace.stage('workbook_cache', state=state) as stage:
+                cache_prefix = workbook_cache.workbook_prefix(state, timeframe, start_date, end_date, spare_rows)
+                cache_fp = workbook_cache.fingerprint(job_records, employee_map_total, relevant_holidays)
+                excel_bytes = workbook_cache.load(cache_prefix, cache_fp) if reuse_data else None
+                stage.output_bytes = len(excel_bytes or b'')
+
+            if excel_bytes is not None:
+                logger.info("Serving saved workbook for %s, %s to %s, nothing has changed.", state, start_date, end_date)
+            else:
+                with step("Separating by technician..."), trace.stage('grouping', state=state) as stage:
+                    # group by tech name
+                    # print(relevant_holidays)
+                    job_records.sort(key = lambda x: x["first_appt_start_str"])
+                    jobs_by_tech = format.group_jobs_by_tech(job_records, employee_map_total, end_date, relevant_holidays)
+                    stage.rows = len(jobs_by_tech)
+
+                with step("Building spreadsheet..."), trace.stage('workbook', state=state) as stage:
+                    builder = CommissionSpreadSheetExporter(jobs_by_tech, end_date, timeframe=timeframe.lower(), col_offset=1, holidays=relevant_holidays, scheme=state, spare_rows=spare_rows)
+                    
+                    excel_bytes = builder.build_workbook()
+                    stage.rows = len(job_records)
+                    stage.output_bytes = len(excel_bytes)
+                    logger.info("Workbook built for %s, %s to %s.", state, start_date, end_date)
+                workbook_cache.save(cache_prefix, cache_fp, excel_bytes)
+            workbooks[state] = excel_bytes
+        else:
+            workbooks[state] = None
+    return workbooks
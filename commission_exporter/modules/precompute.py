@@ -0,0 +1,149 @@
+"""
+Weekly and monthly "All" commission exports built ahead of time, so the page can serve them straight away.
+
+Cloud Scheduler POSTs to the worker's /tasks/precompute early every morning, with an OIDC token for
+a service account that can invoke the worker, which doesn't accept unauthenticated requests. That
+queues Cloud Tasks (/tasks/precompute-period), one per state, for each of these periods that hasn't
+been built yet:
+- last week, Monday to Sunday, which is new each Monday
+- last month, which is new on the 1st
+so the other days are no-ops. Each run is exported like a background job (modules/export_jobs.py),
+and the workbooks are saved next to the run and its per-state parts:
+
+    precomputed/<timeframe>/<start>_<end>.json
+    precomputed/<timeframe>/<start>_<end>/parts/<state>.json
+    precomputed/<timeframe>/<start>_<end>/commissions_<state>_<start>_<end>.xlsx
+
+The workbooks are also saved to the workbook cache as usual, so an export run from the page with the
+same options reuses them if nothing has changed since.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Any
+from zoneinfo import ZoneInfo
+
+import modules.google_store as gs
+import modules.helpers as helpers
+import modules.tasks as tasks
+import modules.pipeline as pipeline
+import modules.export_jobs as export_jobs
+
+PRECOMPUTE_PREFIX = os.environ.get("PRECOMPUTE_PREFIX", "precomputed")
+SPARE_ROWS = 5 # the page's default
+
+SCHEDULE_TIMEZONE = "Australia/Sydney"
+# A queued or running run that hasn't been saved for this long has lost its tasks, e.g. the worker
+# was restarted or the queue gave up, so the next schedule queues it again
+RUN_STALE_AFTER = timedelta(seconds=tasks.DISPATCH_DEADLINE) + timedelta(minutes=30)
+
+logger = logging.getLogger(__name__)
+
+Period = Tuple[str, _dt.date, _dt.date]
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+def local_today() -> _dt.date:
+    """Today in Sydney. The worker runs in UTC, where an early morning run is still the day before."""
+    return datetime.now(ZoneInfo(SCHEDULE_TIMEZONE)).date()
+
+def previous_week(today: _dt.date) -> Period:
+    last_monday = today - _dt.timedelta(days=today.weekday() + 7)
+    return 'Weekly', last_monday, last_monday + _dt.timedelta(days=6)
+
+def previous_month(today: _dt.date) -> Period:
+    last_month_end = today.replace(day=1) - _dt.timedelta(days=1)
+    return 'Monthly', last_month_end.replace(day=1), helpers.get_last_day_of_month_datetime(last_month_end.year, last_month_end.month)
+
+def periods(today: _dt.date) -> List[Period]:
+    """The periods that should have a precomputed export as of `today`."""
+    return [previous_week(today), previous_month(today)]
+
+def run_blob(timeframe: str, start_date: _dt.date, end_date: _dt.date) -> str:
+    return f"{PRECOMPUTE_PREFIX}/{timeframe.lower()}/{start_date}_{end_date}.json"
+
+def result_blob(timeframe: str, start_date: _dt.date, end_date: _dt.date, file_name: str) -> str:
+    return f"{PRECOMPUTE_PREFIX}/{timeframe.lower()}/{start_date}_{end_date}/{file_name}"
+
+def part_blob(timeframe: str, start_date: _dt.date, end_date: _dt.date, state: str) -> str:
+    return f"{PRECOMPUTE_PREFIX}/{timeframe.lower()}/{start_date}_{end_date}/parts/{state}.json"
+
+def save_run(run: Dict[str, Any]) -> None:
+    run['updated_at'] = _now()
+    params = run['params']
+    gs.save_file(run, run_blob(params['timeframe'], _dt.date.fromisoformat(params['start_date']), _dt.date.fromisoformat(params['end_date'])))
+
+def load_run(timeframe: str, start_date: _dt.date, end_date: _dt.date) -> Optional[Dict[str, Any]]:
+    """The run with its parts combined, see export_jobs.combine_parts."""
+    run = gs.load_file(run_blob(timeframe, start_date, end_date)) or None
+    if run is None:
+        return None
+    return export_jobs.combine_parts(run, {state: export_jobs.load_part(part_blob(timeframe, start_date, end_date, state)) for state in run['parts']})
+
+def new_run(timeframe: str, start_date: _dt.date, end_date: _dt.date) -> Dict[str, Any]:
+    """A run in the same shape as a background job, so the worker runs and reports it the same way."""
+    states = pipeline.states_for('All')
+    return {
+        'job_id': f"precompute-{timeframe.lower()}-{start_date}-{end_date}",
+        'params': {
+            'state': 'All',
+            'states': states,
+            'timeframe': timeframe,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'spare_rows': SPARE_ROWS,
+            'reuse_data': True,
+        },
+        'parts': list(states),
+        'status': 'queued',
+        'message': 'Waiting for the worker...',
+        'submitted_at': _now(),
+        'error': None,
+        'task_names': {},
+    }
+
+def is_stale(run: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """True if the run is queued or running but nothing has saved it for RUN_STALE_AFTER."""
+    if run['status'] not in export_jobs.ACTIVE_STATUSES:
+        return False
+    return (now or datetime.now()) - datetime.fromisoformat(run['updated_at']) > RUN_STALE_AFTER
+
+def schedule_due(today: _dt.date, force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Queue precompute tasks, one per state, for each of today's periods that isn't built, queued or running.
+    Failed and stale runs (see is_stale) are queued again for the states that didn't finish. With `force`,
+    every period is rebuilt.
+    """
+    if not export_jobs.WORKER_URL:
+        raise RuntimeError("COMMISSION_WORKER_URL isn't set, so precompute tasks can't be queued.")
+    queued = []
+    for timeframe, start_date, end_date in periods(today):
+        existing = load_run(timeframe, start_date, end_date)
+        if existing and existing['status'] != 'error' and not is_stale(existing) and not force:
+            logger.info("Precomputed %s export for %s to %s is %s, skipping.", timeframe.lower(), start_date, end_date, existing['status'])
+            continue
+        built = set(existing['results']) if existing and not force else set()
+        run = new_run(timeframe, start_date, end_date)
+        save_run(run)
+        for state in run['parts']:
+            if state in built:
+                continue
+            if existing:
+                # Replaces the earlier attempt's part, which the worker would otherwise skip or wait for
+                export_jobs.save_part(export_jobs.new_part(state), part_blob(timeframe, start_date, end_date, state))
+            run['task_names'][state] = tasks.create_task(
+                export_jobs.WORKER_URL.rstrip('/') + '/tasks/precompute-period',
+                {'timeframe': timeframe, 'start_date': start_date.isoformat(), 'end_date': end_date.isoformat(), 'state': state},
+            )
+        save_run(run)
+        queued.append(run)
+    return queued
+
+def latest_runs(today: _dt.date) -> List[Dict[str, Any]]:
+    """The saved runs for today's periods, whatever their status."""
+    runs = [load_run(*period) for period in periods(today)]
+    return [run for run in runs if run]
@@ -0,0 +1,69 @@
+"""
+Field projections for ServiceTitan records used in commission runs.
+
+ServiceTitan returns every field of a record (invoices include all their items in full), but the
+commission export only reads a handful of them. Fetches project each page down to these fields as
+it arrives, so the full payloads are never held for a whole run and the warehouse stores less.
+
+A field is either a name, or (name, subfields) for a nested object or list of objects. Fields the
+record doesn't have are left out rather than set to None, so formatters see the same keys as before.
+
+If a formatter starts reading a new field, add it here too.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Tuple, Union, Any
+
+Field = Union[str, Tuple[str, Tuple]]
+
+FIELDS: Dict[str, Tuple[Field, ...]] = {
+    # format_job, localise_job_dates, get_invoice_ids
+    'jobs': (
+        'id', 'modifiedOn', 'jobNumber', 'jobStatus', 'soldById', 'appointmentCount', 'createdOn',
+        'completedOn', 'invoiceId', 'tagTypeIds', 'total', 'externalData',
+    ),
+    # format_invoice
+    'invoices': (
+        'id', 'modifiedOn', 'subTotal', 'balance', 'total',
+        ('customerAddress', ('city',)),
+        ('items', ('description', 'skuName', 'price')),
+    ),
+    # format_payment, localise_payment_dates, Warehouse.payments_for_invoices
+    'payments': (
+        'id', 'modifiedOn', 'type', 'date',
+        ('appliedTo', ('appliedTo', 'appliedAmount')),
+    ),
+    # get_first_appts, get_job_ids, localise_job_dates, Warehouse.records_between on 'start'
+    'appointments': ('id', 'modifiedOn', 'jobId', 'appointmentNumber', 'start'),
+    # format_appt_assmt, Warehouse.records_with_field_in on 'appointmentId'
+    'appointment_assignments': (
+        'id', 'modifiedOn', 'jobId', 'appointmentId', 'technicianId', 'technicianName', 'assignedOn',
+    ),
+    # format_estimate, the estimates local_query on 'createdOn'
+    'estimates': (
+        'id', 'modifiedOn', 'jobId', 'subtotal', 'createdOn',
+        ('status', ('name',)),
+    ),
+}
+
+def project(record: Dict[str, Any], fields: Tuple[Field, ...]) -> Dict[str, Any]:
+    """Copy only `fields` out of `record`."""
+    out = {}
+    for field in fields:
+        if isinstance(field, tuple):
+            name, subfields = field
+            if name not in record:
+                continue
+            value = record[name]
+            if isinstance(value, dict):
+                value = project(value, subfields)
+            elif isinstance(value, list):
+                value = [project(v, subfields) if isinstance(v, dict) else v for v in value]
+            out[name] = value
+        elif field in record:
+            out[field] = record[field]
+    return out
+
+def project_all(records: List[Dict[str, Any]], entity: str) -> List[Dict[str, Any]]:
+    fields = FIELDS[entity]
+    return [project(record, fields) for record in records]
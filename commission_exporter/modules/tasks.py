@@ -0,0 +1,44 @@
+from google.cloud import tasks_v2
+from google.protobuf import duration_pb2
+from urllib.parse import urlsplit
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXPORT_QUEUE = 'commission-export-queue'
+DISPATCH_DEADLINE = 1800 # seconds, the most Cloud Tasks allows
+# The worker only accepts requests with an identity token. Tasks sign theirs as this service account,
+# which needs roles/run.invoker on the worker.
+TASKS_SERVICE_ACCOUNT = os.environ.get("COMMISSION_TASKS_SERVICE_ACCOUNT", "")
+
+def create_task(url, payload, project_id='prestigious-gcp', queue=EXPORT_QUEUE, location='australia-southeast1', dispatch_deadline=DISPATCH_DEADLINE):
+    """
+    POST `payload` as JSON to `url` from a Cloud Tasks queue, authenticated as TASKS_SERVICE_ACCOUNT.
+    Exports can take a while, so allow up to the 30 minute maximum.
+    """
+    if not TASKS_SERVICE_ACCOUNT:
+        raise RuntimeError("COMMISSION_TASKS_SERVICE_ACCOUNT isn't set, so tasks can't authenticate to the worker.")
+    service_url = '{0.scheme}://{0.netloc}'.format(urlsplit(url))
+    client = tasks_v2.CloudTasksClient()
+    parent = client.queue_path(project_id, location, queue)
+
+    task = {
+        "http_request": {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "url": url,
+            "headers": {
+                "accept": "application/json",
+                "Content-Type": "application/json"
+            },
+            "body": json.dumps(payload).encode("utf-8"),
+            # Cloud Run checks the token's audience against the service URL, without the path
+            "oidc_token": {"service_account_email": TASKS_SERVICE_ACCOUNT, "audience": service_url},
+        },
+        "dispatch_deadline": duration_pb2.Duration(seconds=dispatch_deadline),
+    }
+
+    response = client.create_task(request={"parent": parent, "task": task})
+    logger.info("Created task %s", response.name)
+    return response.name
@@ -2,6 +2,10 @@ import streamlit as st
 import streamlit_authenticator as stauth
 import modules.google_store as gs
 import modules.helpers as helpers
+import modules.tracing as tracing
+import modules.warehouse as warehouse
+import modules.export_jobs as export_jobs
+import modules.precompute as precompute
 from datetime import date, timedelta
 import json
 import pandas as pd
@@ -22,4 +26,117 @@ def show_download_button(data, file_name, mime="application/vnd.openxmlformats-o
         data=data,
         file_name=file_name,
         mime=mime,
-    )
\ No newline at end of file
+    )
+
+def show_run_traces(limit=20):
+    """Per-stage timings of recent export runs."""
+    paths = tracing.list_traces()[:limit]
+    with st.expander("Run timings"):
+        if not paths:
+            st.write("No runs recorded yet.")
+            return
+        path = st.selectbox("Run", paths, format_func=lambda p: p.rsplit('/', 1)[-1].removesuffix('.json'))
+        trace = tracing.load_trace(path)
+        st.write(f"Started {trace['started_at']}, took {trace['total_s']:.1f}s. " + ', '.join(f"{k}: {v}" for k, v in trace['params'].items()))
+        stages = pd.DataFrame(trace['stages'])
+        if stages.empty:
+            return
+        stages['wait_s'] = (stages['wall_s'] - stages['cpu_s']).clip(lower=0)
+        totals = stages.groupby('stage', sort=False, as_index=False)[['wall_s', 'cpu_s', 'wait_s', 'api_calls', 'bytes_in']].sum()
+        st.write("Totals by stage (wait_s is time not spent on CPU, mostly API calls)")
+        st.dataframe(totals, hide_index=True)
+        st.write("By tenant")
+        st.dataframe(stages, hide_index=True)
+        st.download_button("Download run JSON", data=json.dumps(trace, indent=2), file_name=f"{trace['run_id']}.json", mime="application/json")
+
+def show_warehouse_freshness():
+    """What's stored locally from ServiceTitan and when it was last synced."""
+    with st.expander("Stored ServiceTitan data"):
+        st.dataframe(warehouse.get_warehouse().freshness(), hide_index=True)
+
+JOB_POLL_SECONDS = 5
+
+def show_export_jobs(user, limit=5):
+    """
+    The user's recent background exports. They're listed from GCS once per session (or after a
+    submit, which clears ss.export_jobs), then only the running ones are reloaded, every few
+    seconds inside a fragment, until they finish.
+    """
+    ss = st.session_state
+    if "export_jobs" not in ss:
+        ss.export_jobs = export_jobs.list_jobs(user, limit)
+        ss.export_jobs_fresh = True # so the panel doesn't load them again straight away
+    if not ss.export_jobs:
+        return
+    active = any(job['status'] in export_jobs.ACTIVE_STATUSES for job in ss.export_jobs)
+    st.subheader("Background exports")
+    st.fragment(_export_jobs_panel, run_every=JOB_POLL_SECONDS if active else None)(user, active)
+
+def _export_jobs_panel(user, polling):
+    ss = st.session_state
+    if polling and not ss.pop("export_jobs_fresh", False):
+        ss.export_jobs = [
+            (export_jobs.load_job(user, job['job_id']) or job) if job['status'] in export_jobs.ACTIVE_STATUSES else job
+            for job in ss.export_jobs
+        ]
+        if not any(job['status'] in export_jobs.ACTIVE_STATUSES for job in ss.export_jobs):
+            st.rerun() # everything finished, redraw the page without polling
+    for job in ss.export_jobs:
+        params = job['params']
+        with st.container(border=True):
+            st.write(f"**{params['state']}** {params['timeframe'].lower()}, {params['start_date']} to {params['end_date']}: {job['status']} (submitted {job['submitted_at']})")
+            if job['status'] in export_jobs.ACTIVE_STATUSES:
+                done = sum(1 for stage in job['stages'] if stage['status'] == 'done')
+                st.write(f"{job['message']} ({done} steps done)")
+            elif job['status'] == 'error':
+                st.error(job['error'])
+            else:
+                _show_export_results(job['results'])
+            if job['stages']:
+                with st.expander("Stages"):
+                    st.dataframe(pd.DataFrame(job['stages']), hide_index=True)
+
+def _show_export_results(results):
+    """A "Get" button per workbook, which loads it from GCS and swaps to its download button."""
+    files = st.session_state.setdefault("export_job_files", {})
+    for state, result in results.items():
+        if result is None:
+            st.write(f"No data available for {state}.")
+            continue
+        data = files.get(result['blob'])
+        if data is None and st.button(f"Get {result['name']}", key=f"get_{result['blob']}"):
+            data = files[result['blob']] = gs.load_bytes(result['blob'])
+        if data is not None:
+            st.download_button(
+                f"Download {result['name']}",
+                data=data,
+                file_name=result['name'],
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key=f"download_{result['blob']}",
+            )
+
+PRECOMPUTED_TTL = 5 * 60 # seconds; they're built once a day
+
+@st.cache_data(ttl=PRECOMPUTED_TTL, show_spinner=False)
+def _precomputed_runs(today):
+    # Runs where some states failed or are still building still have workbooks for the others
+    return [run for run in precompute.latest_runs(today) if run['results']]
+
+def show_precomputed_exports():
+    """Last week's and last month's exports for every state, built overnight by the worker."""
+    runs = _precomputed_runs(precompute.local_today())
+    if not runs:
+        return
+    st.subheader("Ready-made exports")
+    st.write(f"Built early in the morning with {precompute.SPARE_ROWS} spare rows. Run the export above for anything entered since then.")
+    for run in runs:
+        params = run['params']
+        with st.container(border=True):
+            if run['status'] in export_jobs.ACTIVE_STATUSES:
+                built = f"{len(run['results'])} of {len(run['parts'])} states built so far"
+            else:
+                built = f"built {run['finished_at']}"
+            st.write(f"**All** {params['timeframe'].lower()}, {params['start_date']} to {params['end_date']} ({built})")
+            if run['error']:
+                st.error(run['error'])
+            _show_export_results(run['results'])
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Any
+
+import requests
+
+# One JSON file per export run is written here and listed in the app.
+TRACE_DIR = os.environ.get("COMMISSION_TRACE_DIR", "/tmp/commission_traces")
+MAX_TRACE_FILES = 200 # oldest run files are removed past this
+
+# The stage currently running. HTTP calls are counted against it, including calls made on worker
+# threads by functions wrapped with `traced`.
+_current_stage: contextvars.ContextVar[Optional[Stage]] = contextvars.ContextVar('commission_trace_stage', default=None)
+_patch_lock = threading.Lock()
+_http_counter_installed = False
+
+class Stage:
+    """Numbers for one stage of an export run, for one tenant."""
+
+    def __init__(self, name: str, tenant: Optional[str] = None, state: Optional[str] = None):
+        self.name = name
+        self.tenant = tenant
+        self.state = state
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.api_calls = 0
+        self.bytes_in = 0
+        self.rows: Optional[int] = None
+        self.output_bytes: Optional[int] = None
+        self.error: Optional[str] = None
+        self._worker_cpu_s = 0.0
+        self._lock = threading.Lock() # counters are updated from worker threads too
+
+    def _count_response(self, nbytes: int) -> None:
+        with self._lock:
+            self.api_calls += 1
+            self.bytes_in += nbytes
+
+    def _add_worker_cpu(self, seconds: float) -> None:
+        with self._lock:
+            self._worker_cpu_s += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'stage': self.name,
+            'tenant': self.tenant,
+            'state': self.state,
+            'wall_s': self.wall_s,
+            'cpu_s': self.cpu_s,
+            'api_calls': self.api_calls,
+            'bytes_in': self.bytes_in,
+            'rows': self.rows,
+            'output_bytes': self.output_bytes,
+            'error': self.error,
+        }
+
+class RunTrace:
+    """
+    Collects per-stage timings for one export run.
+
+    Use `with trace.stage('jobs', tenant=..., state=...) as s:` around each step and set
+    `s.rows` to the number of records it produced. CPU time is the stage thread's plus that of
+    any `traced` functions it ran on worker threads, so a stage whose wall time is much larger
+    than its CPU time was waiting on the API.
+
+    If `on_stage` is set, it's called as on_stage('start', stage) and on_stage('end', stage)
+    around each stage, e.g. to report progress of a background export.
+    """
+
+    def __init__(self, **params):
+        now = datetime.now()
+        self.run_id = now.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        self.started_at = now.isoformat(timespec='seconds')
+        self.params = {k: str(v) for k, v in params.items()}
+        self.stages: List[Stage] = []
+        self.total_s = 0.0
+        self.on_stage: Optional[Callable[[str, Stage], None]] = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, tenant: Optional[str] = None, state: Optional[str] = None):
+        _install_http_counter()
+        stage = Stage(name, tenant, state)
+        token = _current_stage.set(stage)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        if self.on_stage is not None:
+            self.on_stage('start', stage)
+        try:
+            yield stage
+        except Exception as e:
+            stage.error = repr(e)
+            raise
+        finally:
+            stage.wall_s = round(time.perf_counter() - wall_start, 4)
+            stage.cpu_s = round(time.thread_time() - cpu_start + stage._worker_cpu_s, 4)
+            _current_stage.reset(token)
+            self.stages.append(stage)
+            if self.on_stage is not None:
+                self.on_stage('end', stage)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'run_id': self.run_id,
+            'started_at': self.started_at,
+            'total_s': self.total_s,
+            'params': self.params,
+            'stages': [stage.as_dict() for stage in self.stages],
+        }
+
+    def save(self, trace_dir: str = TRACE_DIR) -> str:
+        """Write the run to `<trace_dir>/<run_id>.json` and return the path."""
+        self.total_s = round(time.perf_counter() - self._start, 4)
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, f"{self.run_id}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        for old in list_traces(trace_dir)[MAX_TRACE_FILES:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+def traced(fn: Callable) -> Callable:
+    """
+    Wrap `fn` to run on a worker thread (ThreadPoolExecutor.submit/map) as part of the current stage,
+    so its HTTP calls and CPU time are counted there. Wrap it on the thread that opened the stage.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stage = context.get(_current_stage)
+        cpu_start = time.thread_time()
+        try:
+            # A context can only be entered by one thread at a time, so each call gets its own copy
+            return context.copy().run(fn, *args, **kwargs)
+        finally:
+            if stage is not None:
+                stage._add_worker_cpu(time.thread_time() - cpu_start)
+    return wrapper
+
+def list_traces(trace_dir: str = TRACE_DIR) -> List[str]:
+    """Paths of saved runs, newest first."""
+    if not os.path.isdir(trace_dir):
+        return []
+    paths = [os.path.join(trace_dir, name) for name in os.listdir(trace_dir) if name.endswith('.json')]
+    return sorted(paths, reverse=True)
+
+def load_trace(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+def _install_http_counter() -> None:
+    """Wrap requests.Session.send once per process to count calls and response bytes per stage."""
+    global _http_counter_installed
+    with _patch_lock:
+        if _http_counter_installed:
+            return
+        original_send = requests.Session.send
+
+        def send(self, request, **kwargs):
+            response = original_send(self, request, **kwargs)
+            stage = _current_stage.get()
+            if stage is not None:
+                if kwargs.get('stream'):
+                    # Don't consume streamed bodies, just trust the header
+                    stage._count_response(int(response.headers.get('Content-Length') or 0))
+                else:
+                    stage._count_response(len(response.content or b''))
+            return response
+
+        requests.Session.send = send
+        _http_counter_installed = True
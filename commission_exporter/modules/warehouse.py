@@ -0,0 +1,338 @@
+"""
+Local DuckDB store of ServiceTitan records, so repeat exports don't re-fetch what's already been pulled.
+
+Each entity table holds the raw API records for all tenants, upserted by (tenant, id), with the time
+each record was last synced. Date-range and filter fetches are recorded as "scopes" (the exact query
+and which ids it returned), so a repeat of the same query within `max_age` is answered locally.
+
+The database lives at ST_WAREHOUSE_PATH. DuckDB allows one writing process per file, which matches
+one Streamlit process per container; point it at a mounted volume to keep it across restarts.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple, Optional, Any, Iterable
+
+import duckdb
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+WAREHOUSE_PATH = os.environ.get("ST_WAREHOUSE_PATH", "/tmp/st_warehouse.duckdb")
+DEFAULT_MAX_AGE = int(os.environ.get("ST_WAREHOUSE_MAX_AGE", 15 * 60)) # seconds a synced record/scope counts as fresh
+
+ENTITIES = ('jobs', 'invoices', 'payments', 'appointments', 'appointment_assignments', 'estimates')
+
+class Warehouse:
+    def __init__(self, path: str = WAREHOUSE_PATH):
+        self.path = path
+        self.conn = duckdb.connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            for entity in ENTITIES:
+                self.conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {entity} (
+                        tenant VARCHAR NOT NULL,
+                        id BIGINT NOT NULL,
+                        modified_on VARCHAR,
+                        synced_at TIMESTAMPTZ NOT NULL,
+                        data JSON NOT NULL,
+                        PRIMARY KEY (tenant, id)
+                    )
+                """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_scopes (
+                    tenant VARCHAR NOT NULL,
+                    entity VARCHAR NOT NULL,
+                    scope VARCHAR NOT NULL,
+                    synced_at TIMESTAMPTZ NOT NULL,
+                    ids BIGINT[] NOT NULL,
+                    PRIMARY KEY (tenant, entity, scope)
+                )
+            """)
+            # modifiedOn cursors for incremental sync (see modules/sync.py). chain_started_at is when the
+            # cursor was first set; every record synced since then has been kept up to date by deltas.
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_cursors (
+                    tenant VARCHAR NOT NULL,
+                    entity VARCHAR NOT NULL,
+                    modified_since VARCHAR NOT NULL,
+                    chain_started_at TIMESTAMPTZ NOT NULL,
+                    synced_at TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (tenant, entity)
+                )
+            """)
+
+    def upsert(self, tenant: str, entity: str, records: List[Dict[str, Any]]) -> None:
+        """Insert records, replacing any already stored with the same id."""
+        if not records:
+            return
+        rows = pd.DataFrame({
+            'tenant': tenant,
+            'id': [int(r['id']) for r in records],
+            'modified_on': [r.get('modifiedOn') for r in records],
+            'synced_at': datetime.now(timezone.utc),
+            'data': [json.dumps(r) for r in records],
+        })
+        with self._lock:
+            self.conn.register('incoming', rows)
+            self.conn.execute(f"INSERT OR REPLACE INTO {entity} SELECT tenant, id, modified_on, synced_at, data FROM incoming")
+            self.conn.unregister('incoming')
+
+    def get_by_ids(self, tenant: str, entity: str, ids: Iterable, max_age: Optional[int] = DEFAULT_MAX_AGE) -> Tuple[List[Dict[str, Any]], List]:
+        """Return (records synced within max_age, ids not stored or stale). max_age=None accepts any age."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return [], []
+        sql = f"SELECT id, data FROM {entity} WHERE tenant = ? AND id IN (SELECT unnest(?::BIGINT[]))"
+        params: List[Any] = [tenant, [int(i) for i in ids]]
+        if max_age is not None:
+            sql += " AND synced_at >= now() - to_seconds(?)"
+            params.append(max_age)
+        with self._lock:
+            found = {row[0]: json.loads(row[1]) for row in self.conn.execute(sql, params).fetchall()}
+        missing = [i for i in ids if int(i) not in found]
+        return list(found.values()), missing
+
+    def get_scope(self, tenant: str, entity: str, scope: str, max_age: Optional[int] = DEFAULT_MAX_AGE) -> Optional[List[Dict[str, Any]]]:
+        """Records returned last time `scope` was fetched, or None if it never was or it's stale."""
+        sql = "SELECT ids FROM sync_scopes WHERE tenant = ? AND entity = ? AND scope = ?"
+        params: List[Any] = [tenant, entity, scope]
+        if max_age is not None:
+            sql += " AND synced_at >= now() - to_seconds(?)"
+            params.append(max_age)
+        with self._lock:
+            row = self.conn.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        records, missing = self.get_by_ids(tenant, entity, row[0], max_age=None)
+        return None if missing else records
+
+    def set_scope(self, tenant: str, entity: str, scope: str, records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_scopes VALUES (?, ?, ?, now(), ?)",
+                [tenant, entity, scope, [int(r['id']) for r in records]],
+            )
+
+    def get_cursor(self, tenant: str, entity: str) -> Optional[Tuple[str, str]]:
+        """(modified_since, chain_started_at) for an entity's incremental sync, or None. Times are ISO strings."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT modified_since, CAST(chain_started_at AS VARCHAR) FROM sync_cursors WHERE tenant = ? AND entity = ?",
+                [tenant, entity],
+            ).fetchone()
+
+    def apply_delta(self, tenant: str, entity: str, records: List[Dict[str, Any]], modified_since: str, chain_started_at: str) -> None:
+        """
+        Upsert changed records and advance the cursor. Records synced since the chain started, which the
+        delta didn't touch, are unchanged in ServiceTitan, so they're marked fresh too.
+        """
+        self.upsert(tenant, entity, records)
+        with self._lock:
+            self.conn.execute(f"UPDATE {entity} SET synced_at = now() WHERE tenant = ? AND synced_at >= ?::TIMESTAMPTZ", [tenant, chain_started_at])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_cursors VALUES (?, ?, ?, ?::TIMESTAMPTZ, now())",
+                [tenant, entity, modified_since, chain_started_at],
+            )
+
+    def scope_kept_current(self, tenant: str, entity: str, scope: str, max_age: Optional[int] = DEFAULT_MAX_AGE) -> bool:
+        """
+        True if `scope` was fetched after the entity's sync chain started and the sync has run within
+        max_age, so every record matching it (including ones created since) is in the store.
+        """
+        sql = """
+            SELECT 1 FROM sync_scopes s JOIN sync_cursors c USING (tenant, entity)
+            WHERE s.tenant = ? AND s.entity = ? AND s.scope = ? AND s.synced_at >= c.chain_started_at
+        """
+        params: List[Any] = [tenant, entity, scope]
+        if max_age is not None:
+            sql += " AND c.synced_at >= now() - to_seconds(?)"
+            params.append(max_age)
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone() is not None
+
+    def query(self, tenant: str, entity: str, where: str, params: List[Any]) -> List[Dict[str, Any]]:
+        """Stored records of an entity matching a SQL condition on `data`."""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT data FROM {entity} WHERE tenant = ? AND ({where})", [tenant, *params]).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def records_between(self, tenant: str, entity: str, field: str, start_utc: str, end_utc: str) -> List[Dict[str, Any]]:
+        """Records whose timestamp `field` is in [start_utc, end_utc)."""
+        return self.query(
+            tenant, entity,
+            f"TRY_CAST(data->>'$.{field}' AS TIMESTAMPTZ) >= ?::TIMESTAMPTZ AND TRY_CAST(data->>'$.{field}' AS TIMESTAMPTZ) < ?::TIMESTAMPTZ",
+            [start_utc, end_utc],
+        )
+
+    def records_with_field_in(self, tenant: str, entity: str, field: str, values: List) -> List[Dict[str, Any]]:
+        """Records whose integer `field` is one of `values`."""
+        return self.query(
+            tenant, entity,
+            f"TRY_CAST(data->>'$.{field}' AS BIGINT) IN (SELECT unnest(?::BIGINT[]))",
+            [[int(v) for v in values]],
+        )
+
+    def payments_for_invoices(self, tenant: str, invoice_ids: List) -> List[Dict[str, Any]]:
+        return self.query(
+            tenant, 'payments',
+            "list_has_any(CAST(json_extract(data, '$.appliedTo[*].appliedTo') AS BIGINT[]), ?::BIGINT[])",
+            [[int(i) for i in invoice_ids]],
+        )
+
+    def freshness(self) -> pd.DataFrame:
+        """Record counts and last sync time per tenant and entity."""
+        queries = [
+            f"SELECT tenant, '{entity}' AS entity, count(*) AS records, max(synced_at) AS last_synced FROM {entity} GROUP BY tenant"
+            for entity in ENTITIES
+        ]
+        with self._lock:
+            return self.conn.execute(" UNION ALL ".join(queries) + " ORDER BY tenant, entity").df()
+
+    def export_parquet(self, directory: str) -> None:
+        """Write every entity table to `<directory>/<entity>/tenant=<tenant>/*.parquet` for other tools to read."""
+        with self._lock:
+            for entity in ENTITIES:
+                self.conn.execute(f"COPY {entity} TO '{os.path.join(directory, entity)}' (FORMAT PARQUET, PARTITION_BY (tenant), OVERWRITE_OR_IGNORE)")
+
+@st.cache_resource(show_spinner=False)
+def get_warehouse() -> Warehouse:
+    """One warehouse connection per process."""
+    return Warehouse()
+
+def scope_key(**params) -> str:
+    """Stable scope name for a query; long id lists are hashed."""
+    parts = []
+    for k, v in sorted(params.items()):
+        if isinstance(v, (list, tuple, set)):
+            v = hashlib.sha1(','.join(sorted(str(i) for i in v)).encode()).hexdigest()[:16]
+        parts.append(f"{k}={v}")
+    return '&'.join(parts)
+
+def fetch_scope(
+    tenant: str,
+    entity: str,
+    scope: str,
+    fetch: Callable[[], List[Dict[str, Any]]],
+    max_age: Optional[int] = DEFAULT_MAX_AGE,
+    local_query: Optional[Callable[[Warehouse], List[Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return the stored result of a query if fresh, otherwise call `fetch` and store what it returns.
+
+    `local_query` answers the same query from the store. It's used when incremental sync has kept the
+    scope current, which also picks up records created after the scope was fetched.
+    """
+    wh = get_warehouse()
+    if max_age != 0:
+        if local_query is not None and wh.scope_kept_current(tenant, entity, scope, max_age):
+            return local_query(wh)
+        cached = wh.get_scope(tenant, entity, scope, max_age)
+        if cached is not None:
+            return cached
+    records = fetch()
+    wh.upsert(tenant, entity, records)
+    wh.set_scope(tenant, entity, scope, records)
+    return records
+
+def fetch_keyed_scopes(
+    tenant: str,
+    entity: str,
+    scopes: Dict[str, str],
+    fetch: Callable[[List[str]], Dict[str, List[Dict[str, Any]]]],
+    max_age: Optional[int] = DEFAULT_MAX_AGE,
+    local_query: Optional[Callable[[Warehouse, List[str]], List[Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Like fetch_scope for many small queries at once, e.g. one per job, so a new key only fetches its own query.
+
+    `scopes` maps each key to its scope name. `fetch` is called once with the keys that aren't stored or
+    are stale, and returns their records by key. `local_query` answers the keys whose scopes sync has
+    kept current.
+    """
+    wh = get_warehouse()
+    records: List[Dict[str, Any]] = []
+    local_keys, missing = [], []
+    for key, scope in scopes.items():
+        if max_age == 0:
+            missing.append(key)
+        elif local_query is not None and wh.scope_kept_current(tenant, entity, scope, max_age):
+            local_keys.append(key)
+        else:
+            cached = wh.get_scope(tenant, entity, scope, max_age)
+            if cached is None:
+                missing.append(key)
+            else:
+                records.extend(cached)
+    if local_keys:
+        records.extend(local_query(wh, local_keys))
+    if missing:
+        fetched = fetch(missing)
+        for key in missing:
+            key_records = fetched.get(key, [])
+            wh.upsert(tenant, entity, key_records)
+            wh.set_scope(tenant, entity, scopes[key], key_records)
+            records.extend(key_records)
+    return records
+
+def fetch_ids(tenant: str, entity: str, ids: List, fetch: Callable[[List], List[Dict[str, Any]]], max_age: Optional[int] = DEFAULT_MAX_AGE) -> List[Dict[str, Any]]:
+    """Return records by id, only calling `fetch` for ids that aren't stored or are stale."""
+    wh = get_warehouse()
+    if max_age == 0:
+        found, missing = [], list(ids)
+    else:
+        found, missing = wh.get_by_ids(tenant, entity, ids, max_age)
+    if not missing:
+        return found
+    fetched = fetch(missing)
+    wh.upsert(tenant, entity, fetched)
+    return found + fetched
+
+def _key_frame(df: pd.DataFrame, **key_cols) -> pd.DataFrame:
+    keys = {'row': np.arange(len(df))}
+    for name, col in key_cols.items():
+        keys[name] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    return pd.DataFrame(keys)
+
+def _take_rows(df: pd.DataFrame, rows: pd.Series, drop: str) -> pd.DataFrame:
+    """Rows of `df` by position, with all-NaN rows where `rows` is null, like an unmatched left merge."""
+    positions = rows.astype('Int64').fillna(-1).astype(int).tolist()
+    return df.drop(columns=[drop]).reset_index(drop=True).reindex(positions).reset_index(drop=True)
+
+def merge_commission_frames(jobs_df, invoices_df, payments_grouped, open_estimates_grouped, sold_estimates_grouped) -> pd.DataFrame:
+    """
+    Join formatted jobs to their invoice, grouped payments and open/sold estimate totals.
+
+    The join runs in DuckDB over the key columns only, then the matching rows are stitched together in
+    pandas so column types come through untouched. Same result as the left merges it replaces: job
+    columns, then invoice and payment columns, then open_est_subtotal and sold_est_subtotal.
+    """
+    conn = duckdb.connect()
+    conn.register('jobs', _key_frame(jobs_df, invoice_id='invoiceId', job_id='job_id'))
+    conn.register('invoices', _key_frame(invoices_df, key='invoiceId'))
+    conn.register('payments', _key_frame(payments_grouped, key='invoiceId'))
+    conn.register('open_est', _key_frame(open_estimates_grouped, key='job_id'))
+    conn.register('sold_est', _key_frame(sold_estimates_grouped, key='job_id'))
+    matches = conn.execute("""
+        SELECT j.row AS job_row, i.row AS invoice_row, p.row AS payment_row, o.row AS open_row, s.row AS sold_row
+        FROM jobs j
+        LEFT JOIN invoices i ON i.key = j.invoice_id
+        LEFT JOIN payments p ON p.key = j.invoice_id
+        LEFT JOIN open_est o ON o.key = j.job_id
+        LEFT JOIN sold_est s ON s.key = j.job_id
+        ORDER BY j.row, i.row, p.row, o.row, s.row
+    """).df()
+    conn.close()
+
+    return pd.concat([
+        jobs_df.reset_index(drop=True).iloc[matches['job_row'].tolist()].reset_index(drop=True),
+        _take_rows(invoices_df, matches['invoice_row'], 'invoiceId'),
+        _take_rows(payments_grouped, matches['payment_row'], 'invoiceId'),
+        _take_rows(open_estimates_grouped, matches['open_row'], 'job_id').rename(columns={'est_subtotal': 'open_est_subtotal'}),
+        _take_rows(sold_estimates_grouped, matches['sold_row'], 'job_id').rename(columns={'est_subtotal': 'sold_est_subtotal'}),
+    ], axis=1)
@@ -0,0 +1,76 @@
+"""
+Built commission workbooks, saved to GCS and reused while their inputs haven't changed.
+
+A workbook is stored under its export options (state, timeframe, dates, spare rows) and named by
+the code version and a fingerprint of everything it's built from: the merged job records, the
+employee map and the holiday calendar. If the page produces the same fingerprint again, the stored
+workbook is served instead of grouping and building it again. Any change to the records gives a
+new fingerprint, and the workbook is rebuilt and replaces the stored one.
+
+The code version is a hash of this app's source, so a deploy that changes how workbooks are
+built doesn't serve workbooks built by the old code. COMMISSION_CODE_VERSION overrides it.
+"""
+from __future__ import annotations
+
+import datetime as _dt
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Any
+
+import modules.google_store as gs
+from modules.holiday_calendar import HolidayCalendar
+
+CACHE_PREFIX = os.environ.get("WORKBOOK_CACHE_PREFIX", "workbook_cache")
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _source_hash() -> str:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    h = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+        for name in sorted(filenames):
+            if name.endswith('.py'):
+                h.update(name.encode())
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()[:12]
+
+CODE_VERSION = os.environ.get("COMMISSION_CODE_VERSION") or _source_hash()
+
+def _hash_json(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def fingerprint(job_records: List[Dict[str, Any]], employee_map: Dict, holidays: HolidayCalendar) -> str:
+    """Hash of a workbook's inputs. Record order doesn't matter, since stored records come back in any order."""
+    h = hashlib.sha256()
+    for record_hash in sorted(_hash_json(record) for record in job_records):
+        h.update(record_hash.encode())
+    h.update(_hash_json(sorted((str(k), v) for k, v in employee_map.items())).encode())
+    h.update(_hash_json([str(d) for d in holidays.holiday_dates]).encode())
+    return h.hexdigest()[:24]
+
+def workbook_prefix(state: str, timeframe: str, start_date: _dt.date, end_date: _dt.date, spare_rows: int) -> str:
+    return f"{CACHE_PREFIX}/{state}/{timeframe.lower()}_{start_date}_{end_date}_spare{spare_rows}/"
+
+def _blob_name(prefix: str, fp: str) -> str:
+    return f"{prefix}{CODE_VERSION}_{fp}.xlsx"
+
+def load(prefix: str, fp: str) -> Optional[bytes]:
+    """The stored workbook for these options and inputs, or None."""
+    try:
+        return gs.load_bytes(_blob_name(prefix, fp))
+    except Exception as e:
+        print(f"ERROR: couldn't read cached workbook under {prefix}: {e}")
+        return None
+
+def save(prefix: str, fp: str, excel_bytes: bytes) -> None:
+    """Store a workbook and remove any older ones for the same options."""
+    blob_name = _blob_name(prefix, fp)
+    try:
+        gs.save_bytes(excel_bytes, blob_name, XLSX_MIME)
+        for old in gs.list_blob_names(prefix):
+            if old != blob_name:
+                gs.delete_blob(old)
+    except Exception as e:
+        print(f"ERROR: couldn't cache workbook {blob_name}: {e}")
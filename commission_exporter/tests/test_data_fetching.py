@@ -0,0 +1,82 @@
+import datetime as dt
+
+import modules.data_fetching as fetching
+
+
+class FakeClient:
+    """Serves estimates by jobId, a page at a time, and records each request's params."""
+
+    def __init__(self, estimates):
+        self.estimates = estimates
+        self.requests = []
+
+    def build_url(self, module, resource):
+        return f"{module}/{resource}"
+
+    def end_of_day_utc_string(self, date):
+        return f"{date + dt.timedelta(days=1)}T00:00:00Z"
+
+    def get(self, url, params=None):
+        self.requests.append(params)
+        rows = [est for est in self.estimates if str(est['jobId']) == params['jobId']]
+        start = (params['page'] - 1) * params['pageSize']
+        return {'data': rows[start:start + params['pageSize']], 'hasMore': start + params['pageSize'] < len(rows)}
+
+
+def estimate(id_, job_id, created_on='2026-10-01T00:00:00Z'):
+    return {'id': id_, 'jobId': job_id, 'createdOn': created_on}
+
+
+def test_chunk_ids_caps_ids_per_chunk():
+    chunks = fetching.chunk_ids(range(120), max_ids=50)
+    assert [len(chunk) for chunk in chunks] == [50, 50, 20]
+    assert sum(chunks, []) == [str(i) for i in range(120)]
+
+
+def test_chunk_ids_caps_characters_per_chunk():
+    ids = [str(10 ** 9 + i) for i in range(10)] # 10 digits, 11 characters with the comma
+    chunks = fetching.chunk_ids(ids, max_ids=50, max_chars=33)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert all(len(','.join(chunk)) <= 33 for chunk in chunks)
+
+
+def test_chunk_ids_of_nothing_is_no_chunks():
+    assert fetching.chunk_ids([]) == []
+
+
+def test_jobs_created_before_compares_instants():
+    jobs = [
+        {'id': 1, 'createdOn': '2026-08-31T13:59:59.9Z'},
+        {'id': 2, 'createdOn': '2026-08-31T14:00:00Z'},
+        {'id': 3, 'createdOn': '2026-09-02T00:00:00.1234567Z'},
+    ]
+    assert fetching.jobs_created_before(jobs, '2026-08-31T14:00:00Z') == ['1']
+
+
+def test_jobs_created_before_includes_jobs_without_a_created_date():
+    assert fetching.jobs_created_before([{'id': 1}], '2026-08-31T14:00:00Z') == ['1']
+
+
+def test_filter_estimates_keeps_the_jobs_estimates_before_the_end():
+    estimates = [
+        estimate(1, 10, '2026-10-11T12:59:59.5Z'),
+        estimate(2, 10, '2026-10-11T13:00:00.5Z'), # after the end, though it sorts first as text
+        estimate(3, 11),
+        estimate(1, 10, '2026-10-11T12:59:59.5Z'), # from both the window and the job's own scope
+    ]
+    kept = fetching.filter_estimates(estimates, [10], '2026-10-11T13:00:00Z')
+    assert [est['id'] for est in kept] == [1]
+
+
+def test_fetch_estimates_by_job_groups_by_job():
+    client = FakeClient([estimate(1, 10), estimate(2, 10), estimate(3, 11)])
+    found = fetching.fetch_estimates_by_job([10, '11', 12, 10], client, created_before=dt.date(2026, 10, 11))
+    assert {job_id: [est['id'] for est in ests] for job_id, ests in found.items()} == {'10': [1, 2], '11': [3], '12': []}
+    assert len(client.requests) == 3
+    assert all(params['createdBefore'] == '2026-10-12T00:00:00Z' for params in client.requests)
+
+
+def test_fetch_estimates_by_job_without_jobs_makes_no_requests():
+    client = FakeClient([])
+    assert fetching.fetch_estimates_by_job([], client) == {}
+    assert client.requests == []
@@ -0,0 +1,23 @@
+import pytest
+
+import modules.data_formatting as format
+
+
+def test_localise_uses_the_tenants_timezone():
+    # 15:30 UTC is 23:30 in Perth but already the next day in Sydney
+    values = ['2025-06-01T15:30:00Z', None, 'not a date']
+    _, perth = format.localise_st_dates(values, 'sierradelta', {'date': "%Y-%m-%d"})
+    _, sydney = format.localise_st_dates(values, 'foxtrotwhiskey', {'date': "%Y-%m-%d"})
+    assert perth['date'] == ['2025-06-01', None, None]
+    assert sydney['date'] == ['2025-06-02', None, None]
+
+
+def test_localise_unknown_tenant_fails():
+    with pytest.raises(KeyError, match="No timezone for tenant"):
+        format.localise_st_dates(['2025-06-01T15:30:00Z'], 'newtenant', {'date': "%Y-%m-%d"})
+
+
+def test_localise_payment_dates():
+    payments = [{'date': '2025-06-30T16:00:00.1234567Z'}, {'date': None}]
+    format.localise_payment_dates(payments, 'sierradelta')
+    assert [p['local_date_str'] for p in payments] == ['2025-07-01', None]
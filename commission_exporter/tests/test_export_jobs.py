@@ -0,0 +1,115 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import modules.export_jobs as export_jobs
+import worker
+
+PARAMS = {'state': 'All', 'states': ['NSW', 'VIC'], 'timeframe': 'Weekly', 'start_date': '2026-10-05',
+          'end_date': '2026-10-11', 'spare_rows': 5, 'reuse_data': True}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    blobs = {}
+    monkeypatch.setattr(export_jobs.gs, 'save_file', lambda data, name: blobs.__setitem__(name, json.dumps(data)))
+    monkeypatch.setattr(export_jobs.gs, 'load_file', lambda name: json.loads(blobs[name]) if name in blobs else {})
+    monkeypatch.setattr(export_jobs.gs, 'list_blob_names', lambda prefix: [name for name in blobs if name.startswith(prefix)])
+    return blobs
+
+
+@pytest.fixture
+def queued(store, monkeypatch):
+    payloads = []
+    monkeypatch.setattr(export_jobs, 'WORKER_URL', 'https://worker')
+    monkeypatch.setattr(export_jobs.tasks, 'create_task', lambda url, payload: payloads.append(payload) or f"task-{len(payloads)}")
+    return payloads
+
+
+def part(state, status, **fields):
+    return {**export_jobs.new_part(state), 'status': status, **fields}
+
+
+def job(parts=('NSW', 'VIC')):
+    return {'job_id': '1', 'user': 'albie', 'params': PARAMS, 'parts': list(parts), 'status': 'queued',
+            'message': 'Waiting for the worker...', 'error': None}
+
+
+def test_combined_status_follows_the_parts():
+    cases = [
+        ((None, None), 'queued'),
+        ((part('NSW', 'running'), None), 'running'),
+        ((part('NSW', 'done'), None), 'running'),
+        ((part('NSW', 'done'), part('VIC', 'error', error='boom')), 'error'),
+        ((part('NSW', 'error', error='boom'), part('VIC', 'running')), 'running'),
+        ((part('NSW', 'done'), part('VIC', 'done')), 'done'),
+    ]
+    for (nsw, vic), status in cases:
+        assert export_jobs.combine_parts(job(), {'NSW': nsw, 'VIC': vic})['status'] == status
+
+
+def test_combined_job_collects_stages_results_and_errors():
+    nsw = part('NSW', 'done', result={'name': 'nsw.xlsx'}, stages=[{'stage': 'jobs'}], finished_at='2026-10-19T10:00:00')
+    vic = part('VIC', 'error', error='boom', stages=[{'stage': 'sync'}], finished_at='2026-10-19T10:05:00')
+    combined = export_jobs.combine_parts(job(), {'NSW': nsw, 'VIC': vic})
+    assert combined['results'] == {'NSW': {'name': 'nsw.xlsx'}}
+    assert [stage['stage'] for stage in combined['stages']] == ['jobs', 'sync']
+    assert (combined['error'], combined['finished_at']) == ('VIC: boom', '2026-10-19T10:05:00')
+
+
+def test_running_message_names_the_state():
+    combined = export_jobs.combine_parts(job(), {'NSW': part('NSW', 'running', message='Fetching jobs...'), 'VIC': None})
+    assert combined['message'] == 'NSW: Fetching jobs...'
+
+
+def test_a_running_part_goes_stale_without_saves():
+    now = datetime(2026, 10, 19, 10)
+    recent = part('NSW', 'running', updated_at=(now - timedelta(minutes=1)).isoformat())
+    quiet = part('NSW', 'running', updated_at=(now - export_jobs.RUNNING_STALE_AFTER).isoformat())
+    assert export_jobs.is_running(recent, now)
+    assert not export_jobs.is_running(quiet, now)
+    assert not export_jobs.is_running(part('NSW', 'done', updated_at=now.isoformat()), now)
+
+
+def test_heartbeat_saves_while_a_stage_runs():
+    saves = []
+    progress = export_jobs.JobProgress(part('NSW', 'running'), saves.append)
+    with progress.heartbeat(interval=0.01):
+        time.sleep(0.1)
+    count = len(saves)
+    time.sleep(0.05)
+    assert count >= 3 and len(saves) == count
+
+
+def test_submit_queues_a_task_per_state(queued):
+    submitted = export_jobs.submit_job('albie', PARAMS)
+    assert [payload['state'] for payload in queued] == ['NSW', 'VIC']
+    assert export_jobs.load_job('albie', submitted['job_id'])['status'] == 'queued'
+
+
+def test_worker_turns_away_a_redelivered_task_while_it_runs(queued, monkeypatch):
+    submitted = export_jobs.submit_job('albie', PARAMS)
+    blob = export_jobs.part_blob('albie', submitted['job_id'], 'NSW')
+    export_jobs.save_part(part('NSW', 'running'), blob)
+    runs = []
+    monkeypatch.setattr(worker, 'run_job', lambda *args: runs.append(args))
+    client = TestClient(worker.app)
+
+    assert client.post('/tasks/run-export', json=queued[0]).status_code == 409
+    assert runs == []
+
+    stale = export_jobs.load_part(blob)
+    stale['updated_at'] = (datetime.now() - export_jobs.RUNNING_STALE_AFTER).isoformat()
+    export_jobs.gs.save_file(stale, blob)
+    assert client.post('/tasks/run-export', json=queued[0]).json()['status'] == 'done'
+    assert len(runs) == 1
+
+
+def test_worker_skips_a_finished_state(queued, monkeypatch):
+    submitted = export_jobs.submit_job('albie', PARAMS)
+    export_jobs.save_part(part('NSW', 'done'), export_jobs.part_blob('albie', submitted['job_id'], 'NSW'))
+    monkeypatch.setattr(worker, 'run_job', lambda *args: pytest.fail("ran a finished state"))
+    assert TestClient(worker.app).post('/tasks/run-export', json=queued[0]).json()['status'] == 'skipped_already_done'
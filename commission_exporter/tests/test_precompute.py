@@ -0,0 +1,115 @@
+import datetime as dt
+import json
+from datetime import datetime
+
+import pytest
+
+import modules.export_jobs as export_jobs
+import modules.precompute as precompute
+
+TODAY = dt.date(2026, 10, 13) # a Tuesday
+WEEK = ('Weekly', dt.date(2026, 10, 5), dt.date(2026, 10, 11))
+MONTH = ('Monthly', dt.date(2026, 9, 1), dt.date(2026, 9, 30))
+
+
+@pytest.fixture
+def store(monkeypatch):
+    blobs = {}
+    monkeypatch.setattr(precompute.gs, 'save_file', lambda data, name: blobs.__setitem__(name, json.dumps(data)))
+    monkeypatch.setattr(precompute.gs, 'load_file', lambda name: json.loads(blobs[name]) if name in blobs else {})
+    return blobs
+
+
+@pytest.fixture
+def queued(store, monkeypatch):
+    payloads = []
+    monkeypatch.setattr(export_jobs, 'WORKER_URL', 'https://worker')
+    monkeypatch.setattr(precompute.tasks, 'create_task', lambda url, payload: payloads.append(payload) or f"task-{len(payloads)}")
+    return payloads
+
+
+def save_parts(period, statuses, updated_at=None):
+    """Save a run for `period` with its parts in `statuses` (state -> status)."""
+    run = precompute.new_run(*period)
+    precompute.save_run(run)
+    for state in run['parts']:
+        part = {**export_jobs.new_part(state), 'status': statuses.get(state, 'queued')}
+        if part['status'] == 'done':
+            part['result'] = {'name': f"{state}.xlsx"}
+        elif part['status'] == 'error':
+            part['error'] = 'boom'
+        export_jobs.save_part(part, precompute.part_blob(*period, state))
+        if updated_at:
+            part['updated_at'] = updated_at
+            precompute.gs.save_file(part, precompute.part_blob(*period, state))
+    if updated_at:
+        run['updated_at'] = updated_at
+        precompute.gs.save_file(run, precompute.run_blob(*period))
+
+
+def queued_states(payloads, timeframe):
+    return sorted(payload['state'] for payload in payloads if payload['timeframe'] == timeframe)
+
+
+def test_periods_are_last_week_and_last_month():
+    assert precompute.periods(TODAY) == [WEEK, MONTH]
+    assert precompute.periods(dt.date(2026, 1, 1)) == [
+        ('Weekly', dt.date(2025, 12, 22), dt.date(2025, 12, 28)),
+        ('Monthly', dt.date(2025, 12, 1), dt.date(2025, 12, 31)),
+    ]
+    assert precompute.previous_month(dt.date(2028, 3, 1))[2] == dt.date(2028, 2, 29)
+
+
+def test_queues_every_state_of_each_new_period(queued):
+    runs = precompute.schedule_due(TODAY)
+    assert [run['job_id'] for run in runs] == ['precompute-weekly-2026-10-05-2026-10-11', 'precompute-monthly-2026-09-01-2026-09-30']
+    assert queued_states(queued, 'Weekly') == queued_states(queued, 'Monthly') == sorted(precompute.pipeline.states_for('All'))
+
+
+def test_skips_built_and_recently_active_runs(queued):
+    states = precompute.pipeline.states_for('All')
+    save_parts(WEEK, {state: 'done' for state in states})
+    save_parts(MONTH, {states[0]: 'running'})
+    assert precompute.schedule_due(TODAY) == []
+    assert queued == []
+
+
+def test_requeues_the_unfinished_states_of_a_failed_run(queued):
+    states = precompute.pipeline.states_for('All')
+    save_parts(WEEK, {state: 'done' for state in states} | {states[1]: 'error'})
+    save_parts(MONTH, {state: 'done' for state in states})
+
+    precompute.schedule_due(TODAY)
+    assert queued_states(queued, 'Weekly') == [states[1]]
+    assert export_jobs.load_part(precompute.part_blob(*WEEK, states[1]))['status'] == 'queued'
+    assert precompute.load_run(*WEEK)['results'].keys() == set(states) - {states[1]}
+
+
+def test_requeues_runs_that_went_stale(queued):
+    states = precompute.pipeline.states_for('All')
+    stale_at = (datetime.now() - precompute.RUN_STALE_AFTER - dt.timedelta(minutes=1)).isoformat(timespec='seconds')
+    save_parts(WEEK, {states[0]: 'done', states[1]: 'running'}, updated_at=stale_at)
+    save_parts(MONTH, {}, updated_at=stale_at) # queued, never picked up
+
+    precompute.schedule_due(TODAY)
+    assert queued_states(queued, 'Weekly') == sorted(states[1:])
+    assert queued_states(queued, 'Monthly') == sorted(states)
+
+
+def test_force_rebuilds_everything(queued):
+    states = precompute.pipeline.states_for('All')
+    save_parts(WEEK, {state: 'done' for state in states})
+    save_parts(MONTH, {state: 'done' for state in states})
+    precompute.schedule_due(TODAY, force=True)
+    assert queued_states(queued, 'Weekly') == queued_states(queued, 'Monthly') == sorted(states)
+    assert precompute.load_run(*WEEK)['status'] == 'queued'
+
+
+def test_is_stale_only_for_active_runs():
+    now = datetime(2026, 10, 13, 6)
+    old = (now - precompute.RUN_STALE_AFTER - dt.timedelta(seconds=1)).isoformat()
+    recent = (now - dt.timedelta(minutes=10)).isoformat()
+    assert precompute.is_stale({'status': 'running', 'updated_at': old}, now)
+    assert precompute.is_stale({'status': 'queued', 'updated_at': old}, now)
+    assert not precompute.is_stale({'status': 'running', 'updated_at': recent}, now)
+    assert not precompute.is_stale({'status': 'done', 'updated_at': old}, now)
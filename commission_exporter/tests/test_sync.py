@@ -0,0 +1,73 @@
+import pytest
+
+import modules.sync as sync
+import modules.warehouse as warehouse
+
+
+@pytest.fixture
+def wh(tmp_path, monkeypatch):
+    store = warehouse.Warehouse(str(tmp_path / 'warehouse.duckdb'))
+    monkeypatch.setattr(warehouse, 'get_warehouse', lambda: store)
+    return store
+
+
+class FakeClient:
+    app_guid = None
+
+    def __init__(self, changed):
+        self.changed = changed
+        self.requests = []
+
+    def build_url(self, module, resource):
+        return f"{module}/{resource}"
+
+    def get(self, url, params=None):
+        self.requests.append((url, params))
+        return {'data': self.changed, 'hasMore': False}
+
+
+def job(id_, modified_on='2026-10-01T00:00:00Z'):
+    return {'id': id_, 'jobNumber': str(id_), 'modifiedOn': modified_on}
+
+
+def age(wh, entity, id_, seconds):
+    wh.conn.execute(f"UPDATE {entity} SET synced_at = now() - to_seconds(?) WHERE id = ?", [seconds, id_])
+
+
+def test_first_sync_only_starts_the_cursor(wh):
+    client = FakeClient([job(1)])
+    assert sync.sync_entity(client, 't', 'jobs') == 0
+    assert client.requests == []
+    assert wh.get_cursor('t', 'jobs') is not None
+
+
+def test_sync_applies_changes_since_the_cursor(wh):
+    client = FakeClient([job(1, '2026-10-02T00:00:00Z')])
+    sync.sync_entity(client, 't', 'jobs')
+    modified_since, _ = wh.get_cursor('t', 'jobs')
+
+    assert sync.sync_entity(client, 't', 'jobs') == 1
+    url, params = client.requests[0]
+    assert (url, params['modifiedOnOrAfter']) == ('jpm/jobs', modified_since)
+    found, missing = wh.get_by_ids('t', 'jobs', [1])
+    assert (found[0]['modifiedOn'], missing) == ('2026-10-02T00:00:00Z', [])
+
+
+def test_delta_refreshes_records_synced_since_the_chain_started(wh):
+    wh.upsert('t', 'jobs', [job(1), job(2)])
+    age(wh, 'jobs', 1, 3600) # fetched an hour ago, after the chain started
+    age(wh, 'jobs', 2, 3 * 3600) # fetched before the chain started, so deltas may have missed it
+    chain_started_at = wh.conn.execute("SELECT CAST(now() - INTERVAL 2 HOUR AS VARCHAR)").fetchone()[0]
+
+    wh.apply_delta('t', 'jobs', [], '2026-10-02T00:00:00Z', chain_started_at)
+
+    found, missing = wh.get_by_ids('t', 'jobs', [1, 2], max_age=60)
+    assert ([r['id'] for r in found], missing) == ([1], [2])
+
+
+def test_scope_is_kept_current_only_if_fetched_after_the_chain_started(wh):
+    wh.set_scope('t', 'jobs', 'before', [job(1)])
+    wh.apply_delta('t', 'jobs', [], '2026-10-02T00:00:00Z', wh.conn.execute("SELECT CAST(now() AS VARCHAR)").fetchone()[0])
+    wh.set_scope('t', 'jobs', 'after', [job(1)])
+    assert not wh.scope_kept_current('t', 'jobs', 'before')
+    assert wh.scope_kept_current('t', 'jobs', 'after')
@@ -0,0 +1,38 @@
+import pytest
+
+import modules.tasks as tasks
+
+
+class FakeTasksClient:
+    created = []
+
+    def queue_path(self, project, location, queue):
+        return f"projects/{project}/locations/{location}/queues/{queue}"
+
+    def create_task(self, request):
+        self.created.append(request)
+        return type('Task', (), {'name': request['parent'] + '/tasks/1'})()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    FakeTasksClient.created = []
+    monkeypatch.setattr(tasks.tasks_v2, 'CloudTasksClient', FakeTasksClient)
+    return FakeTasksClient
+
+
+def test_tasks_carry_an_identity_token_for_the_worker(client, monkeypatch):
+    monkeypatch.setattr(tasks, 'TASKS_SERVICE_ACCOUNT', 'tasks@project.iam.gserviceaccount.com')
+    tasks.create_task('https://worker-abc.a.run.app/tasks/run-export', {'user': 'albie', 'job_id': '1'})
+    http_request = client.created[0]['task']['http_request']
+    assert http_request['oidc_token'] == {
+        'service_account_email': 'tasks@project.iam.gserviceaccount.com',
+        'audience': 'https://worker-abc.a.run.app',
+    }
+
+
+def test_tasks_are_not_created_without_a_service_account(client, monkeypatch):
+    monkeypatch.setattr(tasks, 'TASKS_SERVICE_ACCOUNT', '')
+    with pytest.raises(RuntimeError, match='COMMISSION_TASKS_SERVICE_ACCOUNT'):
+        tasks.create_task('https://worker-abc.a.run.app/tasks/run-export', {})
+    assert client.created == []
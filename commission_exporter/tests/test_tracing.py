@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import modules.tracing as tracing
+
+BODY = b'{"data": [], "hasMore": false}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.01)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+def test_counts_requests_made_on_the_stage_thread(url):
+    trace = tracing.RunTrace()
+    with trace.stage('jobs') as stage:
+        requests.get(url)
+        requests.get(url)
+    assert (stage.api_calls, stage.bytes_in) == (2, 2 * len(BODY))
+
+
+def test_counts_requests_made_by_traced_worker_threads(url):
+    trace = tracing.RunTrace()
+    with trace.stage('assignments') as stage:
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            list(ex.map(tracing.traced(lambda _: requests.get(url)), range(12)))
+    assert (stage.api_calls, stage.bytes_in) == (12, 12 * len(BODY))
+
+
+def test_counts_worker_cpu_time():
+    def busy(_):
+        end = time.thread_time() + 0.05
+        while time.thread_time() < end:
+            pass
+
+    trace = tracing.RunTrace()
+    with trace.stage('formatting') as stage:
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            list(ex.map(tracing.traced(busy), range(4)))
+    assert stage.cpu_s >= 0.2
+
+
+def test_requests_outside_a_stage_arent_counted(url):
+    trace = tracing.RunTrace()
+    with trace.stage('jobs') as stage:
+        pass
+    requests.get(url)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        list(ex.map(lambda _: requests.get(url), range(2)))
+    assert stage.api_calls == 0
+
+
+def test_untraced_worker_threads_dont_count_against_the_stage(url):
+    trace = tracing.RunTrace()
+    with trace.stage('jobs') as stage:
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            list(ex.map(lambda _: requests.get(url), range(2)))
+    assert stage.api_calls == 0
+
+
+def test_counts_chunked_id_filter_fetches(url):
+    import modules.data_fetching as fetching
+
+    class Client:
+        def get(self, path, params=None):
+            return requests.get(url, params=params).json()
+
+    trace = tracing.RunTrace()
+    with trace.stage('jobs') as stage:
+        fetching.get_all_id_filter_projected(Client(), url, range(120), 'jobs')
+    assert stage.api_calls == len(fetching.chunk_ids(str(i) for i in range(120))) == 3
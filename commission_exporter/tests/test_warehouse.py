@@ -0,0 +1,110 @@
+import pandas as pd
+import pytest
+
+import modules.warehouse as warehouse
+
+
+@pytest.fixture
+def wh(tmp_path, monkeypatch):
+    store = warehouse.Warehouse(str(tmp_path / 'warehouse.duckdb'))
+    monkeypatch.setattr(warehouse, 'get_warehouse', lambda: store)
+    return store
+
+
+def estimate(id_, job_id, created_on='2026-10-01T00:00:00Z'):
+    return {'id': id_, 'jobId': job_id, 'createdOn': created_on, 'modifiedOn': created_on}
+
+
+class KeyedFetch:
+    def __init__(self, records_by_key):
+        self.records_by_key = records_by_key
+        self.calls = []
+
+    def __call__(self, keys):
+        self.calls.append(sorted(keys))
+        return {key: self.records_by_key.get(key, []) for key in keys}
+
+
+def test_fetch_scope_reuses_a_fresh_scope(wh):
+    calls = []
+    fetch = lambda: calls.append(1) or [estimate(1, 10)]
+    first = warehouse.fetch_scope('t', 'estimates', 'created_from=2026-09-01', fetch)
+    second = warehouse.fetch_scope('t', 'estimates', 'created_from=2026-09-01', fetch)
+    assert first == second == [estimate(1, 10)]
+    assert len(calls) == 1
+
+
+def test_fetch_scope_refetches_when_asked_for_fresh_data(wh):
+    calls = []
+    fetch = lambda: calls.append(1) or [estimate(1, 10)]
+    warehouse.fetch_scope('t', 'estimates', 'scope', fetch)
+    warehouse.fetch_scope('t', 'estimates', 'scope', fetch, max_age=0)
+    assert len(calls) == 2
+
+
+def test_keyed_scopes_only_fetch_new_keys(wh):
+    fetch = KeyedFetch({'10': [estimate(1, 10)], '11': [estimate(2, 11), estimate(3, 11)], '12': []})
+    scopes = lambda job_ids: {job_id: warehouse.scope_key(job_id=job_id) for job_id in job_ids}
+
+    first = warehouse.fetch_keyed_scopes('t', 'estimates', scopes(['10', '11']), fetch)
+    second = warehouse.fetch_keyed_scopes('t', 'estimates', scopes(['10', '11', '12']), fetch)
+
+    assert fetch.calls == [['10', '11'], ['12']]
+    assert sorted(est['id'] for est in first) == sorted(est['id'] for est in second) == [1, 2, 3]
+
+
+def test_keyed_scopes_remember_empty_results(wh):
+    fetch = KeyedFetch({})
+    warehouse.fetch_keyed_scopes('t', 'estimates', {'12': 'job_id=12'}, fetch)
+    assert warehouse.fetch_keyed_scopes('t', 'estimates', {'12': 'job_id=12'}, fetch) == []
+    assert fetch.calls == [['12']]
+
+
+def test_keyed_scopes_kept_current_by_sync_are_answered_locally(wh):
+    fetch = KeyedFetch({'10': [estimate(1, 10)]})
+    wh.apply_delta('t', 'estimates', [], '2026-10-01T00:00:00Z', '2026-10-01T00:00:00Z')
+    warehouse.fetch_keyed_scopes('t', 'estimates', {'10': 'job_id=10'}, fetch)
+    # An estimate created later arrives through sync rather than the scope's own fetch
+    wh.apply_delta('t', 'estimates', [estimate(4, 10, '2026-10-02T00:00:00Z')], '2026-10-02T00:00:00Z', '2026-10-01T00:00:00Z')
+
+    found = warehouse.fetch_keyed_scopes(
+        't', 'estimates', {'10': 'job_id=10'}, fetch,
+        local_query=lambda store, keys: store.records_with_field_in('t', 'estimates', 'jobId', keys),
+    )
+    assert fetch.calls == [['10']]
+    assert sorted(est['id'] for est in found) == [1, 4]
+
+
+def pandas_merge(jobs_df, invoices_df, payments_grouped, open_estimates_grouped, sold_estimates_grouped):
+    """The chain of left merges merge_commission_frames replaced."""
+    merged = jobs_df.merge(invoices_df, on='invoiceId', how='left').merge(payments_grouped, on='invoiceId', how='left')
+    merged = merged.merge(open_estimates_grouped, on='job_id', how='left').rename(columns={'est_subtotal': 'open_est_subtotal'})
+    return merged.merge(sold_estimates_grouped, on='job_id', how='left').rename(columns={'est_subtotal': 'sold_est_subtotal'})
+
+
+def commission_frames():
+    jobs_df = pd.DataFrame({
+        'job_id': [1, 2, 3, 4],
+        'invoiceId': [11, 12, None, 14],
+        'first_appt_start_dt': pd.to_datetime(['2026-10-06', '2026-10-05', '2026-10-07', '2026-10-08']),
+        'Photos': [True, 'Missing', None, False], # doc check values have mixed types
+    })
+    invoices_df = pd.DataFrame({'invoiceId': [11, 12, 14], 'subTotal': [100.0, 250.5, 80.0], 'suburb': ['Ryde', 'Manly', None]})
+    payments_grouped = pd.DataFrame({'invoiceId': [11, 14], 'payment_types': ['Visa', 'Cash, EFT'], 'amount': [100.0, 40.0]})
+    open_estimates_grouped = pd.DataFrame({'job_id': [2, 3], 'est_subtotal': [500.0, 75.0]})
+    sold_estimates_grouped = pd.DataFrame({'job_id': [1], 'est_subtotal': [900.0]})
+    return jobs_df, invoices_df, payments_grouped, open_estimates_grouped, sold_estimates_grouped
+
+
+def test_merge_commission_frames_matches_the_pandas_merges():
+    frames = commission_frames()
+    pd.testing.assert_frame_equal(warehouse.merge_commission_frames(*frames), pandas_merge(*frames))
+
+
+def test_merge_commission_frames_with_no_invoices_or_estimates():
+    jobs_df, invoices_df, payments_grouped, open_estimates_grouped, sold_estimates_grouped = commission_frames()
+    frames = (jobs_df, invoices_df.iloc[0:0], payments_grouped.iloc[0:0], open_estimates_grouped.iloc[0:0], sold_estimates_grouped.iloc[0:0])
+    merged = warehouse.merge_commission_frames(*frames)
+    assert list(merged.columns) == list(pandas_merge(*frames).columns)
+    assert merged['subTotal'].isna().all() and merged['sold_est_subtotal'].isna().all()
+    pd.testing.assert_frame_equal(merged[list(jobs_df.columns)], jobs_df)
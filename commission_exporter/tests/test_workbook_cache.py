@@ -0,0 +1,66 @@
+import datetime as dt
+
+import pytest
+
+import modules.workbook_cache as workbook_cache
+from modules.holiday_calendar import HolidayCalendar
+
+RECORDS = [
+    {'job_id': 1, 'Tech': 'Tech 0', 'subTotal': 250.0, 'first_appt_start_dt': dt.datetime(2026, 10, 6, 9)},
+    {'job_id': 2, 'Tech': 'Tech 1', 'subTotal': 80.0, 'first_appt_start_dt': dt.datetime(2026, 10, 7, 9)},
+]
+EMPLOYEES = {100: 'Tech 0', 101: 'Tech 1'}
+
+
+@pytest.fixture(scope='module')
+def nsw():
+    return HolidayCalendar('NSW', years=[2026])
+
+
+@pytest.fixture
+def store(monkeypatch):
+    blobs = {}
+    monkeypatch.setattr(workbook_cache.gs, 'save_bytes', lambda data, name, content_type='': blobs.__setitem__(name, data))
+    monkeypatch.setattr(workbook_cache.gs, 'load_bytes', lambda name: blobs.get(name))
+    monkeypatch.setattr(workbook_cache.gs, 'list_blob_names', lambda prefix: [name for name in blobs if name.startswith(prefix)])
+    monkeypatch.setattr(workbook_cache.gs, 'delete_blob', lambda name: blobs.pop(name))
+    return blobs
+
+
+def test_fingerprint_ignores_record_and_employee_order(nsw):
+    reordered_employees = dict(reversed(list(EMPLOYEES.items())))
+    assert workbook_cache.fingerprint(RECORDS, EMPLOYEES, nsw) == workbook_cache.fingerprint(RECORDS[::-1], reordered_employees, nsw)
+
+
+def test_fingerprint_changes_with_any_input(nsw):
+    fp = workbook_cache.fingerprint(RECORDS, EMPLOYEES, nsw)
+    changed_record = [RECORDS[0], {**RECORDS[1], 'subTotal': 81.0}]
+    assert workbook_cache.fingerprint(changed_record, EMPLOYEES, nsw) != fp
+    assert workbook_cache.fingerprint(RECORDS[:1], EMPLOYEES, nsw) != fp
+    assert workbook_cache.fingerprint(RECORDS, {**EMPLOYEES, 101: 'Tech One'}, nsw) != fp
+    assert workbook_cache.fingerprint(RECORDS, EMPLOYEES, HolidayCalendar('VIC', years=[2026])) != fp
+
+
+def test_saved_workbook_is_served_for_the_same_fingerprint(store):
+    prefix = workbook_cache.workbook_prefix('NSW', 'Weekly', dt.date(2026, 10, 5), dt.date(2026, 10, 11), 5)
+    workbook_cache.save(prefix, 'abc', b'workbook')
+    assert workbook_cache.load(prefix, 'abc') == b'workbook'
+    assert workbook_cache.load(prefix, 'def') is None
+
+
+def test_saving_replaces_older_workbooks_for_the_same_options(store):
+    prefix = workbook_cache.workbook_prefix('NSW', 'Weekly', dt.date(2026, 10, 5), dt.date(2026, 10, 11), 5)
+    other = workbook_cache.workbook_prefix('NSW', 'Weekly', dt.date(2026, 10, 5), dt.date(2026, 10, 11), 10)
+    workbook_cache.save(prefix, 'abc', b'old')
+    workbook_cache.save(other, 'abc', b'other options')
+    workbook_cache.save(prefix, 'def', b'new')
+    assert workbook_cache.load(prefix, 'abc') is None
+    assert workbook_cache.load(prefix, 'def') == b'new'
+    assert workbook_cache.load(other, 'abc') == b'other options'
+
+
+def test_read_errors_are_a_cache_miss(monkeypatch):
+    def fail(name):
+        raise ConnectionError("GCS unavailable")
+    monkeypatch.setattr(workbook_cache.gs, 'load_bytes', fail)
+    assert workbook_cache.load('prefix/', 'abc') is None
@@ -0,0 +1,179 @@
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from datetime import date, datetime
+from typing import Callable, Dict, Any
+import logging
+import os
+
+import modules.google_store as gs
+import modules.export_jobs as export_jobs
+import modules.pipeline as pipeline
+import modules.precompute as precompute
+import modules.tracing as tracing
+import modules.workbook_cache as workbook_cache
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("worker")
+
+# Deployed without unauthenticated access (cloudbuild_worker.yaml), so Cloud Run only lets through
+# requests with an identity token for a service account that can invoke it: Cloud Tasks
+# (modules/tasks.py) and the Cloud Scheduler job. The page reads job status from GCS, not from here.
+app = FastAPI()
+
+
+# -------------------------------------------------------------------
+# JSON CONTRACT MODELS
+# -------------------------------------------------------------------
+
+class RunExportRequest(BaseModel):
+    user: str
+    job_id: str
+    state: str
+
+
+class RunExportResponse(BaseModel):
+    status: str
+    job_id: str
+    message: str | None = None
+
+
+class PrecomputeRequest(BaseModel):
+    today: date | None = None # defaults to today in Sydney
+    force: bool = False
+
+
+class PrecomputeResponse(BaseModel):
+    status: str
+    queued: list[str]
+
+
+class PrecomputePeriodRequest(BaseModel):
+    timeframe: str
+    start_date: date
+    end_date: date
+    state: str
+
+
+# -------------------------------------------------------------------
+# CORE PROCESSING LOGIC
+# -------------------------------------------------------------------
+
+def run_job(
+    job: Dict[str, Any],
+    state: str,
+    part_blob: str,
+    result_blob: Callable[[str], str],
+) -> Dict[str, Any]:
+    """
+    Run one state of a submitted export:
+    - mark the state's part running
+    - run the pipeline, saving progress on the part as stages start and finish, and at least every
+      export_jobs.HEARTBEAT_SECONDS
+    - upload the workbook next to the job and mark the part done
+
+    `result_blob` maps a file name to its blob name. Returns the part.
+    """
+    params = job['params']
+    start_date = date.fromisoformat(params['start_date'])
+    end_date = date.fromisoformat(params['end_date'])
+    save = lambda part: export_jobs.save_part(part, part_blob)
+
+    part = export_jobs.new_part(state)
+    part.update(status='running', started_at=datetime.now().isoformat(timespec='seconds'))
+    save(part)
+
+    progress = export_jobs.JobProgress(part, save)
+    trace = tracing.RunTrace(timeframe=params['timeframe'], state=state, start_date=start_date, end_date=end_date, job_id=job['job_id'])
+    trace.on_stage = progress.on_stage
+    try:
+        with progress.heartbeat():
+            workbooks = pipeline.run_export(
+                [state], params['timeframe'], start_date, end_date, params['spare_rows'],
+                reuse_data=params['reuse_data'], trace=trace, step=progress.step,
+            )
+        excel_bytes = workbooks.get(state)
+        result = None
+        if excel_bytes is not None:
+            file_name = pipeline.workbook_name(state, start_date, end_date)
+            blob = result_blob(file_name)
+            gs.save_bytes(excel_bytes, blob, workbook_cache.XLSX_MIME)
+            result = {'name': file_name, 'blob': blob, 'bytes': len(excel_bytes)}
+    except Exception as e:
+        part.update(status='error', error=repr(e), finished_at=datetime.now().isoformat(timespec='seconds'))
+        save(part)
+        raise
+    finally:
+        trace.save()
+
+    part.update(status='done', message='Done', result=result, finished_at=datetime.now().isoformat(timespec='seconds'))
+    save(part)
+    logger.info("Export %s (%s) for %s done in %.1fs.", job['job_id'], state, job.get('user', 'the schedule'), trace.total_s)
+    return part
+
+def run_task(job: Dict[str, Any], state: str, part_blob: str, result_blob: Callable[[str], str]) -> RunExportResponse:
+    """
+    Run a state's part for a Cloud Task, unless it's already done or another delivery of the task is
+    still running it. Cloud Tasks delivers at least once, and retries a task that runs past its deadline.
+    """
+    if state not in job['parts']:
+        raise HTTPException(status_code=404, detail=f"{job['job_id']} doesn't export {state}")
+    part = export_jobs.load_part(part_blob)
+    if part and part['status'] == 'done':
+        return RunExportResponse(status="skipped_already_done", job_id=job['job_id'])
+    if part and export_jobs.is_running(part):
+        # Non-2xx, so Cloud Tasks tries again later: by then it's done, or it's stopped saving and this takes over
+        raise HTTPException(status_code=409, detail=f"{job['job_id']} is already running {state} (saved at {part['updated_at']})")
+    try:
+        run_job(job, state, part_blob, result_blob)
+    except Exception as e:
+        logger.exception("Export %s (%s) failed", job['job_id'], state)
+        # Cloud Tasks will treat non-2xx as failure and retry based on the queue config
+        raise HTTPException(status_code=500, detail=f"Export failed: {e}")
+    return RunExportResponse(status="done", job_id=job['job_id'])
+
+
+# -------------------------------------------------------------------
+# HTTP ENDPOINTS
+# -------------------------------------------------------------------
+
+@app.post("/tasks/run-export", response_model=RunExportResponse)
+def run_export_endpoint(req: RunExportRequest):
+    """
+    Cloud Tasks will POST here with JSON payload matching RunExportRequest, one task per state.
+
+    A plain def, so FastAPI runs it in its threadpool and the event loop stays free for other requests.
+    """
+    job = export_jobs.load_job(req.user, req.job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No export job {req.job_id} for {req.user}")
+    return run_task(
+        job, req.state, export_jobs.part_blob(req.user, req.job_id, req.state),
+        lambda file_name: export_jobs.result_blob(req.user, req.job_id, file_name),
+    )
+
+@app.post("/tasks/precompute", response_model=PrecomputeResponse)
+def precompute_endpoint(req: PrecomputeRequest | None = None):
+    """
+    Cloud Scheduler will POST here early every morning, with an empty body or a PrecomputeRequest.
+
+    Queues /tasks/precompute-period tasks for last week and last month, unless they're already built.
+    """
+    req = req or PrecomputeRequest()
+    try:
+        queued = precompute.schedule_due(req.today or precompute.local_today(), force=req.force)
+    except Exception as e:
+        logger.exception("Couldn't queue precomputed exports")
+        raise HTTPException(status_code=500, detail=f"Couldn't queue precomputed exports: {e}")
+    return PrecomputeResponse(status="queued" if queued else "up_to_date", queued=[run['job_id'] for run in queued])
+
+@app.post("/tasks/precompute-period", response_model=RunExportResponse)
+def precompute_period_endpoint(req: PrecomputePeriodRequest):
+    """Cloud Tasks will POST here with one period and state queued by /tasks/precompute."""
+    run = precompute.load_run(req.timeframe, req.start_date, req.end_date)
+    if run is None:
+        run = precompute.new_run(req.timeframe, req.start_date, req.end_date)
+        precompute.save_run(run)
+    return run_task(
+        run, req.state, precompute.part_blob(req.timeframe, req.start_date, req.end_date, req.state),
+        lambda file_name: precompute.result_blob(req.timeframe, req.start_date, req.end_date, file_name),
+    )
@@ -4,8 +4,14 @@ import streamlit_authenticator as stauth
 from datetime import datetime, time, date, timedelta
 from zoneinfo import ZoneInfo
 
-from modules.data import get_invoices_for_xero, convert_df_for_download
+import os
+import tempfile
+import pandas as pd
+
+from modules.data import iter_invoice_rows, iter_changed_invoice_rows, write_invoices_csv, write_invoices_zip
+from modules.ledger import ExportLedger, LedgerConflictError
 import modules.google_store as gs
+import modules.profiling as profiling
 
 st.set_page_config(
     layout="wide",
@@ -24,6 +30,7 @@ authenticator = stauth.Authenticate(
 authenticator.login(location='main')
 
 if ss["authentication_status"]:
+    profiling.start('invoice_exporter')
 
     time_now = datetime.now(ZoneInfo("Australia/Sydney"))
     today = time_now.date()
@@ -37,20 +44,31 @@ if ss["authentication_status"]:
                 today,
                 format="DD/MM/YYYY",
             )
-        with st.container(width=200):
-            tenant = st.selectbox(
-                "Tenant:",
+        with st.container(width=400):
+            tenants = st.multiselect(
+                "Tenants:",
                 [
-                    "AlphaBravo (NSW - Brofessionals)", 
                     "FoxtrotWhiskey (NSW)", 
                     "SierraDelta (WA)",
                     "VictorTango (VIC)",
                     "EchoZulu (QLD)",
                     "MikeEcho (VIC new)",
                     "BravoGolf (QLD new)",
-                ]
+                ],
+                default="FoxtrotWhiskey (NSW)",
+            )
+        with st.container(width=250):
+            export_mode = st.radio(
+                "Export:",
+                ["Date range", "Since last export"],
+                help="'Since last export' only exports invoices created or changed since each tenant's last export. The start date is used for tenants that have never been exported.",
+            )
+        with st.container(width=250):
+            output_format = st.radio(
+                "Download as:",
+                ["One combined CSV", "Zip of CSVs per tenant"],
             )
-    tenant_stripped = tenant.split(' ')[0].lower()
+    tenants_stripped = [tenant.split(' ')[0].lower() for tenant in tenants]
     if "confirmed_range" not in ss:
         ss.confirmed_range = None
 
@@ -63,31 +81,78 @@ if ss["authentication_status"]:
     start_date = ss.confirmed_range[0]
     end_date = ss.confirmed_range[1]
 
-    if "invoice_data" not in ss:
-        ss.invoice_data = None
-        ss.invoice_start_date = "NO_DATE_SELECTED"
-        ss.invoice_end_date = None
+    if "invoice_file" not in ss:
+        ss.invoice_file = None
+        ss.invoice_file_name = None
+        ss.invoice_mime = None
+        ss.invoice_row_count = 0
+        ss.invoice_preview = None
+
+    def clear_invoice_file():
+        if ss.invoice_file and os.path.exists(ss.invoice_file):
+            os.remove(ss.invoice_file)
+        ss.invoice_file = None
+        ss.invoice_file_name = None
+        ss.invoice_mime = None
+        ss.invoice_row_count = 0
+        ss.invoice_preview = None
 
     with st.container(horizontal=True):
-        if st.button("Fetch Invoice Data", key="invoice_data_button"):
-            ss.invoice_data = get_invoices_for_xero(tenant_stripped, start_date, end_date)
-            ss.invoice_start_date = start_date
-            ss.invoice_end_date = end_date
-
-        st.download_button(
-            label="Download Invoices",
-            data=convert_df_for_download(ss.invoice_data),
-            file_name=f"invoices_{ss.invoice_start_date}-{ss.invoice_end_date}.csv",
-            mime="text/csv",
-            icon=":material/download:",
-        )
+        if st.button("Fetch Invoice Data", key="invoice_data_button", disabled=not tenants_stripped):
+            clear_invoice_file()
+            # Rows are written to a temp file window by window, so large ranges aren't held in memory.
+            zipped = output_format == "Zip of CSVs per tenant"
+            suffix = ".zip" if zipped else ".csv"
+            if export_mode == "Since last export":
+                file_suffix = f"changes_to_{today}"
+            else:
+                file_suffix = f"{start_date}-{end_date}"
+            with st.spinner(f"Fetching invoices for {len(tenants_stripped)} tenant(s)..."):
+                ledger = ExportLedger.load()
+                tmp_name = None
+                try:
+                    if export_mode == "Since last export":
+                        rows_iter = iter_changed_invoice_rows(tenants_stripped, ledger, start_date)
+                    else:
+                        rows_iter = iter_invoice_rows(tenants_stripped, start_date, end_date)
+                    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                        tmp_name = f.name
+                        if zipped:
+                            ss.invoice_row_count = write_invoices_zip(rows_iter, f, file_suffix, ledger=ledger)
+                        else:
+                            ss.invoice_row_count = write_invoices_csv(rows_iter, f, ledger=ledger)
+                    ledger.save(advance_mark=export_mode == "Since last export")
+                except LedgerConflictError as e:
+                    st.error(str(e))
+                else:
+                    ss.invoice_file, tmp_name = tmp_name, None # kept for the download button
+                    ss.invoice_file_name = f"invoices_{file_suffix}{suffix}"
+                    ss.invoice_mime = "application/zip" if zipped else "text/csv"
+                    if not zipped:
+                        ss.invoice_preview = pd.read_csv(ss.invoice_file, nrows=100)
+                finally:
+                    ledger.close()
+                    # Partial export from a failed fetch or a ledger conflict.
+                    if tmp_name is not None:
+                        os.remove(tmp_name)
+
+        if ss.invoice_file:
+            with open(ss.invoice_file, "rb") as f:
+                st.download_button(
+                    label="Download Invoices",
+                    data=f,
+                    file_name=ss.invoice_file_name,
+                    mime=ss.invoice_mime,
+                    icon=":material/download:",
+                )
 
         if st.button("Clear Data", key="clear_data_button"):
-            ss.invoice_data = None
-            ss.invoice_start_date = "NO_DATE_SELECTED"
-            ss.invoice_end_date = None
-    st.write("Current Data:")
-    st.dataframe(ss.invoice_data)
+            clear_invoice_file()
+    st.write(f"Current Data: {ss.invoice_row_count} invoices")
+    if ss.invoice_preview is not None:
+        st.caption("First 100 rows:")
+        st.dataframe(ss.invoice_preview)
+    profiling.finish()
 
 elif ss["authentication_status"] is False:
     st.error('Go to home page to log in.')
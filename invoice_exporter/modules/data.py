@@ -1,11 +1,20 @@
 import pandas as pd
 from google.cloud import secretmanager
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
 from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from io import TextIOWrapper
+import csv
+import zipfile
 import pytz
+import streamlit as st
 
 import servicepytan as sp
 
+import modules.st_fixtures as st_fixtures
+
 def get_secret(secret_id, project_id="prestigious-gcp", version_id="latest"):
     client = secretmanager.SecretManagerServiceClient()
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
@@ -24,63 +33,212 @@ def get_secret(secret_id, project_id="prestigious-gcp", version_id="latest"):
 #     }
 #     return codes
 
-def get_invoices_for_xero(tenant_stripped, start_date, end_date):
+XERO_COLUMNS = [
+    '*InvoiceNumber',
+    'Invoice Date',
+    '*ContactName',
+    'POAddressLine1',
+    'POCity',
+    'PORegion',
+    'POPostalCode',
+    'POCountry',
+    '*Description',
+    '*UnitAmount',
+    '*TaxType',
+    'Sum',
+    '*AccountCode',
+]
+
+def account_codes():
+    codes = {
+        'foxtrotwhiskey': '210-2',
+        'sierradelta': '210-1',
+        'victortango': '210-1',
+        'echozulu': '210-1',
+        'bravogolf': '210-4',
+        'mikeecho': '210-3',
+    }
+    return codes
 
-    def account_codes():
-        codes = {
-            'foxtrotwhiskey': '210-2',
-            'sierradelta': '210-1',
-            'victortango': '210-1',
-            'echozulu': '210-1',
-            'bravogolf': '210-4',
-            'mikeecho': '210-3',
-        }
-        return codes
-
-    # def format_address(customerAddress):
-    #     address = f"{customerAddress['street']}, {customerAddress['city']}, {customerAddress['state']} {customerAddress['zip']}, {customerAddress['country']}"
-    #     if customerAddress['unit']:
-    #         address = f"{customerAddress['unit']}/{address}"
-    #     return address
-
-    def format_invoice(invoice):
-        formatted = {}
-        invoice_num = invoice['referenceNumber']
-        if tenant_stripped == "sierradelta" and invoice_num.startswith("1"):
-            formatted['*InvoiceNumber'] = 'W' + invoice_num
-        else:
-            formatted['*InvoiceNumber'] = invoice_num
-        formatted['Invoice Date'] = datetime.fromisoformat(invoice['invoiceDate'].replace('Z', '+00:00')).strftime("%m/%d/%Y")
-        formatted['*ContactName'] = invoice['customer']['name']
-        # formatted['Location Address'] = format_address(invoice['customerAddress'])
-        formatted['POAddressLine1'] = invoice['customerAddress']['street']
-        if invoice['customerAddress']['unit']:
-            formatted['POAddressLine1'] = f"{invoice['customerAddress']['unit']}/{formatted['POAddressLine1']}"
-        formatted['POCity'] = invoice['customerAddress']['city']
-        formatted['PORegion'] = invoice['customerAddress']['state']
-        formatted['POPostalCode'] = invoice['customerAddress']['zip']
-        formatted['POCountry'] = invoice['customerAddress']['country']
-        formatted['*Description'] = invoice['job']['type']
-        formatted['*UnitAmount'] = invoice['subTotal']
-        formatted['*TaxType'] = "GST on Income"
-        formatted['Sum'] = invoice['total']
-        formatted['*AccountCode'] = account_codes()[tenant_stripped]
-        return formatted
+# def format_address(customerAddress):
+#     address = f"{customerAddress['street']}, {customerAddress['city']}, {customerAddress['state']} {customerAddress['zip']}, {customerAddress['country']}"
+#     if customerAddress['unit']:
+#         address = f"{customerAddress['unit']}/{address}"
+#     return address
 
+def format_invoice(invoice, tenant_stripped):
+    formatted = {}
+    invoice_num = invoice['referenceNumber']
+    if tenant_stripped == "sierradelta" and invoice_num.startswith("1"):
+        formatted['*InvoiceNumber'] = 'W' + invoice_num
+    else:
+        formatted['*InvoiceNumber'] = invoice_num
+    formatted['Invoice Date'] = datetime.fromisoformat(invoice['invoiceDate'].replace('Z', '+00:00')).strftime("%m/%d/%Y")
+    formatted['*ContactName'] = invoice['customer']['name']
+    # formatted['Location Address'] = format_address(invoice['customerAddress'])
+    formatted['POAddressLine1'] = invoice['customerAddress']['street']
+    if invoice['customerAddress']['unit']:
+        formatted['POAddressLine1'] = f"{invoice['customerAddress']['unit']}/{formatted['POAddressLine1']}"
+    formatted['POCity'] = invoice['customerAddress']['city']
+    formatted['PORegion'] = invoice['customerAddress']['state']
+    formatted['POPostalCode'] = invoice['customerAddress']['zip']
+    formatted['POCountry'] = invoice['customerAddress']['country']
+    formatted['*Description'] = invoice['job']['type']
+    formatted['*UnitAmount'] = invoice['subTotal']
+    formatted['*TaxType'] = "GST on Income"
+    formatted['Sum'] = invoice['total']
+    formatted['*AccountCode'] = account_codes()[tenant_stripped]
+    return formatted
+
+@st.cache_resource(show_spinner=False)
+def get_data_service(tenant_stripped):
+    """One servicepytan connection per tenant, shared across reruns and sessions."""
+    st_fixtures.install() # no-op unless ST_FIXTURE_MODE is set
     st_conn = sp.auth.servicepytan_connect(app_key=get_secret("st_app_key_tester"), tenant_id=get_secret(f"st_tenant_id_{tenant_stripped}"), client_id=get_secret(f"st_client_id_{tenant_stripped}"), 
     client_secret=get_secret(f"st_client_secret_{tenant_stripped}"), timezone="Australia/Sydney")
-    st_data_service = sp.DataService(conn=st_conn)
+    return sp.DataService(conn=st_conn)
+
+def date_windows(start_date, end_date, window_days=None):
+    """
+    Split an inclusive date range into consecutive (start, end) windows of `window_days` days.
+    If not given, ranges up to a month use daily windows and longer ones weekly.
+    """
+    if window_days is None:
+        window_days = 1 if (end_date - start_date).days < 31 else 7
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
 
-    start_time = datetime.combine(start_date, time(0,0,0))
-    end_time = datetime.combine(end_date, time(23,59,59))
+def fetch_invoice_window(tenant_stripped, window_start, window_end):
+    """Formatted Xero rows for one tenant and date window."""
+    st_data_service = get_data_service(tenant_stripped)
+
+    start_time = datetime.combine(window_start, time(0,0,0))
+    end_time = datetime.combine(window_end, time(23,59,59))
 
     invoice_response = st_data_service.get_invoices_between(start_time, end_time)
+    return [format_invoice_row(invoice, tenant_stripped) for invoice in invoice_response]
+
+def format_invoice_row(invoice, tenant_stripped):
+    """format_invoice plus the id and modifiedOn needed by the export ledger. The extra keys aren't written to the CSV."""
+    row = format_invoice(invoice, tenant_stripped)
+    row['_invoice_id'] = invoice['id']
+    row['_modified_on'] = invoice.get('modifiedOn')
+    return row
+
+def fetch_invoices_modified_since(tenant_stripped, since):
+    """Raw invoices created or modified on or after `since` (UTC, ISO format)."""
+    st_data_service = get_data_service(tenant_stripped)
+    return st_data_service.get_api_data('accounting', 'invoices', options={'modifiedOnOrAfter': since})
+
+def changed_since(tenant_stripped, ledger, fallback_start_date):
+    """The tenant's last export mark, or the start of `fallback_start_date` if it has never been exported."""
+    since = ledger.last_export_mark(tenant_stripped)
+    if since is None:
+        since = datetime.combine(fallback_start_date, time(0,0,0), tzinfo=ZoneInfo("Australia/Sydney")).astimezone(ZoneInfo("UTC")).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return since
 
-    invoices = [format_invoice(invoice) for invoice in invoice_response]
-    
-    return pd.DataFrame(invoices)
+def iter_changed_invoice_rows(tenants, ledger, fallback_start_date, max_workers=7):
+    """
+    Yield (tenant, rows) of invoices changed since each tenant's last export,
+    skipping versions the ledger has already exported. Rows come out in tenant order.
+
+    Tenants are fetched in parallel. The ledger is only read here, in the calling
+    thread, as its SQLite connection can't be shared with the fetch threads.
+    """
+    # Connections are created up front so the secret lookups and auth don't race in the threads.
+    for tenant_stripped in tenants:
+        get_data_service(tenant_stripped)
+
+    marks = [(tenant_stripped, changed_since(tenant_stripped, ledger, fallback_start_date)) for tenant_stripped in tenants]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [(tenant_stripped, pool.submit(fetch_invoices_modified_since, tenant_stripped, since)) for tenant_stripped, since in marks]
+        for tenant_stripped, fut in futures:
+            yield tenant_stripped, [
+                format_invoice_row(invoice, tenant_stripped) for invoice in fut.result()
+                if not ledger.is_exported(tenant_stripped, invoice['id'], invoice.get('modifiedOn'))
+            ]
+
+def iter_invoice_rows(tenants, start_date, end_date, window_days=None, max_workers=7):
+    """
+    Yield (tenant, rows) for each tenant and date window, in tenant then date order.
+
+    Windows are fetched in parallel, but only `max_workers` are in flight at once
+    so memory use doesn't grow with the length of the range.
+    """
+    # Connections are created up front so the secret lookups and auth don't race in the threads.
+    for tenant_stripped in tenants:
+        get_data_service(tenant_stripped)
+
+    windows = iter([(tenant_stripped, ws, we) for tenant_stripped in tenants for ws, we in date_windows(start_date, end_date, window_days)])
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        for window in islice(windows, max_workers):
+            in_flight.append((window[0], pool.submit(fetch_invoice_window, *window)))
+        while in_flight:
+            tenant_stripped, fut = in_flight.popleft()
+            rows = fut.result()
+            next_window = next(windows, None)
+            if next_window is not None:
+                in_flight.append((next_window[0], pool.submit(fetch_invoice_window, *next_window)))
+            yield tenant_stripped, rows
+
+def write_invoices_csv(rows_iter, file_obj, ledger=None):
+    """
+    Write (tenant, rows) from `rows_iter` as one combined Xero CSV to a binary file object.
+    Rows are recorded in `ledger` if given. Returns the row count.
+    """
+    text = TextIOWrapper(file_obj, encoding="utf-8", newline="")
+    writer = csv.DictWriter(text, fieldnames=XERO_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for tenant_stripped, rows in rows_iter:
+        writer.writerows(rows)
+        count += len(rows)
+        if ledger is not None:
+            ledger.record(tenant_stripped, rows)
+    text.flush()
+    text.detach()
+    return count
+
+def write_invoices_zip(rows_iter, file_obj, file_suffix, ledger=None):
+    """
+    Write (tenant, rows) from `rows_iter` as a zip with one Xero CSV per tenant to a binary file object.
+    `rows_iter` must yield each tenant's rows together. Rows are recorded in `ledger` if given.
+    Returns the row count.
+    """
+    count = 0
+    with zipfile.ZipFile(file_obj, "w", zipfile.ZIP_DEFLATED) as zf:
+        current_tenant = None
+        entry = text = writer = None
+        for tenant_stripped, rows in rows_iter:
+            if tenant_stripped != current_tenant:
+                if text is not None:
+                    text.close()
+                current_tenant = tenant_stripped
+                entry = zf.open(f"invoices_{tenant_stripped}_{file_suffix}.csv", "w")
+                text = TextIOWrapper(entry, encoding="utf-8", newline="")
+                writer = csv.DictWriter(text, fieldnames=XERO_COLUMNS, extrasaction="ignore")
+                writer.writeheader()
+            writer.writerows(rows)
+            count += len(rows)
+            if ledger is not None:
+                ledger.record(tenant_stripped, rows)
+        if text is not None:
+            text.close()
+    return count
+
+def get_invoices_for_xero(tenant_stripped, start_date, end_date):
+    rows = []
+    for _, window_rows in iter_invoice_rows([tenant_stripped], start_date, end_date):
+        rows.extend(window_rows)
+    return pd.DataFrame(rows, columns=XERO_COLUMNS)
 
 def convert_df_for_download(df):
     if df is None:
         df = pd.DataFrame()
-    return df.to_csv(index=False).encode("utf-8")
\ No newline at end of file
+    return df.to_csv(index=False).encode("utf-8")
@@ -1,9 +1,22 @@
+import copy
 import json
+import os
+import threading
+import time
+from functools import lru_cache
 import yaml
 from google.cloud import storage
 
 BUCKET_NAME = "prestigious_config_files"
 
+# Config blobs (auth YAML) are cached process-wide and only revalidated against GCS after this long.
+# Revalidating is one metadata request; the blob is only downloaded again if its generation changed.
+CONFIG_TTL = int(os.environ.get("CONFIG_CACHE_TTL", 60)) # seconds
+
+_config_cache = {} # blob name -> (generation, checked_at, parsed data)
+_config_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
 def _get_bucket():
     client = storage.Client()
     return client.bucket(BUCKET_NAME)
@@ -28,17 +41,36 @@ def save_file(json_dict: dict, blobname):
         content_type="application/json"
     )
 
-def load_yaml_from_gcs(blob_name):
-    """Load YAML config from GCS"""
+def save_bytes(data: bytes, blobname, content_type="application/octet-stream"):
+    """Save raw bytes (e.g. a zip or workbook) to GCS."""
     bucket = _get_bucket()
-    blob = bucket.blob(blob_name)
+    blob = bucket.blob(blobname)
+    blob.upload_from_string(data, content_type=content_type)
 
-    if not blob.exists():
-        return {}  
+def load_yaml_from_gcs(blob_name, ttl=CONFIG_TTL):
+    """
+    Load YAML config from GCS, cached per process.
 
-    data = blob.download_as_text()
+    Returns a copy each call, since callers (e.g. streamlit_authenticator) modify the config in place.
+    """
+    now = time.monotonic()
+    with _config_lock:
+        cached = _config_cache.get(blob_name)
+    if cached is not None and now - cached[1] < ttl:
+        return copy.deepcopy(cached[2])
 
-    return yaml.safe_load(data)
+    blob = _get_bucket().get_blob(blob_name)
+    if blob is None:
+        generation, data = 0, {}
+    elif cached is not None and cached[0] == blob.generation:
+        generation, data = cached[0], cached[2]
+    else:
+        generation = blob.generation
+        data = yaml.safe_load(blob.download_as_text(if_generation_match=generation))
+
+    with _config_lock:
+        _config_cache[blob_name] = (generation, now, data)
+    return copy.deepcopy(data)
 
 def save_yaml_to_gcs(data, blobname):
     """Save YAML config back to GCS."""
@@ -46,4 +78,24 @@ def save_yaml_to_gcs(data, blobname):
 
     bucket = _get_bucket()
     blob = bucket.blob(blobname)
-    blob.upload_from_string(yaml_text, content_type="text/yaml")
\ No newline at end of file
+    blob.upload_from_string(yaml_text, content_type="text/yaml")
+    with _config_lock:
+        _config_cache[blobname] = (blob.generation, time.monotonic(), copy.deepcopy(data))
+
+def download_blob_to_file(blob_name, path):
+    """Download a blob to a local path. Returns the blob generation, or 0 if it doesn't exist."""
+    bucket = _get_bucket()
+    blob = bucket.blob(blob_name)
+
+    if not blob.exists():
+        return 0
+
+    blob.reload()
+    blob.download_to_filename(path, if_generation_match=blob.generation)
+    return blob.generation
+
+def upload_file_to_blob(path, blob_name, if_generation_match=None):
+    """Upload a local file. With `if_generation_match`, fails if the blob changed since it was downloaded (0 = must not exist)."""
+    bucket = _get_bucket()
+    blob = bucket.blob(blob_name)
+    blob.upload_from_filename(path, if_generation_match=if_generation_match)
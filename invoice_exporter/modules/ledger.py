@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+from google.api_core.exceptions import PreconditionFailed
+
+import modules.google_store as gs
+
+# Record of every invoice exported to Xero, per tenant, so later exports can skip what's already been sent.
+# Stored as a SQLite file in GCS. It's downloaded at the start of an export and uploaded at the end.
+LEDGER_BLOB = 'xero_export_ledger.sqlite'
+
+# ServiceTitan's modifiedOn has anywhere from 0 to 7 fractional digits, so its text order isn't time order.
+# Timestamps are stored and compared in this fixed-width UTC form instead.
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+def normalise_timestamp(value):
+    """`value` as a fixed-width UTC timestamp, or None. Fractions beyond microseconds are dropped."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+class LedgerConflictError(Exception):
+    """Someone else saved the ledger while this export was running."""
+
+class ExportLedger:
+    def __init__(self, path, generation):
+        self.path = path
+        self.generation = generation
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS exported_invoices (
+                tenant TEXT NOT NULL,
+                invoice_id INTEGER NOT NULL,
+                modified_on TEXT,
+                exported_at TEXT NOT NULL,
+                PRIMARY KEY (tenant, invoice_id)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS exports (
+                tenant TEXT NOT NULL,
+                exported_at TEXT NOT NULL,
+                high_water_mark TEXT,
+                row_count INTEGER NOT NULL
+            )
+            """
+        )
+        self._counts = {}
+        self._marks = {}
+
+    @classmethod
+    def load(cls):
+        path = os.path.join(tempfile.mkdtemp(), LEDGER_BLOB)
+        generation = gs.download_blob_to_file(LEDGER_BLOB, path)
+        return cls(path, generation)
+
+    def last_export_mark(self, tenant):
+        """Latest `modifiedOn` exported for the tenant, or None if it has never been exported."""
+        rows = self.conn.execute(
+            "SELECT high_water_mark FROM exports WHERE tenant = ? AND high_water_mark IS NOT NULL",
+            (tenant,),
+        ).fetchall()
+        # Normalised here too, for marks saved before they were stored normalised
+        return max((normalise_timestamp(row[0]) for row in rows), default=None)
+
+    def is_exported(self, tenant, invoice_id, modified_on):
+        """True if this version of the invoice has already been exported."""
+        row = self.conn.execute(
+            "SELECT modified_on FROM exported_invoices WHERE tenant = ? AND invoice_id = ?",
+            (tenant, int(invoice_id)),
+        ).fetchone()
+        if row is None or row[0] is None or modified_on is None:
+            return False
+        return normalise_timestamp(row[0]) >= normalise_timestamp(modified_on)
+
+    def record(self, tenant, rows):
+        """Record rows written to an export. Rows need the `_invoice_id` and `_modified_on` keys."""
+        exported_at = datetime.now().isoformat()
+        self.conn.executemany(
+            """
+            INSERT INTO exported_invoices (tenant, invoice_id, modified_on, exported_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (tenant, invoice_id) DO UPDATE SET modified_on = excluded.modified_on, exported_at = excluded.exported_at
+            """,
+            [(tenant, int(row['_invoice_id']), normalise_timestamp(row['_modified_on']), exported_at) for row in rows],
+        )
+        self._counts[tenant] = self._counts.get(tenant, 0) + len(rows)
+        marks = [normalise_timestamp(row['_modified_on']) for row in rows if row['_modified_on']]
+        if marks:
+            self._marks[tenant] = max([self._marks.get(tenant) or ''] + marks)
+
+    def save(self, advance_mark=True):
+        """
+        Write an export entry per tenant recorded and upload the ledger.
+
+        Date range exports should pass `advance_mark=False`: they can include recently
+        modified invoices without covering everything modified before them, so they
+        mustn't move the point "since last export" starts from.
+        """
+        exported_at = datetime.now().isoformat()
+        for tenant, count in self._counts.items():
+            self.conn.execute(
+                "INSERT INTO exports (tenant, exported_at, high_water_mark, row_count) VALUES (?, ?, ?, ?)",
+                (tenant, exported_at, self._marks.get(tenant) if advance_mark else None, count),
+            )
+        self.conn.commit()
+        try:
+            gs.upload_file_to_blob(self.path, LEDGER_BLOB, if_generation_match=self.generation)
+        except PreconditionFailed as e:
+            raise LedgerConflictError(f"The export ledger was updated by another export, please fetch again. ({e})")
+        self._counts = {}
+        self._marks = {}
+
+    def close(self):
+        self.conn.close()
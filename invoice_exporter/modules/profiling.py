@@ -0,0 +1,261 @@
+"""
+On-demand profiling of a single Streamlit run, for admins.
+
+An admin clicks "Profile next run" in the sidebar and then uses the page as normal, e.g. clicks
+the button that starts a slow export. That next script run is profiled with either cProfile or a
+sampling profiler, and tracemalloc records where memory was allocated. The result is a zip containing:
+
+    profile.prof     cProfile stats (snakeviz profile.prof, or flameprof for a flamegraph)
+    stacks.folded    sampled stacks in folded format (flamegraph.pl, speedscope.app)
+    stats.txt        top functions as text
+    allocations.txt  top allocation sites during the run, and the peak traced memory
+    meta.json        app, user, mode, timings
+
+The zip is uploaded to GCS under PROFILE_PREFIX and offered as a download in the sidebar.
+
+Admins are users with the "admin" role in the auth config, or usernames listed in the
+PROFILING_ADMINS environment variable (comma separated).
+
+Copied into each app's modules/; keep the copies identical (tests/test_shared_copies.py checks).
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+import streamlit as st
+from streamlit import session_state as ss
+
+import modules.google_store as gs
+
+PROFILING_ADMINS = {u.strip() for u in os.environ.get("PROFILING_ADMINS", "").split(",") if u.strip()}
+PROFILE_PREFIX = os.environ.get("PROFILE_PREFIX", "profiles")
+SAMPLE_INTERVAL = 0.005 # seconds between stack samples in sampling mode
+TOP_N = 40
+MAX_PROFILES_KEPT = 3 # per session, for the download buttons
+
+MODES = ("cProfile", "Sampling")
+
+# tracemalloc is process-wide, so it runs while any session is being profiled
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+def is_admin() -> bool:
+    if not ss.get("authentication_status"):
+        return False
+    return "admin" in (ss.get("roles") or []) or ss.get("username") in PROFILING_ADMINS
+
+# -------------------------------------------------------------------
+# PROFILERS
+# -------------------------------------------------------------------
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread and counts folded stacks."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top_text(self, n: int = TOP_N) -> str:
+        """Self and total sample counts per frame, like a flat profile."""
+        total = sum(self.stacks.values()) or 1
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        lines = [f"{total} samples every {self.interval * 1000:.0f} ms", "", "self%   total%  frame"]
+        for frame, count in own.most_common(n):
+            lines.append(f"{100 * count / total:5.1f}  {100 * inclusive[frame] / total:6.1f}  {frame}")
+        return "\n".join(lines)
+
+class ProfiledRun:
+    def __init__(self, app_name: str, mode: str):
+        self.app_name = app_name
+        self.mode = mode
+        self.user = ss.get("username", "")
+        self.started = datetime.now()
+        self.thread_id = threading.get_ident()
+        self.profiler: Optional[cProfile.Profile] = None
+        self.sampler: Optional[SamplingProfiler] = None
+        self.snapshot_before: Optional[tracemalloc.Snapshot] = None
+
+    def start(self):
+        global _tracemalloc_users
+        with _tracemalloc_lock:
+            if _tracemalloc_users == 0:
+                tracemalloc.start()
+            _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+        self.snapshot_before = tracemalloc.take_snapshot()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        if self.mode == "Sampling":
+            self.sampler = SamplingProfiler(self.thread_id)
+            self.sampler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self, completed: bool) -> Dict[str, Any]:
+        """Stop profiling and return the report as {'name', 'zip', 'blob', 'wall_s'}."""
+        global _tracemalloc_users
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0:
+                tracemalloc.stop()
+
+        files: Dict[str, str | bytes] = {}
+        if self.profiler is not None:
+            self.profiler.create_stats()
+            files["profile.prof"] = marshal.dumps(self.profiler.stats) # what Profile.dump_stats writes
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(TOP_N)
+            files["stats.txt"] = out.getvalue()
+        if self.sampler is not None:
+            files["stacks.folded"] = self.sampler.folded()
+            files["stats.txt"] = self.sampler.top_text()
+        files["allocations.txt"] = _allocation_report(self.snapshot_before, snapshot_after, peak)
+        files["meta.json"] = json.dumps({
+            "app": self.app_name,
+            "user": self.user,
+            "mode": self.mode,
+            "started": self.started.isoformat(timespec="seconds"),
+            "completed": completed, # False if the run was interrupted, e.g. by st.rerun or an error
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "peak_traced_mb": round(peak / 1e6, 1),
+        }, indent=2)
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, content in files.items():
+                zf.writestr(name, content)
+        name = f"{self.app_name}_{self.started:%Y%m%d_%H%M%S}_{self.mode.lower()}.zip"
+        return {"name": name, "zip": buffer.getvalue(), "blob": f"{PROFILE_PREFIX}/{self.app_name}/{name}", "wall_s": wall}
+
+def _allocation_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int) -> str:
+    lines = [f"Peak traced memory during run: {peak / 1e6:.1f} MB", "", f"Top {TOP_N} allocation sites by growth during the run:"]
+    for stat in after.compare_to(before, "lineno")[:TOP_N]:
+        lines.append(str(stat))
+    lines += ["", f"Top {TOP_N} allocation sites still held at the end of the run:"]
+    for stat in after.statistics("lineno")[:TOP_N]:
+        lines.append(str(stat))
+    return "\n".join(lines)
+
+# -------------------------------------------------------------------
+# STREAMLIT HOOKS
+# -------------------------------------------------------------------
+
+def start(app_name: str) -> None:
+    """
+    Call at the top of the page, after login. Starts profiling if an admin asked for it.
+
+    A profile left running by a run that didn't reach `finish` (st.rerun, st.stop, an error) is
+    collected first and marked incomplete.
+    """
+    if ss.get("_profiling_run") is not None:
+        _collect(completed=False)
+    if not ss.pop("profile_next_run", False) or not is_admin():
+        return
+    run = ProfiledRun(app_name, ss.get("profile_mode", MODES[0]))
+    run.start()
+    ss["_profiling_run"] = run
+    print(f"Profiling {app_name} run for {run.user} ({run.mode})")
+
+def finish() -> None:
+    """Call at the end of the page. Saves any profile in progress and shows the profiling panel to admins."""
+    if ss.get("_profiling_run") is not None:
+        _collect(completed=True)
+    if is_admin():
+        show_panel()
+
+@contextmanager
+def profiled_run(app_name: str):
+    """`start` and `finish` around a block, for pages that run from a main() function."""
+    start(app_name)
+    try:
+        yield
+    except BaseException:
+        # st.rerun and st.stop end the run with an exception; keep what was profiled so far
+        if ss.get("_profiling_run") is not None:
+            _collect(completed=False)
+        raise
+    finish()
+
+def _collect(completed: bool) -> None:
+    run: ProfiledRun = ss.pop("_profiling_run")
+    result = run.stop(completed)
+    try:
+        gs.save_bytes(result["zip"], result["blob"], "application/zip")
+        print(f"Profile saved to {result['blob']} ({result['wall_s']:.1f}s run)")
+    except Exception as e:
+        print(f"ERROR: couldn't upload profile {result['blob']}: {e}")
+        result["blob"] = None
+    profiles: List[Dict[str, Any]] = ss.setdefault("profiles", [])
+    profiles.insert(0, result)
+    del profiles[MAX_PROFILES_KEPT:]
+
+def _request_profile():
+    ss["profile_next_run"] = True
+
+def show_panel() -> None:
+    with st.sidebar.expander("Profiling (admin)"):
+        st.radio("Profiler", MODES, key="profile_mode", horizontal=True,
+                 help="cProfile records every call; sampling adds less overhead to long runs.")
+        if ss.get("profile_next_run"):
+            st.caption("The next run will be profiled.")
+        else:
+            st.button("Profile next run", on_click=_request_profile)
+        for profile in ss.get("profiles", []):
+            st.download_button(profile["name"], profile["zip"], file_name=profile["name"],
+                               mime="application/zip", key=f"profile_{profile['name']}")
+            if profile["blob"]:
+                st.caption(f"Saved to gs://{gs.BUCKET_NAME}/{profile['blob']}")
@@ -0,0 +1,55 @@
+import pytest
+
+from modules.ledger import ExportLedger, normalise_timestamp
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = ExportLedger(str(tmp_path / "ledger.sqlite"), generation=0)
+    yield ledger
+    ledger.close()
+
+
+def row(invoice_id, modified_on):
+    return {'_invoice_id': invoice_id, '_modified_on': modified_on}
+
+
+def test_normalise_timestamp_is_fixed_width_utc():
+    assert normalise_timestamp('2025-03-01T10:00:05.1Z') == '2025-03-01T10:00:05.100000Z'
+    assert normalise_timestamp('2025-03-01T10:00:05Z') == '2025-03-01T10:00:05.000000Z'
+    assert normalise_timestamp('2025-03-01T10:00:05.1234567Z') == '2025-03-01T10:00:05.123456Z'
+    assert normalise_timestamp('2025-03-01T21:00:05+11:00') == '2025-03-01T10:00:05.000000Z'
+    assert normalise_timestamp(None) is None
+
+
+@pytest.mark.parametrize("exported, current, expected", [
+    # Text order gets these wrong: '.1Z' > '.123Z' and '05Z' > '05.5Z'
+    ('2025-03-01T10:00:05.1Z', '2025-03-01T10:00:05.123Z', False),
+    ('2025-03-01T10:00:05Z', '2025-03-01T10:00:05.5Z', False),
+    ('2025-03-01T10:00:05.123Z', '2025-03-01T10:00:05.1Z', True),
+    ('2025-03-01T10:00:05.1Z', '2025-03-01T10:00:05.100Z', True),
+])
+def test_is_exported_compares_times_not_text(ledger, exported, current, expected):
+    ledger.record('tenant', [row(1, exported)])
+    assert ledger.is_exported('tenant', 1, current) is expected
+
+
+def test_is_exported_unknown_invoice_or_missing_timestamp(ledger):
+    ledger.record('tenant', [row(1, '2025-03-01T10:00:05Z')])
+    assert not ledger.is_exported('tenant', 2, '2025-03-01T10:00:05Z')
+    assert not ledger.is_exported('other', 1, '2025-03-01T10:00:05Z')
+    assert not ledger.is_exported('tenant', 1, None)
+
+
+def test_last_export_mark_is_the_latest_time(ledger, monkeypatch):
+    monkeypatch.setattr("modules.google_store.upload_file_to_blob", lambda *args, **kwargs: None)
+    assert ledger.last_export_mark('tenant') is None
+
+    ledger.record('tenant', [row(1, '2025-03-01T10:00:05.5Z'), row(2, '2025-03-01T10:00:05Z')])
+    ledger.save()
+    # A mark saved before marks were normalised
+    ledger.conn.execute("INSERT INTO exports VALUES ('tenant', '2025-03-01', '2025-03-01T10:00:05.45Z', 1)")
+    ledger.record('tenant', [row(3, '2025-03-01T10:00:05.123Z')])
+    ledger.save(advance_mark=False)
+
+    assert ledger.last_export_mark('tenant') == '2025-03-01T10:00:05.500000Z'
@@ -17,6 +17,8 @@ import modules.helpers as helpers
 import modules.templates as templates
 import modules.fetching as fetch
 import modules.tasks as tasks
+import modules.submissions as submissions
+import modules.profiling as profiling
 
 ###############################################################################
 # Filter warnings
@@ -103,14 +105,23 @@ def main() -> None:
                 st.session_state.jobs_queued: Dict = {}
             if "current_num_jobs" not in st.session_state:
                 st.session_state.current_num_jobs: int = 0
-            if "max_jobs_shown" not in st.session_state:
-                st.session_state.max_jobs_shown: int = 0
+            if "job_pages_loaded" not in st.session_state:
+                st.session_state.job_pages_loaded: Set[int] = set()
+            if "job_status_cache" not in st.session_state:
+                st.session_state.job_status_cache: Dict[str, Tuple] = {}
+            if "job_attachments_cache" not in st.session_state:
+                st.session_state.job_attachments_cache: Dict[str, Tuple] = {}
+            if "job_page_futures" not in st.session_state:
+                st.session_state.job_page_futures: Dict[int, Future] = {}
             
 
+        submissions.start_worker()
+
         # st.write(st.session_state.jobs_queued)
         templates.sidebar_filters()
 
         with st.sidebar:
+            templates.submission_queue_status()
             st.markdown("---")
 
         do_not_load_imgs_box = st.sidebar.checkbox("Don't load images")
@@ -120,11 +131,10 @@ def main() -> None:
 
         # Display the current job if available
         if st.session_state.jobs:
-            
-            if st.session_state.current_num_jobs > st.session_state.max_jobs_shown: # These are set in helpers
-                st.info(f"NOTE: There are actually {st.session_state.current_num_jobs} jobs for these parameters, but only {st.session_state.max_jobs_shown} are being shown so the website doesn't get overloaded. Please fetch jobs again after finishing to load more jobs in!")
             client = st.session_state.clients.get(st.session_state.current_tenant)
             idx = st.session_state.current_index
+            with st.spinner("Loading job data..."):
+                helpers.ensure_job_page_loaded(idx, client)
             # job, job_id, job_num = templates.job_nav_buttons(idx)
             job = st.session_state.jobs[idx]
             job_id = str(job.get("id"))
@@ -171,7 +181,7 @@ def main() -> None:
                 templates.show_job_info(job)
 
             with attachments_col:
-                job_attachment_status, error_msg, last_update_time = fetch.get_job_status(job_id, st.session_state.clients['supabase'], st.session_state.current_tenant)
+                job_attachment_status, error_msg, last_update_time = fetch.get_job_status_cached(job_id, st.session_state.clients['supabase'], st.session_state.current_tenant)
                 try:
                     last_update_time = datetime.fromisoformat(last_update_time).replace(tzinfo=ZoneInfo("Australia/Sydney"))
                     update_time_diff = datetime.now() - last_update_time
@@ -181,7 +191,7 @@ def main() -> None:
 
                 if show_imgs:
                     if job_attachment_status == 2:# and update_time_diff < timedelta(seconds=(SIGNED_URL_TTL-100)):
-                        attachments_response = fetch.get_attachments_supabase(job_id, st.session_state.clients['supabase'], st.session_state.current_tenant)
+                        attachments_response = fetch.get_attachments_cached(job_id, st.session_state.clients['supabase'], st.session_state.current_tenant)
 
                         imgs = [att for att in attachments_response if att['type'] == 'img']
                         pdfs = [att for att in attachments_response if att['type'] == 'pdf']
@@ -207,7 +217,8 @@ def main() -> None:
                                 del st.session_state.jobs_queued[job_id]
                             st.session_state.refresh_5_sec_count += 1
                             print(f"This has refreshed after 5 seconds {st.session_state.refresh_5_sec_count} times for job id {job_id}")
-                            fetch.request_job_download(job_id, st.session_state.current_tenant, ATTACHMENT_DOWNLOADER_URL, force_refresh=True)
+                            fetch.request_job_download(job_id, st.session_state.current_tenant, ATTACHMENT_DOWNLOADER_URL, force_refresh=True, priority=True)
+                            fetch.clear_status_cache(job_id)
                             time.sleep(7)
                             st.rerun()
                     else:
@@ -222,7 +233,7 @@ def main() -> None:
                     #         job_attachment_status_tmp, error_msg_tmp, last_update_time_tmp = fetch.get_job_status(job_id, st.session_state.clients['supabase'], st.session_state.current_tenant)
                     #         print(job_attachment_status, error_msg_tmp, last_update_time_tmp)
                     #     print(f"This has refreshed after 5 seconds {st.session_state.refresh_5_sec_count} times for job id {job_id}")
-                    #     fetch.request_job_download(job_id, st.session_state.current_tenant, ATTACHMENT_DOWNLOADER_URL, force_refresh=True)
+                    #     fetch.request_job_download(job_id, st.session_state.current_tenant, ATTACHMENT_DOWNLOADER_URL, force_refresh=True, priority=True)
                     #     time.sleep(5)
                     #     st.rerun()
 
@@ -269,4 +280,5 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiling.profiled_run('payroll_doc_checker'):
+        main()
\ No newline at end of file
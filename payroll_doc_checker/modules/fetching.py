@@ -5,6 +5,7 @@ from typing import Dict, List, Set, Tuple, Optional, Any, Iterable
 import json
 import requests
 import time
+import math
 import asyncio
 
 
@@ -22,6 +23,20 @@ import modules.tasks as tasks
 ATTACHMENT_DOWNLOADER_URL = 'https://attachment-downloader-293142632916.australia-southeast1.run.app'
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
 
+# Attachment prefetching. The current job goes on its own queue so it isn't stuck behind lookahead downloads.
+# Lookahead jobs still waiting in their queue are cancelled if the reviewer jumps elsewhere or refilters.
+PRIORITY_QUEUE = 'ST-attachment-download-priority-queue'
+LOOKAHEAD_QUEUE = 'ST-attachment-download-queue'
+MIN_LOOKAHEAD = 3
+MAX_LOOKAHEAD = 15
+DEFAULT_SECONDS_PER_JOB = 30 # until measured
+DEFAULT_DOWNLOAD_LATENCY = 20 # seconds, until measured
+MAX_NAV_GAP = 600 # seconds, longer gaps between jobs are treated as breaks and not measured
+EWMA_ALPHA = 0.3
+MAX_LATENCY_POLL_GAP = 15 # seconds, a download is only timed if its status was polled this recently before it was seen processed
+STATUS_CACHE_TTL = 3 # seconds, for jobs whose attachments aren't ready yet. Keep below the refresh sleeps in the main page.
+READY_CACHE_TTL = 300 # seconds, for jobs whose attachments are processed
+
 def fetch_job(
         _client: ServiceTitanClient,
         job_id: str
@@ -47,11 +62,13 @@ def fetch_jobs(
     _client: ServiceTitanClient,
     job_id: str = None,
     status_filters: List = [],
+    with_appts: bool = True,
 ) -> List[Dict[str, Any]]:
     """
     Retrieve all jobs created between `start_date` and `end_date`,
     converting the local date boundaries into UTC timestamps. If
-    job_num specified, just fetches that job.
+    job_num specified, just fetches that job. Set `with_appts` to False
+    to skip the appointment lookups (see `enrich_jobs`).
     """
 
     tenant = _client.tenant or "{tenant}"
@@ -91,6 +108,19 @@ def fetch_jobs(
         else:
             jobs = _client.get_all(base_path, params=params)
 
+    if with_appts:
+        jobs = fetch_appt_info(jobs, _client)
+    return jobs
+
+def fetch_appt_info(
+    jobs: List[Dict[str, Any]],
+    _client: ServiceTitanClient,
+) -> List[Dict[str, Any]]:
+    """
+    Add first and last appointment info to each job in `jobs`.
+    """
+    if not jobs:
+        return jobs
     first_appt_ids = [str(job.get("firstAppointmentId")) for job in jobs]
     last_appt_ids = [str(job.get("lastAppointmentId")) for job in jobs]
     appt_url = _client.build_url('jpm', 'appointments')
@@ -99,10 +129,32 @@ def fetch_jobs(
     last_appts = _client.get_all_id_filter(appt_url, last_appt_ids)
     last_appts = {appt.get("jobId"): appt for appt in last_appts}
     for job in jobs:
-        job = format.add_appt_info(job, first_appts[job['id']], modifier='first')
-        job = format.add_appt_info(job, last_appts[job['id']], modifier='last')
+        job = format.add_appt_info(job, first_appts.get(job['id'], {}), modifier='first')
+        job = format.add_appt_info(job, last_appts.get(job['id'], {}), modifier='last')
     return jobs
 
+def enrich_jobs(
+    jobs: List[Dict[str, Any]],
+    _client: ServiceTitanClient,
+) -> List[Dict[str, Any]]:
+    """
+    Add appointment, invoice and payment data to a page of jobs.
+
+    Works on shallow copies of the jobs and doesn't touch session state, so
+    it is safe to run in a background thread. Returns the enriched copies.
+    """
+    jobs = [dict(job) for job in jobs]
+    jobs = fetch_appt_info(jobs, _client)
+
+    invoice_ids = format.get_invoice_ids(jobs)
+    invoices = fetch_invoices(invoice_ids, _client)
+    payments = fetch_payments(invoice_ids, _client)
+
+    invoices = {invoice['id']: format.format_invoice(invoice) for invoice in invoices}
+    payments = format.format_payments(payments)
+
+    return format.combine_job_data(jobs, invoices, payments)
+
 # @st.cache_data(show_spinner=False)
 def fetch_job_attachments(job_id: str, _client: ServiceTitanClient) -> List[Dict[str, Any]]:
     """Retrieve attachment metadata for the given job ID.
@@ -206,45 +258,118 @@ def get_tag_types(client: ServiceTitanClient):
     url = client.build_url('settings', 'tag-types')
     return client.get_all(url)
 
-def request_job_download(job_id, tenant, base_url=ATTACHMENT_DOWNLOADER_URL, force_refresh=False):
-    # print(f'requested job download for {job_id}...')
+def _ewma(prev: Optional[float], value: float) -> float:
+    if prev is None:
+        return value
+    return EWMA_ALPHA * value + (1 - EWMA_ALPHA) * prev
+
+def get_lookahead() -> int:
+    """Number of jobs from the current index to prefetch, from measured reviewer speed and download latency."""
+    seconds_per_job = st.session_state.get("seconds_per_job") or DEFAULT_SECONDS_PER_JOB
+    download_latency = st.session_state.get("download_latency") or DEFAULT_DOWNLOAD_LATENCY
+    lookahead = math.ceil(download_latency / max(seconds_per_job, 1)) + 2
+    return max(MIN_LOOKAHEAD, min(lookahead, MAX_LOOKAHEAD))
+
+def record_navigation() -> None:
+    """Update the reviewer speed estimate. Only single-step moves are measured, jumps just reset the clock."""
+    now = time.time()
+    current = st.session_state.current_index
+    last_index = st.session_state.get("last_nav_index")
+    last_time = st.session_state.get("last_nav_time")
+    if last_index is not None and abs(current - last_index) == 1:
+        elapsed = now - last_time
+        if elapsed < MAX_NAV_GAP:
+            st.session_state.seconds_per_job = _ewma(st.session_state.get("seconds_per_job"), elapsed)
+    st.session_state.last_nav_index = current
+    st.session_state.last_nav_time = now
+
+def record_download_status(job_id: str, ready: bool) -> None:
+    """Called for each status poll of a job. Times the download from when it was
+    requested to the first poll that sees it processed.
+
+    The job could have finished any time since the previous poll, so it's only
+    timed if that poll was within ``MAX_LATENCY_POLL_GAP``. Lookahead jobs are
+    usually only polled again when the reviewer moves on, and timing those
+    would count the reviewer's time on the current job.
+    """
+    queued = st.session_state.jobs_queued.get(job_id)
+    if queued is None or queued["ready_seen"]:
+        return
+    now = time.time()
+    if not ready:
+        queued["pending_seen_at"] = now
+        return
+    queued["ready_seen"] = True
+    pending_seen_at = queued.get("pending_seen_at")
+    if pending_seen_at is None or now - pending_seen_at > MAX_LATENCY_POLL_GAP:
+        return
+    latency = now - queued["requested_at"]
+    if latency > 0:
+        st.session_state.download_latency = _ewma(st.session_state.get("download_latency"), latency)
 
-    if job_id in st.session_state.jobs_queued.keys():
-        # if _dt.datetime.now() - st.session_state.jobs_queued[job_id] < _dt.timedelta(hours=1):
-            # print("already queued this session")
+def request_job_download(job_id, tenant, base_url=ATTACHMENT_DOWNLOADER_URL, force_refresh=False, priority=False):
+    # print(f'requested job download for {job_id}...')
+    queued = st.session_state.jobs_queued.get(job_id)
+    if queued is not None and (queued["priority"] or queued["ready_seen"] or not priority):
         return
+    # Not requested yet, or still waiting on the lookahead queue, which may be backed up behind other jobs.
 
     url = base_url + '/tasks/process-job'
-    tasks.create_task(url, job_id, tenant, force_refresh)
-
-    st.session_state.jobs_queued[job_id] = _dt.datetime.now()
+    queue = PRIORITY_QUEUE if priority else LOOKAHEAD_QUEUE
+    task_name = tasks.create_task(url, job_id, tenant, force_refresh, queue=queue)
+
+    st.session_state.jobs_queued[job_id] = {
+        "requested_at": time.time(),
+        "task_name": task_name,
+        "priority": priority,
+        "ready_seen": False,
+    }
     # print(f'finished job download for {job_id}')
     return 
 
+def drop_stale_prefetches(keep_ids: Set[str]) -> None:
+    """Delete lookahead tasks still waiting in the queue for jobs outside ``keep_ids``,
+    so they don't hold up the jobs the reviewer is now heading for.
+
+    Dropped jobs are removed from ``jobs_queued`` so they get requested again
+    if the reviewer comes back to them. Tasks that have already been
+    dispatched are left to finish.
+    """
+    for job_id, queued in list(st.session_state.jobs_queued.items()):
+        if job_id in keep_ids or queued["priority"] or queued["ready_seen"] or queued["task_name"] is None:
+            continue
+        if tasks.delete_task(queued["task_name"]):
+            del st.session_state.jobs_queued[job_id]
+        else:
+            queued["task_name"] = None # already dispatched, don't try again
+
 def schedule_prefetches(client: ServiceTitanClient, downloader_url=ATTACHMENT_DOWNLOADER_URL) -> None:
-    """Ensure up to three jobs (current and next two) are prefetched.
+    """Request attachment downloads for the current job and the lookahead window.
 
-    For the current job index ``i``, this function schedules
-    prefetches for jobs at ``i``, ``i+1``, and ``i+2``.  Already
-    completed downloads are not rescheduled.  Existing futures are
-    left to finish.
+    The current job goes on the priority queue and the rest of the window on
+    the lookahead queue, all straight away so they're ready before the
+    reviewer gets there. Jobs already requested aren't requested again, so a
+    Next/Prev click only creates a task for the job that just came into the
+    window. A job first requested as lookahead is requested again on the
+    priority queue once the reviewer reaches it.
+
+    After a jump or a refilter, lookahead tasks for jobs outside the new window
+    that are still waiting in the queue are deleted.
     """
     jobs = st.session_state.jobs
     if not jobs:
         return
     current = st.session_state.current_index
-    end = min(current+5, len(jobs))
-    for i in range(current, end):
-        job_id = str(jobs[i].get("id"))
-        # executor = ThreadPoolExecutor(max_workers=5)
-        # future = executor.submit(request_job_download, job_id, st.session_state.current_tenant, downloader_url)
-        request_job_download(job_id, st.session_state.current_tenant, downloader_url)
+    last_index = st.session_state.get("last_nav_index")
+    jumped = last_index is None or abs(current - last_index) > 1
+    record_navigation()
+    end = min(current+get_lookahead(), len(jobs))
+    window_ids = [str(jobs[i].get("id")) for i in range(current, end)]
+    if jumped:
+        drop_stale_prefetches(set(window_ids))
+    for offset, job_id in enumerate(window_ids):
+        request_job_download(job_id, st.session_state.current_tenant, downloader_url, priority=offset == 0)
     return
-        # Skip if already prefetched or scheduled
-        # if job_id in st.session_state.prefetched or job_id in st.session_state.prefetch_futures:
-        #     continue
-        # # Schedule a background download
-        # st.session_state.prefetch_futures[job_id] = future
 
 # @st.cache_data(show_spinner=False)
 def fetch_invoices(
@@ -304,6 +429,17 @@ def fetch_tag_types(client: ServiceTitanClient):
     url = client.build_url('settings', 'tag-types')
     return client.get_all(url)
 
+def _status_from_rows(rows: List[Dict[str, Any]]):
+    try:
+        if len(rows) == 0:
+            return 0, "", None
+        if len(rows) > 1:
+            return -1, rows[0]['error_msg'], None
+        else:
+            return rows[0]['status'], rows[0].get('error_msg'), rows[0].get('last_update')
+    except KeyError:
+        return None, None, None
+
 def get_job_status(job_id: int, client: Client, tenant: str):
     """
     Return one of: {-1,0,1,2} representing 'error', 'pending', 'processing', 'processed', respectively or None if record doesn't exist.
@@ -315,15 +451,25 @@ def get_job_status(job_id: int, client: Client, tenant: str):
         # .eq("tenant", tenant)
         .execute()
     )
-    try:
-        if len(response.data) == 0:
-            return 0, "", None
-        if len(response.data) > 1:
-            return -1, response.data[0]['error_msg'], None
-        else:
-            return response.data[0]['status'], response.data[0].get('error_msg'), response.data[0].get('last_update')
-    except KeyError:
-        return None, None, None
+    return _status_from_rows(response.data)
+
+def get_job_statuses(job_ids: List, client: Client, tenant: str) -> Dict[str, Tuple]:
+    """
+    Batched version of get_job_status. Returns a dict of job id (as str) to (status, error_msg, last_update).
+    """
+    if not job_ids:
+        return {}
+    response = (
+        client.table("gcs_job_attachment_status")
+        .select("job_id, status, error_msg, last_update")
+        .in_("job_id", [int(job_id) for job_id in job_ids])
+        # .eq("tenant", tenant)
+        .execute()
+    )
+    rows_by_job: Dict[str, List[Dict[str, Any]]] = {}
+    for row in response.data:
+        rows_by_job.setdefault(str(row['job_id']), []).append(row)
+    return {str(job_id): _status_from_rows(rows_by_job.get(str(job_id), [])) for job_id in job_ids}
 
 def get_attachments_supabase(job_id: int, client: Client, tenant: str):
     response = (
@@ -335,3 +481,77 @@ def get_attachments_supabase(job_id: int, client: Client, tenant: str):
     )
     return response.data
 
+def get_attachments_supabase_batch(job_ids: List, client: Client, tenant: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Batched version of get_attachments_supabase. Returns a dict of job id (as str) to its attachment rows.
+    """
+    if not job_ids:
+        return {}
+    response = (
+        client.table("gcs_attachments")
+        .select("job_id,type,url,file_date,file_by,file_name")
+        .in_("job_id", [int(job_id) for job_id in job_ids])
+        # .eq("tenant", tenant)
+        .execute()
+    )
+    attachments: Dict[str, List[Dict[str, Any]]] = {str(job_id): [] for job_id in job_ids}
+    for row in response.data:
+        attachments.setdefault(str(row['job_id']), []).append(row)
+    return attachments
+
+def _cache_fresh(entry, now: float) -> bool:
+    return entry is not None and entry[0] > now
+
+def refresh_status_window(job_id, client: Client, tenant: str) -> None:
+    """Refresh cached attachment statuses (and attachments of ready jobs) for
+    ``job_id`` and the jobs in the prefetch window after the current index.
+
+    Only stale entries are queried, in one ``in_`` query per table. Ready jobs
+    are cached for ``READY_CACHE_TTL``, others for ``STATUS_CACHE_TTL`` so
+    polling still picks up downloads finishing.
+    """
+    status_cache = st.session_state.setdefault("job_status_cache", {})
+    attachments_cache = st.session_state.setdefault("job_attachments_cache", {})
+    now = time.time()
+
+    jobs = st.session_state.get("jobs") or []
+    current = st.session_state.get("current_index", 0)
+    window_ids = [str(job_id)] + [str(job.get("id")) for job in jobs[current:current+get_lookahead()]]
+    window_ids = list(dict.fromkeys(window_ids))
+
+    stale_ids = [j for j in window_ids if not _cache_fresh(status_cache.get(j), now)]
+    if stale_ids:
+        for j, status in get_job_statuses(stale_ids, client, tenant).items():
+            record_download_status(j, status[0] == 2)
+            ttl = READY_CACHE_TTL if status[0] == 2 else STATUS_CACHE_TTL
+            status_cache[j] = (now + ttl, status)
+
+    ready_ids = [
+        j for j in window_ids
+        if status_cache[j][1][0] == 2 and not _cache_fresh(attachments_cache.get(j), now)
+    ]
+    if ready_ids:
+        for j, attachments in get_attachments_supabase_batch(ready_ids, client, tenant).items():
+            attachments_cache[j] = (now + READY_CACHE_TTL, attachments)
+
+def get_job_status_cached(job_id, client: Client, tenant: str):
+    """Same return values as get_job_status, served from the session cache."""
+    refresh_status_window(job_id, client, tenant)
+    return st.session_state.job_status_cache[str(job_id)][1]
+
+def get_attachments_cached(job_id, client: Client, tenant: str):
+    """Same return values as get_attachments_supabase, served from the session cache."""
+    refresh_status_window(job_id, client, tenant)
+    entry = st.session_state.job_attachments_cache.get(str(job_id))
+    if entry is None:
+        return get_attachments_supabase(job_id, client, tenant)
+    return entry[1]
+
+def clear_status_cache(job_id=None) -> None:
+    """Drop cached status/attachments for ``job_id``, or for every job if not given."""
+    if job_id is None:
+        st.session_state.job_status_cache = {}
+        st.session_state.job_attachments_cache = {}
+        return
+    st.session_state.get("job_status_cache", {}).pop(str(job_id), None)
+    st.session_state.get("job_attachments_cache", {}).pop(str(job_id), None)
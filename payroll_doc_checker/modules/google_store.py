@@ -1,4 +1,8 @@
+import copy
 import json
+import threading
+import time
+from functools import lru_cache
 import yaml
 from google.cloud import storage
 from typing import Optional
@@ -16,6 +20,14 @@ def is_running_in_cloud_run():
     """Checks if the application is running in Google Cloud Run."""
     return bool(os.environ.get('K_SERVICE'))
 
+# Config blobs (auth YAML) are cached process-wide and only revalidated against GCS after this long.
+# Revalidating is one metadata request; the blob is only downloaded again if its generation changed.
+CONFIG_TTL = int(os.environ.get("CONFIG_CACHE_TTL", 60)) # seconds
+
+_config_cache = {} # blob name -> (generation, checked_at, parsed data)
+_config_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
 def _get_bucket():
     client = storage.Client()
     return client.bucket(BUCKET_NAME)
@@ -40,17 +52,42 @@ def save_file(json_dict: dict, blobname):
         content_type="application/json"
     )
 
-def load_yaml_from_gcs(blob_name):
-    """Load YAML config from GCS"""
+def save_bytes(data: bytes, blobname, content_type="application/octet-stream"):
+    """Save raw bytes (e.g. a zip or workbook) to GCS."""
     bucket = _get_bucket()
-    blob = bucket.blob(blob_name)
+    blob = bucket.blob(blobname)
+    blob.upload_from_string(data, content_type=content_type)
 
-    if not blob.exists():
-        return {}  
+def list_blob_names(prefix):
+    return [blob.name for blob in _get_bucket().list_blobs(prefix=prefix)]
 
-    data = blob.download_as_text()
+def delete_blob(blobname):
+    _get_bucket().blob(blobname).delete()
 
-    return yaml.safe_load(data)
+def load_yaml_from_gcs(blob_name, ttl=CONFIG_TTL):
+    """
+    Load YAML config from GCS, cached per process.
+
+    Returns a copy each call, since callers (e.g. streamlit_authenticator) modify the config in place.
+    """
+    now = time.monotonic()
+    with _config_lock:
+        cached = _config_cache.get(blob_name)
+    if cached is not None and now - cached[1] < ttl:
+        return copy.deepcopy(cached[2])
+
+    blob = _get_bucket().get_blob(blob_name)
+    if blob is None:
+        generation, data = 0, {}
+    elif cached is not None and cached[0] == blob.generation:
+        generation, data = cached[0], cached[2]
+    else:
+        generation = blob.generation
+        data = yaml.safe_load(blob.download_as_text(if_generation_match=generation))
+
+    with _config_lock:
+        _config_cache[blob_name] = (generation, now, data)
+    return copy.deepcopy(data)
 
 def save_yaml_to_gcs(data, blobname):
     """Save YAML config back to GCS."""
@@ -59,6 +96,8 @@ def save_yaml_to_gcs(data, blobname):
     bucket = _get_bucket()
     blob = bucket.blob(blobname)
     blob.upload_from_string(yaml_text, content_type="text/yaml")
+    with _config_lock:
+        _config_cache[blobname] = (blob.generation, time.monotonic(), copy.deepcopy(data))
 
 def upload_bytes_to_gcs_signed(
     data: bytes,
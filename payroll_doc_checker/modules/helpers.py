@@ -7,15 +7,18 @@ from google.cloud import secretmanager
 from supabase import create_client, Client
 
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 
 from servicetitan_api_client import ServiceTitanClient
 import modules.google_store as gs
+import modules.st_fixtures as st_fixtures
 import modules.formatting as format
 import modules.fetching as fetch
 from bidict import bidict
 
 satisfactory_check_code = 'ds' # ALSO IN templates.py
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+DEFAULT_JOB_PAGE_SIZE = 25 # Number of jobs enriched with invoice/payment data at a time
 
 def flatten_list(nested_list):
     return [item for sublist in nested_list for item in sublist]
@@ -63,6 +66,7 @@ def state_codes():
     return codes
 
 def get_client(tenant) -> ServiceTitanClient:
+    st_fixtures.install() # no-op unless ST_FIXTURE_MODE is set
     @st.cache_resource(show_spinner=False)
     def _create_client(tenant) -> ServiceTitanClient:
             # state_code = state_codes()[state]
@@ -218,7 +222,7 @@ def fetch_jobs_button_call_lite(tenant_filter, job_id):
         st.session_state.jobs = [job] # Put in as list to keep consistent when calling from ss.jobs in main page.
         st.rerun()
 
-def fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filter, filter_unsuccessful, doc_check_status_filter, custom_job_id=None, doc_check_filters=None, exdata_key="docchecks_live", max_jobs_shown=200):
+def fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filter, filter_unsuccessful, doc_check_status_filter, custom_job_id=None, doc_check_filters=None, exdata_key="docchecks_live", page_size=DEFAULT_JOB_PAGE_SIZE):
     with st.spinner("Retrieving jobs..."):
         st.session_state.current_tenant_full = tenant_filter
         tenant_filter = tenant_filter.split(" ")[0].lower()
@@ -236,9 +240,9 @@ def fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filte
             st.session_state.employee_lists[tenant_filter] = get_all_employee_ids(client)
 
         if custom_job_id:
-            jobs = fetch.fetch_jobs(start_date, end_date, client, custom_job_id)
+            jobs = fetch.fetch_jobs(start_date, end_date, client, custom_job_id, with_appts=False)
         else:
-            jobs = fetch.fetch_jobs(start_date, end_date, client, status_filters=job_status_filter)
+            jobs = fetch.fetch_jobs(start_date, end_date, client, status_filters=job_status_filter, with_appts=False)
             if filter_unsuccessful:
                 jobs = filter_out_unsuccessful_jobs(jobs, client)
             jobs = filter_out_less_than_100dollar_jobs(jobs)
@@ -316,28 +320,76 @@ def fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filte
             jobs = filtered_jobs.copy()
             del filtered_jobs
 
-        # Hard cap the number of jobs shown in case things get crazy
-        num_jobs = len(jobs)
-        st.session_state.current_num_jobs = num_jobs
-        st.session_state.max_jobs_shown = max_jobs_shown
-        if num_jobs > max_jobs_shown:
-            jobs = jobs[:max_jobs_shown]
-
-        invoice_ids = format.get_invoice_ids(jobs)
-        invoices = fetch.fetch_invoices(invoice_ids, client)
-        payments = fetch.fetch_payments(invoice_ids, client)
-
-        invoices = {invoice['id']: format.format_invoice(invoice) for invoice in invoices}
-        payments = format.format_payments(payments)
-        # payments = flatten_list([format.format_invoice(payment) for payment in payments])
-
-        jobs = format.combine_job_data(jobs, invoices, payments)
+        # Jobs are enriched (appointments, invoices, payments) a page at a time as the reviewer gets to them, see ensure_job_page_loaded.
+        st.session_state.current_num_jobs = len(jobs)
+        st.session_state.job_page_size = page_size
+        st.session_state.job_pages_loaded = set()
+        st.session_state.job_page_futures = {}
+        fetch.clear_status_cache()
 
         st.session_state.jobs = jobs
         st.session_state.current_index = 0
+        st.session_state.last_nav_index = None
         st.session_state.prefetched = {}
         # st.session_state.prefetch_futures = {}
+        ensure_job_page_loaded(0, client)
         # Kick off prefetch for the first three jobs
         fetch.schedule_prefetches(client)
         # Trigger an immediate rerun to process any completed futures
-        st.rerun()
\ No newline at end of file
+        st.rerun()
+
+@st.cache_resource(show_spinner=False)
+def _get_page_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+def _store_job_page(page: int, enriched_jobs: List[Dict[str, Any]]) -> None:
+    start = page * st.session_state.job_page_size
+    st.session_state.jobs[start:start + len(enriched_jobs)] = enriched_jobs
+    st.session_state.job_pages_loaded.add(page)
+
+def process_completed_job_pages() -> None:
+    """Move any finished background page enrichments into ``st.session_state.jobs``."""
+    futures = st.session_state.get("job_page_futures", {})
+    for page, fut in list(futures.items()):
+        if not fut.done():
+            continue
+        del futures[page]
+        try:
+            _store_job_page(page, fut.result())
+        except Exception as e:
+            # Page will be enriched synchronously when the reviewer gets to it
+            print(f"ERROR: prefetching job page {page} ({e})")
+
+def ensure_job_page_loaded(index: int, client: ServiceTitanClient) -> None:
+    """Make sure the page containing job ``index`` is enriched, and prefetch the next page.
+
+    Pages already being prefetched in the background are waited on rather
+    than fetched a second time.
+    """
+    jobs = st.session_state.jobs
+    if not jobs:
+        return
+    page_size = st.session_state.get("job_page_size", DEFAULT_JOB_PAGE_SIZE)
+    page = index // page_size
+
+    process_completed_job_pages()
+    if page not in st.session_state.job_pages_loaded:
+        fut = st.session_state.job_page_futures.pop(page, None)
+        enriched = None
+        if fut is not None:
+            try:
+                enriched = fut.result()
+            except Exception as e:
+                print(f"ERROR: prefetching job page {page} ({e}), enriching it now")
+        if enriched is None:
+            enriched = fetch.enrich_jobs(jobs[page * page_size:(page + 1) * page_size], client)
+        _store_job_page(page, enriched)
+
+    next_page = page + 1
+    if (
+        next_page * page_size < len(jobs)
+        and next_page not in st.session_state.job_pages_loaded
+        and next_page not in st.session_state.job_page_futures
+    ):
+        page_jobs = jobs[next_page * page_size:(next_page + 1) * page_size]
+        st.session_state.job_page_futures[next_page] = _get_page_executor().submit(fetch.enrich_jobs, page_jobs, client)
@@ -0,0 +1,217 @@
+"""
+Record ServiceTitan API responses to fixture files and replay them from a local server.
+
+Recording and replay hook into `requests`, so they work the same for ServiceTitanClient and
+servicepytan. Set environment variables before starting an app, e.g. the commission exporter:
+
+    ST_FIXTURE_MODE=record ST_FIXTURE_DIR=fixtures/week42 streamlit run "Commission Exporter.py"
+
+then run the same export again offline against the replay server:
+
+    python -m modules.st_fixtures serve --dir fixtures/week42 --latency 0.3 --page-size 50
+    ST_FIXTURE_MODE=replay streamlit run "Commission Exporter.py"
+
+Each recorded page is one gzipped JSON file. The replay server joins the pages back together and
+re-paginates them at whatever page size is requested (or forced with --page-size), so the client's
+paging loop runs the same way it does against the live API.
+
+Copied into each app's modules/; keep the copies identical (tests/test_shared_copies.py checks).
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Optional, Any
+from urllib.parse import urlsplit, urlunsplit, parse_qsl
+
+import requests
+
+FIXTURE_MODE = os.environ.get("ST_FIXTURE_MODE", "") # "record", "replay" or empty for live
+FIXTURE_DIR = os.environ.get("ST_FIXTURE_DIR", "st_fixtures")
+REPLAY_URL = os.environ.get("ST_REPLAY_URL", "http://127.0.0.1:8799")
+
+ST_HOST_SUFFIX = "servicetitan.io"
+PAGING_PARAMS = {"page", "pageSize"}
+
+_install_lock = threading.Lock()
+_installed = False
+
+def fixture_key(method: str, path: str, query: str) -> str:
+    """Identifies a request independent of paging, so pages recorded at one size can be served at another."""
+    params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in PAGING_PARAMS)
+    raw = json.dumps([method.upper(), path, params])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def _page_of(query: str) -> int:
+    return int(dict(parse_qsl(query)).get("page", 1))
+
+def _is_servicetitan(netloc: str) -> bool:
+    return netloc.split(":")[0].endswith(ST_HOST_SUFFIX)
+
+def _is_auth(path: str) -> bool:
+    return path.rstrip("/").endswith("/connect/token")
+
+# -------------------------------------------------------------------
+# RECORD / REDIRECT HOOK
+# -------------------------------------------------------------------
+
+def _record(request: requests.PreparedRequest, response: requests.Response, fixture_dir: str) -> None:
+    parts = urlsplit(request.url)
+    if not response.ok or _is_auth(parts.path):
+        return
+    entry = {
+        "method": request.method,
+        "path": parts.path,
+        "query": parts.query,
+        "status": response.status_code,
+        "content_type": response.headers.get("Content-Type", ""),
+    }
+    try:
+        entry["json"] = response.json()
+    except ValueError:
+        entry["body_b64"] = base64.b64encode(response.content).decode()
+    key = fixture_key(request.method, parts.path, parts.query)
+    os.makedirs(fixture_dir, exist_ok=True)
+    with gzip.open(os.path.join(fixture_dir, f"{key}_{_page_of(parts.query):05d}.json.gz"), "wt") as f:
+        json.dump(entry, f)
+
+def install(mode: str = FIXTURE_MODE, fixture_dir: str = FIXTURE_DIR, replay_url: str = REPLAY_URL) -> None:
+    """
+    Patch requests once per process. "record" saves every ServiceTitan response, "replay" sends
+    ServiceTitan requests to the replay server instead. Anything else leaves requests untouched.
+    """
+    global _installed
+    if mode not in ("record", "replay"):
+        return
+    with _install_lock:
+        if _installed:
+            return
+        original_send = requests.Session.send
+        replay = urlsplit(replay_url)
+
+        def send(self, request, **kwargs):
+            parts = urlsplit(request.url)
+            if not _is_servicetitan(parts.netloc):
+                return original_send(self, request, **kwargs)
+            if mode == "replay":
+                request.url = urlunsplit((replay.scheme, replay.netloc, parts.path, parts.query, ""))
+                return original_send(self, request, **kwargs)
+            response = original_send(self, request, **kwargs)
+            try:
+                _record(request, response, fixture_dir)
+            except Exception as e:
+                print(f"ERROR: couldn't record {parts.path}: {e}")
+            return response
+
+        requests.Session.send = send
+        _installed = True
+        print(f"ServiceTitan fixtures: {mode} ({fixture_dir if mode == 'record' else replay_url})")
+
+# -------------------------------------------------------------------
+# REPLAY SERVER
+# -------------------------------------------------------------------
+
+class FixtureStore:
+    """Recorded responses grouped by fixture key, with paginated ones joined into a single list."""
+
+    def __init__(self, fixture_dir: str):
+        pages: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        for name in os.listdir(fixture_dir):
+            if not name.endswith(".json.gz"):
+                continue
+            key, page = name[:-len(".json.gz")].rsplit("_", 1)
+            with gzip.open(os.path.join(fixture_dir, name), "rt") as f:
+                pages.setdefault(key, {})[int(page)] = json.load(f)
+
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        for key, by_page in pages.items():
+            first = by_page[min(by_page)]
+            body = first.get("json")
+            if isinstance(body, dict) and isinstance(body.get("data"), list) and "page" in body:
+                rows: List[Any] = []
+                for page in sorted(by_page):
+                    rows.extend(by_page[page]["json"]["data"])
+                self.entries[key] = {"paged": True, "rows": rows, "page_size": len(body["data"]) or 50, "extra": {k: v for k, v in body.items() if k not in ("data", "hasMore", "page", "pageSize", "totalCount")}}
+            else:
+                self.entries[key] = {"paged": False, "entry": first}
+
+    def lookup(self, method: str, path: str, query: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(fixture_key(method, path, query))
+
+def make_handler(store: FixtureStore, latency: float, forced_page_size: Optional[int]):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status: int, data: Any):
+            self._send(status, json.dumps(data).encode())
+
+        def _handle(self):
+            parts = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            if _is_auth(parts.path):
+                return self._send_json(200, {"access_token": "replay", "token_type": "Bearer", "expires_in": 900})
+            if latency:
+                time.sleep(latency)
+
+            found = store.lookup(self.command, parts.path, parts.query)
+            if found is None:
+                print(f"MISS {self.command} {self.path}")
+                return self._send_json(404, {"title": "No fixture recorded for this request", "path": self.path})
+            if not found["paged"]:
+                entry = found["entry"]
+                if "json" in entry:
+                    return self._send_json(entry["status"], entry["json"])
+                return self._send(entry["status"], base64.b64decode(entry["body_b64"]), entry["content_type"] or "application/octet-stream")
+
+            query = dict(parse_qsl(parts.query))
+            page = int(query.get("page", 1))
+            page_size = forced_page_size or int(query.get("pageSize", found["page_size"]))
+            rows = found["rows"]
+            start = (page - 1) * page_size
+            self._send_json(200, {
+                "page": page,
+                "pageSize": page_size,
+                "totalCount": len(rows),
+                "hasMore": start + page_size < len(rows),
+                "data": rows[start:start + page_size],
+                **found["extra"],
+            })
+
+        do_GET = _handle
+        do_POST = _handle
+        do_PATCH = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+def serve(fixture_dir: str, port: int = 8799, latency: float = 0.0, page_size: Optional[int] = None) -> None:
+    store = FixtureStore(fixture_dir)
+    print(f"Serving {len(store.entries)} recorded requests from {fixture_dir} on port {port}")
+    ThreadingHTTPServer(("127.0.0.1", port), make_handler(store, latency, page_size)).serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded ServiceTitan responses.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve")
+    serve_parser.add_argument("--dir", default=FIXTURE_DIR, help="fixture directory written in record mode")
+    serve_parser.add_argument("--port", type=int, default=8799)
+    serve_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    serve_parser.add_argument("--page-size", type=int, default=None, help="force this page size instead of the requested one")
+    args = parser.parse_args()
+    serve(args.dir, args.port, args.latency, args.page_size)
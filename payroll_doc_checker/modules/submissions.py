@@ -0,0 +1,255 @@
+"""
+Doc check submissions, sent to ServiceTitan in the background so the reviewer can move straight on.
+
+Submitting saves the job's PATCH to GCS, then adds it to a SQLite queue on the instance and returns.
+A background thread sends queued submissions, retrying failures with exponential backoff, and the
+form shows anything still pending or failed. The GCS copy is deleted once the PATCH has gone through:
+
+    doc_check_submissions/<tenant>/<job_id>.json
+
+The SQLite queue is on the instance's local disk, which on Cloud Run is in memory and goes when the
+instance does. GCS is what makes a submission durable: every instance's worker periodically picks up
+submissions that have been in GCS for RECOVER_AFTER, e.g. from an instance that shut down before
+sending them, and sends them itself. Only the latest submission per job is kept, in both places, and
+a submission is only sent while it's still the one in GCS, so an older one never overwrites a newer.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional, Any
+
+import streamlit as st
+
+from servicetitan_api_client import ServiceTitanClient
+import modules.google_store as gs
+import modules.helpers as helpers
+
+logger = logging.getLogger(__name__)
+
+# Only the latest submission per job is kept, so re-submitting a job before it's flushed just replaces it.
+QUEUE_DB_PATH = os.environ.get("DOC_CHECK_QUEUE_DB", "/tmp/doc_check_submissions.db")
+SUBMISSIONS_PREFIX = os.environ.get("DOC_CHECK_SUBMISSIONS_PREFIX", "doc_check_submissions")
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2 # seconds, doubled on each failed attempt
+POLL_INTERVAL = 1 # seconds between queue checks when idle
+RECOVER_INTERVAL = 5 * 60 # seconds between checks of GCS for submissions no instance has sent
+RECOVER_AFTER = 10 * 60 # seconds a submission stays in GCS before another instance takes it on
+
+STATUS_PENDING = 'pending'
+STATUS_FAILED = 'failed'
+STATUS_DONE = 'done'
+
+# ServiceTitan clients registered from the script thread, so the worker doesn't need to rebuild them.
+_clients: Dict[str, ServiceTitanClient] = {}
+_wake = threading.Event()
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(QUEUE_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS submissions (
+            tenant TEXT NOT NULL,
+            job_id INTEGER NOT NULL,
+            patch_url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            submission_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (tenant, job_id)
+        )
+        """
+    )
+    return conn
+
+@contextmanager
+def _db():
+    """A connection that commits (or rolls back) and closes at the end of the block."""
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _blob(tenant: str, job_id: int) -> str:
+    return f"{SUBMISSIONS_PREFIX}/{tenant}/{int(job_id)}.json"
+
+def _queue(conn: sqlite3.Connection, tenant: str, job_id: int, patch_url: str, payload: Dict[str, Any], submission_id: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO submissions (tenant, job_id, patch_url, payload, submission_id, status, version, attempts, next_attempt_at, last_error, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 1, 0, 0, NULL, ?)
+        ON CONFLICT (tenant, job_id) DO UPDATE SET
+            patch_url = excluded.patch_url,
+            payload = excluded.payload,
+            submission_id = excluded.submission_id,
+            status = excluded.status,
+            version = submissions.version + 1,
+            attempts = 0,
+            next_attempt_at = 0,
+            last_error = NULL,
+            updated_at = excluded.updated_at
+        """,
+        (tenant, int(job_id), patch_url, json.dumps(payload), submission_id, STATUS_PENDING, time.time()),
+    )
+
+def enqueue(tenant: str, job_id: int, patch_url: str, payload: Dict[str, Any], client: ServiceTitanClient) -> None:
+    """
+    Save a job PATCH to GCS and queue it. Replaces any unsent submission for the same job.
+    Raises if it couldn't be saved, in which case it isn't queued either.
+    """
+    _clients[tenant] = client
+    submission_id = uuid.uuid4().hex
+    gs.save_file({
+        'tenant': tenant,
+        'job_id': int(job_id),
+        'patch_url': patch_url,
+        'payload': payload,
+        'submission_id': submission_id,
+        'submitted_at': time.time(),
+    }, _blob(tenant, job_id))
+    with _db() as conn:
+        _queue(conn, tenant, job_id, patch_url, payload, submission_id)
+    _wake.set()
+
+def get_status(tenant: str, job_id: int) -> Tuple[Optional[str], Optional[str]]:
+    """Return (status, last_error) for a job's latest submission, or (None, None) if never submitted."""
+    with _db() as conn:
+        row = conn.execute(
+            "SELECT status, last_error FROM submissions WHERE tenant = ? AND job_id = ?",
+            (tenant, int(job_id)),
+        ).fetchone()
+    if row is None:
+        return None, None
+    return row['status'], row['last_error']
+
+def get_unsent(tenant: str) -> List[Dict[str, Any]]:
+    """Return pending and failed submissions for a tenant."""
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT job_id, status, attempts, last_error FROM submissions WHERE tenant = ? AND status != ? ORDER BY updated_at",
+            (tenant, STATUS_DONE),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def retry_failed(tenant: str) -> None:
+    with _db() as conn:
+        conn.execute(
+            "UPDATE submissions SET status = ?, attempts = 0, next_attempt_at = 0 WHERE tenant = ? AND status = ?",
+            (STATUS_PENDING, tenant, STATUS_FAILED),
+        )
+    _wake.set()
+
+def _get_client(tenant: str) -> ServiceTitanClient:
+    if tenant not in _clients:
+        # Only happens for submissions left over from a previous process
+        _clients[tenant] = helpers.get_client(tenant)
+    return _clients[tenant]
+
+def _saved_submission_id(tenant: str, job_id: int) -> Optional[str]:
+    """The id of the job's submission in GCS, or None once it's been sent."""
+    return gs.load_file(_blob(tenant, job_id)).get('submission_id')
+
+def _flush_one(row: sqlite3.Row) -> None:
+    tenant, job_id, version = row['tenant'], row['job_id'], row['version']
+    try:
+        if _saved_submission_id(tenant, job_id) != row['submission_id']:
+            # Sent by another instance, or replaced by a newer submission there
+            with _db() as conn:
+                conn.execute(
+                    "UPDATE submissions SET status = ?, last_error = NULL WHERE tenant = ? AND job_id = ? AND version = ?",
+                    (STATUS_DONE, tenant, job_id, version),
+                )
+            return
+        _get_client(tenant).patch(row['patch_url'], json=json.loads(row['payload']))
+    except Exception as e:
+        attempts = row['attempts'] + 1
+        status = STATUS_FAILED if attempts >= MAX_ATTEMPTS else STATUS_PENDING
+        logger.warning("Doc check submission for job %s failed (attempt %s): %s", job_id, attempts, e)
+        with _db() as conn:
+            conn.execute(
+                """
+                UPDATE submissions SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE tenant = ? AND job_id = ? AND version = ?
+                """,
+                (status, attempts, time.time() + RETRY_BASE_DELAY * 2 ** (attempts - 1), str(e), tenant, job_id, version),
+            )
+        return
+    with _db() as conn:
+        # Version check stops a newer submission made during the PATCH from being marked done
+        conn.execute(
+            "UPDATE submissions SET status = ?, last_error = NULL WHERE tenant = ? AND job_id = ? AND version = ?",
+            (STATUS_DONE, tenant, job_id, version),
+        )
+    try:
+        if _saved_submission_id(tenant, job_id) == row['submission_id']:
+            gs.delete_blob(_blob(tenant, job_id))
+    except Exception as e:
+        # Harmless: whoever picks it up finds it already in ServiceTitan and sends the same PATCH again
+        logger.warning("Couldn't remove sent doc check submission for job %s from GCS: %s", job_id, e)
+
+def flush_pending() -> int:
+    """Send every due pending submission. Returns the number attempted."""
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM submissions WHERE status = ? AND next_attempt_at <= ? ORDER BY updated_at",
+            (STATUS_PENDING, time.time()),
+        ).fetchall()
+    for row in rows:
+        _flush_one(row)
+    return len(rows)
+
+def recover_unsent(min_age: float = RECOVER_AFTER) -> int:
+    """
+    Queue submissions that have been in GCS for `min_age` seconds and aren't queued here, e.g. from an
+    instance that shut down before sending them. Returns the number queued.
+    """
+    recovered = 0
+    for name in gs.list_blob_names(f"{SUBMISSIONS_PREFIX}/"):
+        entry = gs.load_file(name)
+        if not entry or time.time() - entry['submitted_at'] < min_age:
+            continue
+        with _db() as conn:
+            row = conn.execute(
+                "SELECT submission_id FROM submissions WHERE tenant = ? AND job_id = ?",
+                (entry['tenant'], entry['job_id']),
+            ).fetchone()
+            if row is not None and row['submission_id'] == entry['submission_id']:
+                continue # queued here already, including ones that failed and wait for "Retry failed"
+            _queue(conn, entry['tenant'], entry['job_id'], entry['patch_url'], entry['payload'], entry['submission_id'])
+        logger.info("Recovered unsent doc check submission for job %s", entry['job_id'])
+        recovered += 1
+    return recovered
+
+def _worker_loop() -> None:
+    last_recovered = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_recovered >= RECOVER_INTERVAL:
+                last_recovered = time.monotonic()
+                recover_unsent()
+            flush_pending()
+        except Exception as e:
+            logger.exception("Doc check submission worker: %s", e)
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+
+@st.cache_resource(show_spinner=False)
+def start_worker() -> threading.Thread:
+    """Start the background flush thread, once per process."""
+    worker = threading.Thread(target=_worker_loop, name="doc-check-submissions", daemon=True)
+    worker.start()
+    return worker
@@ -1,10 +1,16 @@
 # create_task.py
 from google.cloud import tasks_v2
-import datetime
+from google.api_core.exceptions import NotFound
 import json
+import streamlit as st
+
+@st.cache_resource(show_spinner=False)
+def _get_client() -> tasks_v2.CloudTasksClient:
+    """One client per process, so navigating doesn't pay for a new gRPC channel each time."""
+    return tasks_v2.CloudTasksClient()
 
 def create_task(url, job_id, tenant, force_refresh=False, project_id='prestigious-gcp', queue='ST-attachment-download-queue', location='australia-southeast1'):
-    client = tasks_v2.CloudTasksClient()
+    client = _get_client()
     parent = client.queue_path(project_id, location, queue)
 
     # Prepare payload
@@ -31,11 +37,15 @@ def create_task(url, job_id, tenant, force_refresh=False, project_id='prestigiou
         }
     }
 
-    # if in_seconds > 0:
-    #     d = datetime.datetime.utcnow() + datetime.timedelta(seconds=in_seconds)
-    #     timestamp = timestamp_pb2.Timestamp()
-    #     timestamp.FromDatetime(d)
-    #     task["schedule_time"] = timestamp
-
     response = client.create_task(request={"parent": parent, "task": task})
     print(f"Created task: {response.name}")
+    return response.name
+
+def delete_task(task_name):
+    """Delete a task that hasn't been dispatched yet. Returns False if it's already gone (ran or was deleted)."""
+    try:
+        _get_client().delete_task(name=task_name)
+    except NotFound:
+        return False
+    print(f"Deleted task: {task_name}")
+    return True
@@ -14,6 +14,7 @@ from bidict import bidict
 
 
 import modules.fetching as fetch
+import modules.submissions as submissions
 
 
 
@@ -135,7 +136,7 @@ def sidebar_filters():
 
     # When the fetch button is pressed, call the API and reset state
     if fetch_jobs_button:
-        helpers.fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filter, filter_unsuccessful, doc_check_status_filter, custom_job_id, doc_check_filters, max_jobs_shown=200)
+        helpers.fetch_jobs_button_call(tenant_filter, start_date, end_date, job_status_filter, filter_unsuccessful, doc_check_status_filter, custom_job_id, doc_check_filters)
 
 def nav_button(dir):
     client = st.session_state.clients.get(st.session_state.current_tenant)
@@ -365,11 +366,43 @@ def doc_check_form(job_num, job, pdfs, doc_check_criteria, exdata_key='docchecks
 
             patch_url = client.build_url('jpm', 'jobs', resource_id=job['id'])
             try:
-                client.patch(patch_url, json=external_data_payload)
-                st.success("Form submitted successfully")
-
+                # Saved to GCS and sent to ServiceTitan in the background, see modules/submissions.py
+                submissions.enqueue(st.session_state.current_tenant, job['id'], patch_url, external_data_payload, client)
+                st.success("Form saved, sending to ServiceTitan...")
                 job['tmp_doccheck_bits'] = checks # add to job so that when returning to job's doc check page, they stay filled as they were. This is needed because the job data is not re-fetched on "next" or "prev" buttons.
-                    
             except Exception as e:
-                st.error(f"Failed to submit form: {e}")
+                # Couldn't be saved for the background send, so send it now
+                print(f"ERROR: queueing doc check for job {job['id']} ({e}), sending it directly")
+                try:
+                    client.patch(patch_url, json=external_data_payload)
+                    st.success("Form saved to ServiceTitan.")
+                    job['tmp_doccheck_bits'] = checks
+                except Exception as e:
+                    st.error(f"Failed to submit form: {e}")
+        else:
+            submission_status, submission_error = submissions.get_status(st.session_state.current_tenant, job['id'])
+            if submission_status == submissions.STATUS_PENDING:
+                st.info("Last submission is still being sent to ServiceTitan.")
+            elif submission_status == submissions.STATUS_FAILED:
+                st.error(f"Last submission failed to send: {submission_error}")
+
+@st.fragment(run_every=5)
+def submission_queue_status():
+    """Sidebar summary of doc check submissions not yet in ServiceTitan."""
+    tenant = st.session_state.current_tenant
+    if not tenant:
+        return
+    unsent = submissions.get_unsent(tenant)
+    pending = [s for s in unsent if s['status'] == submissions.STATUS_PENDING]
+    failed = [s for s in unsent if s['status'] == submissions.STATUS_FAILED]
+    if pending:
+        st.caption(f"Sending {len(pending)} doc check(s) to ServiceTitan. They're saved, so they'll still be sent if you close this page.")
+    if failed:
+        st.error(f"{len(failed)} doc check(s) failed to send to ServiceTitan. Check the errors below and retry them before you finish.")
+        with st.expander("Failed doc checks"):
+            for f in failed:
+                st.write(f"Job ID {f['job_id']}: {f['last_error']}")
+            if st.button("Retry failed", key="retry_failed_submissions"):
+                submissions.retry_failed(tenant)
+                st.rerun(scope="fragment")
 
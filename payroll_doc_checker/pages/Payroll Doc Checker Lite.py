@@ -17,6 +17,7 @@ import modules.helpers as helpers
 import modules.templates as templates
 import modules.fetching as fetch
 import modules.tasks as tasks
+import modules.submissions as submissions
 
 ###############################################################################
 # Filter warnings
@@ -82,8 +83,11 @@ def main() -> None:
                 st.session_state.current_tenant: str = ""
             if "app_guid" not in st.session_state:
                 st.session_state.app_guid = helpers.get_secret('st_servco_integrations_guid', project_id="prestigious-gcp")
+
+        submissions.start_worker()
             
         templates.filters_lite()
+        templates.submission_queue_status()
 
         # Display the current job if available
         if st.session_state.jobs:
@@ -0,0 +1,6 @@
+# The app imports its helpers as `modules.*` from its own folder, so put that on the path.
+# Each app has its own `modules` package: run the tests from inside the app, e.g. `python -m pytest tests`.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
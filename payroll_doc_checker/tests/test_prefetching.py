@@ -0,0 +1,95 @@
+import pytest
+
+import modules.fetching as fetch
+
+
+class SessionState(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+class FakeTasks:
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+        self.dispatched = set()
+
+    def create_task(self, url, job_id, tenant, force_refresh=False, queue=None):
+        self.created.append((job_id, queue))
+        return f"{queue}/{job_id}/{len(self.created)}"
+
+    def delete_task(self, task_name):
+        if task_name in self.dispatched:
+            return False
+        self.deleted.append(task_name)
+        return True
+
+
+@pytest.fixture
+def state(monkeypatch):
+    session = SessionState(jobs=[{"id": i} for i in range(20)], current_index=0, current_tenant="tenant", jobs_queued={})
+    monkeypatch.setattr(fetch.st, "session_state", session)
+    return session
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    fake = FakeTasks()
+    monkeypatch.setattr(fetch, "tasks", fake)
+    return fake
+
+
+def go_to(state, index):
+    state.current_index = index
+    fetch.schedule_prefetches(None)
+
+
+def test_current_job_moves_to_priority_queue(state, queue):
+    go_to(state, 0)
+    go_to(state, 1)
+
+    assert queue.created[:3] == [("0", fetch.PRIORITY_QUEUE), ("1", fetch.LOOKAHEAD_QUEUE), ("2", fetch.LOOKAHEAD_QUEUE)]
+    assert ("1", fetch.PRIORITY_QUEUE) in queue.created
+    assert state.jobs_queued["1"]["priority"]
+
+
+def test_ready_lookahead_job_is_not_requested_again(state, queue):
+    go_to(state, 0)
+    fetch.record_download_status("1", ready=True)
+    go_to(state, 1)
+
+    assert ("1", fetch.PRIORITY_QUEUE) not in queue.created
+
+
+def test_jump_drops_waiting_lookahead_tasks(state, queue):
+    go_to(state, 0)
+    queue.dispatched.add(state.jobs_queued["1"]["task_name"])
+    go_to(state, 10)
+
+    # Job 0 was on the priority queue and job 1 already started, the rest of the old window is dropped.
+    assert set(state.jobs_queued) >= {"0", "1"}
+    assert "2" not in state.jobs_queued
+    assert len(queue.deleted) == fetch.get_lookahead() - 2
+
+    queue.deleted.clear()
+    go_to(state, 11)
+    assert queue.deleted == []
+
+
+def test_download_latency_needs_a_recent_poll(state, queue, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(fetch.time, "time", lambda: clock[0])
+    go_to(state, 0)
+
+    # Lookahead job 1 last polled when requested, then seen ready after the reviewer spent a minute on job 0.
+    fetch.record_download_status("1", ready=False)
+    clock[0] += 60
+    fetch.record_download_status("1", ready=True)
+    assert "download_latency" not in state
+
+    # Current job polled every few seconds until it's ready.
+    for _ in range(3):
+        fetch.record_download_status("0", ready=False)
+        clock[0] += 5
+    fetch.record_download_status("0", ready=True)
+    assert state.download_latency == 75
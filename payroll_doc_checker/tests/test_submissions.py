@@ -0,0 +1,137 @@
+import json
+
+import pytest
+
+import modules.submissions as submissions
+
+
+class FlakyClient:
+    def __init__(self, failures):
+        self.failures = failures
+        self.patches = []
+
+    def patch(self, url, json=None):
+        self.patches.append((url, json))
+        if len(self.patches) <= self.failures:
+            raise RuntimeError("ServiceTitan is down")
+
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(submissions, "QUEUE_DB_PATH", str(tmp_path / "queue.db"))
+    monkeypatch.setattr(submissions, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(submissions, "_clients", {})
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    blobs = {}
+    monkeypatch.setattr(submissions.gs, "save_file", lambda data, name: blobs.__setitem__(name, json.dumps(data)))
+    monkeypatch.setattr(submissions.gs, "load_file", lambda name: json.loads(blobs[name]) if name in blobs else {})
+    monkeypatch.setattr(submissions.gs, "list_blob_names", lambda prefix: [name for name in blobs if name.startswith(prefix)])
+    monkeypatch.setattr(submissions.gs, "delete_blob", lambda name: blobs.pop(name))
+    return blobs
+
+
+def new_instance(tmp_path, monkeypatch, client):
+    """Start over with an empty local queue, as on another Cloud Run instance."""
+    monkeypatch.setattr(submissions, "QUEUE_DB_PATH", str(tmp_path / "other_instance.db"))
+    monkeypatch.setattr(submissions, "_clients", {"tenant": client})
+
+
+def test_failed_send_is_retried_until_it_goes_through():
+    client = FlakyClient(failures=2)
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"externalData": []}, client)
+
+    submissions.flush_pending()
+    assert submissions.get_status("tenant", 1) == (submissions.STATUS_PENDING, "ServiceTitan is down")
+    submissions.flush_pending()
+    submissions.flush_pending()
+
+    assert submissions.get_status("tenant", 1) == (submissions.STATUS_DONE, None)
+    assert len(client.patches) == 3
+    assert submissions.get_unsent("tenant") == []
+
+
+def test_gives_up_after_max_attempts_until_retried(monkeypatch):
+    monkeypatch.setattr(submissions, "MAX_ATTEMPTS", 2)
+    client = FlakyClient(failures=2)
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {}, client)
+
+    submissions.flush_pending()
+    submissions.flush_pending()
+    assert submissions.get_status("tenant", 1)[0] == submissions.STATUS_FAILED
+    assert submissions.flush_pending() == 0
+
+    submissions.retry_failed("tenant")
+    submissions.flush_pending()
+    assert submissions.get_status("tenant", 1) == (submissions.STATUS_DONE, None)
+
+
+def test_resubmitting_while_a_send_is_in_flight_keeps_the_newer_submission(monkeypatch):
+    client = FlakyClient(failures=0)
+    real_patch = client.patch
+
+    def patch_and_resubmit(url, json=None):
+        real_patch(url, json)
+        if len(client.patches) == 1:
+            submissions.enqueue("tenant", 1, url, {"newer": True}, client)
+
+    client.patch = patch_and_resubmit
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"newer": False}, client)
+
+    submissions.flush_pending()
+    assert submissions.get_status("tenant", 1)[0] == submissions.STATUS_PENDING
+    submissions.flush_pending()
+    assert client.patches[-1] == ("jpm/jobs/1", {"newer": True})
+    assert submissions.get_status("tenant", 1)[0] == submissions.STATUS_DONE
+
+
+def test_submission_is_saved_to_gcs_until_sent(store):
+    client = FlakyClient(failures=1)
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"externalData": []}, client)
+    assert list(store) == ["doc_check_submissions/tenant/1.json"]
+
+    submissions.flush_pending()
+    assert list(store) == ["doc_check_submissions/tenant/1.json"]
+    submissions.flush_pending()
+    assert store == {}
+
+
+def test_nothing_is_queued_if_it_cant_be_saved(monkeypatch):
+    def fail(data, name):
+        raise ConnectionError("GCS unavailable")
+    monkeypatch.setattr(submissions.gs, "save_file", fail)
+    with pytest.raises(ConnectionError):
+        submissions.enqueue("tenant", 1, "jpm/jobs/1", {}, FlakyClient(failures=0))
+    assert submissions.get_status("tenant", 1) == (None, None)
+
+
+def test_another_instance_sends_submissions_left_unsent(tmp_path, monkeypatch, store):
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"externalData": []}, FlakyClient(failures=0))
+    client = FlakyClient(failures=0)
+    new_instance(tmp_path, monkeypatch, client)
+
+    assert submissions.recover_unsent() == 0 # too recent, its own instance may still send it
+    assert submissions.recover_unsent(min_age=0) == 1
+    submissions.flush_pending()
+
+    assert client.patches == [("jpm/jobs/1", {"externalData": []})]
+    assert store == {}
+    assert submissions.recover_unsent(min_age=0) == 0
+
+
+def test_a_replaced_submission_is_not_sent(tmp_path, monkeypatch):
+    client = FlakyClient(failures=0)
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"newer": False}, client)
+    new_instance(tmp_path, monkeypatch, client)
+    submissions.recover_unsent(min_age=0)
+
+    monkeypatch.setattr(submissions, "QUEUE_DB_PATH", str(tmp_path / "queue.db"))
+    submissions.enqueue("tenant", 1, "jpm/jobs/1", {"newer": True}, client)
+    submissions.flush_pending()
+    monkeypatch.setattr(submissions, "QUEUE_DB_PATH", str(tmp_path / "other_instance.db"))
+    submissions.flush_pending()
+
+    assert client.patches == [("jpm/jobs/1", {"newer": True})]
+    assert submissions.get_status("tenant", 1)[0] == submissions.STATUS_DONE
@@ -0,0 +1,74 @@
+"""
+Each app is built from its own folder, so code shared between apps is copied into each app's
+modules/ rather than imported from one place. These tests fail when the copies drift apart:
+change every copy together.
+"""
+import ast
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ['app', 'commission_exporter', 'invoice_exporter', 'payroll_doc_checker']
+
+# modules that must be identical in every app that has them
+SHARED_FILES = [
+    'st_fixtures.py',
+    'profiling.py',
+]
+
+# module -> top-level functions and assignments that must match in every app that has them
+SHARED_DEFINITIONS = {
+    'google_store.py': [
+        'CONFIG_TTL', '_config_cache', '_config_lock',
+        '_get_bucket', 'load_yaml_from_gcs', 'save_yaml_to_gcs',
+        'save_bytes', # used by profiling.py
+    ],
+}
+
+
+def _copies(module):
+    paths = [os.path.join(ROOT, app, 'modules', module) for app in APPS]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def _definitions(path, names):
+    with open(path) as f:
+        source = f.read()
+    found = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            node_names = [node.name]
+        elif isinstance(node, ast.Assign):
+            node_names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+        else:
+            continue
+        for name in node_names:
+            if name in names:
+                found[name] = "\n".join(
+                    ast.get_source_segment(source, decorator) for decorator in getattr(node, 'decorator_list', [])
+                ) + ast.get_source_segment(source, node)
+    return found
+
+
+@pytest.mark.parametrize("module", SHARED_FILES)
+def test_shared_files_match(module):
+    copies = _copies(module)
+    assert len(copies) > 1
+    with open(copies[0], 'rb') as f:
+        reference = f.read()
+    for path in copies[1:]:
+        with open(path, 'rb') as f:
+            assert f.read() == reference, f"{path} differs from {copies[0]}"
+
+
+@pytest.mark.parametrize("module, names", SHARED_DEFINITIONS.items())
+def test_shared_definitions_match(module, names):
+    copies = _copies(module)
+    assert len(copies) > 1
+    reference = _definitions(copies[0], names)
+    for path in copies:
+        definitions = _definitions(path, names)
+        assert sorted(definitions) == sorted(names), f"{path} is missing some of {names}"
+        for name, source in definitions.items():
+            assert source == reference[name], f"{name} in {path} differs from {copies[0]}"